@@ -0,0 +1,156 @@
+"""
+An in-process, size-bounded read cache in front of an XBlockUserStateClient.
+"""
+
+import threading
+from collections import OrderedDict
+
+from edx_user_state_client.interface import resolve_scope
+from edx_user_state_client.wrapper import XBlockUserStateClientWrapper, project_state
+
+# Marks a key that has been looked up and found to have no stored state.
+_ABSENT = object()
+
+
+class CachedUserStateClient(XBlockUserStateClientWrapper):
+    """
+    Cache the full state of recently read blocks, evicting the least recently used
+    entries once ``max_entries`` is reached.
+
+    Reads with a ``fields`` projection are served from the cached full state. Any
+    write or delete through this client invalidates the affected entries. Writes made
+    directly against the wrapped client are not seen until the entry is evicted, so
+    give each cache its own store (see
+    :class:`~edx_user_state_client.routing.ScopeRoutingUserStateClient`).
+
+    Arguments:
+        client (XBlockUserStateClient): The client to cache reads from.
+        max_entries (int): The maximum number of (username, block_key, scope) entries to keep.
+    """
+
+    def __init__(self, client, max_entries=10000):
+        super().__init__(client)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped on every invalidation, so that a read which raced with a write
+        # doesn't put the state it fetched before the write back in the cache.
+        self._generation = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """
+        Drop every cached entry.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+
+    def _invalidate(self, username, block_keys, scope):
+        """
+        Drop the cached entries for ``block_keys``.
+        """
+        with self._lock:
+            for key in block_keys:
+                self._entries.pop((username, key, scope), None)
+            self._generation += 1
+
+    def get_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        block_keys = list(block_keys)
+        found = {}
+        misses = []
+        with self._lock:
+            for key in block_keys:
+                cache_key = (username, key, scope)
+                if cache_key in self._entries:
+                    self._entries.move_to_end(cache_key)
+                    found[key] = self._entries[cache_key]
+                elif key not in misses:
+                    misses.append(key)
+            generation = self._generation
+
+        if misses:
+            fetched = {
+                entry.block_key: entry
+                for entry in self._client.get_many(username, misses, scope)
+            }
+            with self._lock:
+                if generation == self._generation and self.max_entries > 0:
+                    for key in misses:
+                        self._entries[(username, key, scope)] = fetched.get(key, _ABSENT)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+            for key in misses:
+                found[key] = fetched.get(key, _ABSENT)
+
+        for key in block_keys:
+            entry = found[key]
+            if entry is not _ABSENT:
+                yield project_state(entry, fields)
+
+    def set_many(self, username, block_keys_to_state, scope=None):
+        scope = resolve_scope(scope)
+        try:
+            return self._client.set_many(username, block_keys_to_state, scope)
+        finally:
+            self._invalidate(username, block_keys_to_state, scope)
+
+    def set_many_if_unmodified(self, username, block_keys_to_state, expected_updated, scope=None):
+        # Invalidate on conflict too, so that the caller's re-read sees the new version.
+        scope = resolve_scope(scope)
+        try:
+            return self._client.set_many_if_unmodified(username, block_keys_to_state, expected_updated, scope)
+        finally:
+            self._invalidate(username, block_keys_to_state, scope)
+
+    def delete_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        block_keys = list(block_keys)
+        try:
+            return self._client.delete_many(username, block_keys, scope, fields=fields)
+        finally:
+            self._invalidate(username, block_keys, scope)
+
+    def bulk_load(self, entries, batch_size=1000):
+        try:
+            return self._client.bulk_load(entries, batch_size)
+        finally:
+            self.clear()
+
+    def _invalidate_matching(self, scope, matches):
+        """
+        Drop the cached entries in ``scope`` for which ``matches(username, block_key)`` is true.
+        """
+        with self._lock:
+            for cache_key in [key for key in self._entries if key[2] == scope and matches(key[0], key[1])]:
+                del self._entries[cache_key]
+            self._generation += 1
+
+    def delete_all_for_user(self, username, course_keys=None, scope=None, purge_history=False,
+                            batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        try:
+            return super().delete_all_for_user(username, course_keys, scope, purge_history, batch_size, progress)
+        finally:
+            self._invalidate_matching(scope, lambda one_username, _: one_username == username)
+
+    def delete_all_for_block(self, block_key, scope=None, purge_history=False, batch_size=1000,
+                             progress=None):
+        scope = resolve_scope(scope)
+        try:
+            return super().delete_all_for_block(block_key, scope, purge_history, batch_size, progress)
+        finally:
+            self._invalidate_matching(scope, lambda _, one_block_key: one_block_key == block_key)
+
+    def delete_all_for_course(self, course_key, block_type=None, scope=None, purge_history=False,
+                              batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        try:
+            return super().delete_all_for_course(course_key, block_type, scope, purge_history, batch_size, progress)
+        finally:
+            self._invalidate_matching(
+                scope, lambda _, block_key: getattr(block_key, 'course_key', None) == course_key
+            )
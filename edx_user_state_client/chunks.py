@@ -0,0 +1,97 @@
+"""
+Batches of XBlockUserState, as yielded by the ``iter_chunks_*`` methods of
+:class:`~edx_user_state_client.interface.XBlockUserStateClient`, either as lists
+or as parallel columns that can be handed to NumPy or pandas without building
+an object per row.
+"""
+
+from collections import namedtuple
+from itertools import islice
+
+
+class StateColumns(namedtuple('_StateColumns', ['usernames', 'block_keys', 'updated', 'fields'])):
+    """
+    A chunk of XBlockUserState as parallel lists, where the items at the same index of
+    every list come from the same XBlockUserState.
+
+    For example, to average a chunk's scores with pandas::
+
+        frame = pandas.DataFrame(columns.fields, index=columns.usernames)
+        frame['score'].mean()
+
+    Arguments:
+        usernames (list): The username of each XBlockUserState.
+        block_keys (list): The block key of each XBlockUserState.
+        updated (list): The ``updated`` :class:`datetime.datetime` of each XBlockUserState.
+        fields (dict): A map from each field name to the list of that field's values, with
+            None where a block has no value for the field.
+    """
+    __slots__ = ()
+
+
+def check_chunk_size(chunk_size):
+    """
+    Raise ValueError if ``chunk_size`` is less than 1.
+    """
+    if chunk_size < 1:
+        raise ValueError(f'chunk_size must be at least 1, not {chunk_size!r}')
+
+
+def make_chunk(entries, columnar=False, fields=None):
+    """
+    Return the list of XBlockUserState ``entries`` as a chunk.
+
+    Arguments:
+        entries (list): The XBlockUserState of the chunk.
+        columnar (bool): Whether to return a :class:`StateColumns` rather than a list.
+        fields: The fields to keep. If None, keep every stored field, and give a columnar
+            chunk a column for every field stored in any of ``entries``.
+
+    Returns:
+        A list of XBlockUserState, or a :class:`StateColumns`.
+    """
+    if not columnar:
+        if fields is None:
+            return entries
+        return [
+            entry._replace(state={field: entry.state[field] for field in fields if field in entry.state})
+            for entry in entries
+        ]
+
+    if fields is None:
+        fields = dict.fromkeys(field for entry in entries for field in entry.state)
+    states = [entry.state for entry in entries]
+    return StateColumns(
+        [entry.username for entry in entries],
+        [entry.block_key for entry in entries],
+        [entry.updated for entry in entries],
+        {field: [state.get(field) for state in states] for field in fields},
+    )
+
+
+def iter_chunks(entries, chunk_size, columnar=False, fields=None):
+    """
+    Batch the XBlockUserState of the iterable ``entries`` into chunks of at most ``chunk_size``.
+
+    Arguments:
+        entries: An iterable of XBlockUserState.
+        chunk_size (int): The most XBlockUserState in a chunk.
+        columnar (bool): Whether to yield :class:`StateColumns` rather than lists.
+        fields: The fields to keep, as for :func:`make_chunk`.
+
+    Returns:
+        An iterator of chunks made by :func:`make_chunk`.
+
+    Raises:
+        ValueError if ``chunk_size`` is less than 1.
+    """
+    check_chunk_size(chunk_size)
+    return _iter_chunks(iter(entries), chunk_size, columnar, fields)
+
+
+def _iter_chunks(entries, chunk_size, columnar, fields):
+    while True:
+        chunk = list(islice(entries, chunk_size))
+        if not chunk:
+            return
+        yield make_chunk(chunk, columnar, fields)
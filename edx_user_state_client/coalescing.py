@@ -0,0 +1,230 @@
+"""
+An XBlockUserStateClient that shares one backend read between concurrent identical
+or overlapping ``get_many`` calls.
+"""
+
+import asyncio
+import threading
+import time
+
+from edx_user_state_client.interface import resolve_scope
+from edx_user_state_client.wrapper import XBlockUserStateClientWrapper, project_state
+
+
+class _Flight():
+    """
+    One backend read, and the result that every caller waiting on it shares.
+    """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.entries = None
+        self.error = None
+
+
+class _Batch(_Flight):
+    """
+    A backend read gathering the block keys and fields of every caller that joins it.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.block_keys = {}
+        self.fields = set()
+
+    def add(self, block_keys, fields):
+        """
+        Include ``block_keys`` and ``fields`` in this batch.
+        """
+        for key in block_keys:
+            self.block_keys[key] = None
+        if fields is None or self.fields is None:
+            self.fields = None
+        else:
+            self.fields.update(fields)
+
+
+class CoalescingUserStateClient(XBlockUserStateClientWrapper):
+    """
+    Collapse concurrent ``get_many`` calls into shared backend reads (single-flight).
+
+    With ``batch_window`` 0, a call that is identical (same username, block keys,
+    scope and fields) to one already in flight waits for that call's result instead
+    of reading the backend again. With a positive ``batch_window``, the first call for
+    a (username, scope) opens a batch and waits that many seconds for other calls to
+    join it, then reads the union of their block keys and fields in one ``get_many``.
+
+    Every caller gets its own copy of each state dict. Errors from the shared read
+    are raised in every caller waiting on it. A write through this client detaches
+    the reads in flight for the users it writes, so a read made after the write
+    returns never joins a read that started before it. :meth:`get_many_async` does the same for
+    asyncio coroutines without blocking the event loop.
+
+    Arguments:
+        client (XBlockUserStateClient): The client to read from.
+        batch_window (float): How long to gather overlapping calls into one batch, in seconds.
+        executor: The :class:`concurrent.futures.Executor` that :meth:`get_many_async`
+            runs backend reads on. None uses the event loop's default executor.
+    """
+
+    def __init__(self, client, batch_window=0, executor=None):
+        super().__init__(client)
+        self.batch_window = batch_window
+        self.executor = executor
+        self._lock = threading.Lock()
+        self._flights = {}
+        self._batches = {}
+        self._async_flights = {}
+
+    def _run(self, flight, read):
+        """
+        Perform ``read`` as the leader of ``flight``, and wake every follower.
+        """
+        try:
+            flight.entries = list(read())
+        except Exception as exception:  # pylint: disable=broad-except
+            flight.error = exception
+        finally:
+            flight.done.set()
+
+    @staticmethod
+    def _wait(flight):
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.entries
+
+    def _get_identical(self, username, block_keys, scope, fields):
+        flight_key = (username, tuple(block_keys), scope, None if fields is None else tuple(fields))
+        with self._lock:
+            flight = self._flights.get(flight_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[flight_key] = _Flight()
+        if leader:
+            try:
+                self._run(flight, lambda: self._client.get_many(username, block_keys, scope, fields=fields))
+            finally:
+                with self._lock:
+                    if self._flights.get(flight_key) is flight:
+                        del self._flights[flight_key]
+        return self._wait(flight)
+
+    def _get_batched(self, username, block_keys, scope, fields):
+        batch_key = (username, scope)
+        with self._lock:
+            batch = self._batches.get(batch_key)
+            leader = batch is None
+            if leader:
+                batch = self._batches[batch_key] = _Batch()
+            batch.add(block_keys, fields)
+        if leader:
+            time.sleep(self.batch_window)
+            with self._lock:
+                if self._batches.get(batch_key) is batch:
+                    del self._batches[batch_key]
+            batch_fields = None if batch.fields is None else sorted(batch.fields)
+            self._run(batch, lambda: self._client.get_many(username, list(batch.block_keys), scope, fields=batch_fields))
+        entries = {entry.block_key: entry for entry in self._wait(batch)}
+        return [entries[key] for key in block_keys if key in entries]
+
+    def _detach(self, username=None, scope=None):
+        """
+        Stop later reads from joining the reads in flight for ``username`` and ``scope``
+        (or for every user or scope, if None), so that they read the backend afresh.
+        """
+        def matches(key_username, key_scope):
+            return (username is None or key_username == username) and (scope is None or key_scope == scope)
+
+        with self._lock:
+            for flights, username_index, scope_index in (
+                (self._flights, 0, 2), (self._batches, 0, 1), (self._async_flights, 1, 3),
+            ):
+                for key in [key for key in flights if matches(key[username_index], key[scope_index])]:
+                    del flights[key]
+
+    def _write(self, write, username=None, scope=None):
+        """
+        Call ``write()``, then detach the reads in flight that it may have made stale.
+        """
+        try:
+            return write()
+        finally:
+            self._detach(username, scope)
+
+    def set_many(self, username, block_keys_to_state, scope=None):
+        scope = resolve_scope(scope)
+        return self._write(lambda: self._client.set_many(username, block_keys_to_state, scope), username, scope)
+
+    def set_many_if_unmodified(self, username, block_keys_to_state, expected_updated, scope=None):
+        scope = resolve_scope(scope)
+        return self._write(
+            lambda: self._client.set_many_if_unmodified(username, block_keys_to_state, expected_updated, scope),
+            username,
+            scope,
+        )
+
+    def delete_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        return self._write(lambda: self._client.delete_many(username, block_keys, scope, fields=fields), username, scope)
+
+    def bulk_load(self, entries, batch_size=1000):
+        return self._write(lambda: self._client.bulk_load(entries, batch_size))
+
+    def delete_all_for_user(self, username, course_keys=None, scope=None, purge_history=False,
+                            batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        return self._write(lambda: self._client.delete_all_for_user(
+            username, course_keys, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+        ), username, scope)
+
+    def delete_all_for_block(self, block_key, scope=None, purge_history=False, batch_size=1000,
+                             progress=None):
+        scope = resolve_scope(scope)
+        return self._write(lambda: self._client.delete_all_for_block(
+            block_key, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+        ), scope=scope)
+
+    def delete_all_for_course(self, course_key, block_type=None, scope=None, purge_history=False,
+                              batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        return self._write(lambda: self._client.delete_all_for_course(
+            course_key, block_type, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+        ), scope=scope)
+
+    def get_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        block_keys = list(block_keys)
+        if self.batch_window > 0:
+            entries = self._get_batched(username, block_keys, scope, fields)
+        else:
+            entries = self._get_identical(username, block_keys, scope, fields)
+        for entry in entries:
+            yield project_state(entry, fields)
+
+    async def get_many_async(self, username, block_keys, scope=None, fields=None):
+        """
+        Coroutine version of :meth:`get_many`, returning a list of XBlockUserState.
+
+        Identical concurrent calls on one event loop share a single executor task, which
+        itself goes through the thread-level coalescing of :meth:`get_many`.
+        """
+        scope = resolve_scope(scope)
+        block_keys = list(block_keys)
+        loop = asyncio.get_running_loop()
+        flight_key = (loop, username, tuple(block_keys), scope, None if fields is None else tuple(fields))
+        with self._lock:
+            future = self._async_flights.get(flight_key)
+            leader = future is None
+            if leader:
+                future = self._async_flights[flight_key] = loop.run_in_executor(
+                    self.executor, lambda: list(self.get_many(username, block_keys, scope, fields=fields))
+                )
+        try:
+            entries = await asyncio.shield(future)
+        finally:
+            if leader:
+                with self._lock:
+                    if self._async_flights.get(flight_key) is future:
+                        del self._async_flights[flight_key]
+        return [project_state(entry, None) for entry in entries]
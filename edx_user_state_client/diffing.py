@@ -0,0 +1,75 @@
+"""
+An XBlockUserStateClient that only writes the fields that actually changed.
+"""
+
+from edx_user_state_client.interface import resolve_scope
+from edx_user_state_client.wrapper import XBlockUserStateClientWrapper
+
+
+def changed_fields(current_state, new_state):
+    """
+    Return the part of ``new_state`` that differs from ``current_state``.
+
+    Arguments:
+        current_state (dict): The stored state, or None if nothing is stored.
+        new_state (dict): The state to be overlaid on ``current_state``.
+    """
+    if current_state is None:
+        return dict(new_state)
+    return {
+        field: value
+        for field, value in new_state.items()
+        if field not in current_state or current_state[field] != value
+    }
+
+
+class DiffingUserStateClient(XBlockUserStateClientWrapper):
+    """
+    Compare each ``set_many`` with the stored state, and write only what changed.
+
+    XBlocks usually pass back their whole field dict even when one field changed.
+    This wrapper reads the current state of every block in the batch with a single
+    ``get_many``, drops fields whose value is unchanged, drops blocks with nothing left
+    to write, and skips the wrapped ``set_many`` entirely if no block changed. Backends
+    then rewrite, record history for and replicate only real changes.
+
+    The changes are written with ``set_many_if_unmodified``, conditional on the ``updated``
+    values from the comparison read. If another writer changed one of those blocks in
+    between, the delta may be stale, so the whole ``set_many`` is written unchanged
+    instead. A block whose state was already stored at the read is not written at all,
+    so the write takes effect as of the read, and a write that lands after the read wins.
+
+    The comparison read is an extra round trip, so wrap a client that caches reads
+    (for example :class:`~edx_user_state_client.cache.CachedUserStateClient`) to make
+    it cheap.
+
+    Arguments:
+        client (XBlockUserStateClient): The client to write changes to.
+    """
+
+    def set_many(self, username, block_keys_to_state, scope=None):
+        scope = resolve_scope(scope)
+        if not block_keys_to_state:
+            return
+        fields = set()
+        for state in block_keys_to_state.values():
+            fields.update(state)
+        current = {
+            entry.block_key: entry
+            for entry in self._client.get_many(username, list(block_keys_to_state), scope, fields=list(fields))
+        }
+
+        changes = {}
+        for key, state in block_keys_to_state.items():
+            entry = current.get(key)
+            delta = changed_fields(entry.state if entry else None, state)
+            if delta or entry is None:
+                changes[key] = delta
+
+        if not changes:
+            return
+        expected_updated = {key: current[key].updated if key in current else None for key in changes}
+        try:
+            self._client.set_many_if_unmodified(username, changes, expected_updated, scope)
+        except self.VersionConflict:
+            self._client.set_many(username, block_keys_to_state, scope)
@@ -0,0 +1,235 @@
+"""
+Publish the changes made through an XBlockUserStateClient to in-process subscribers,
+so that consumers such as grading or completion tracking don't have to poll the store.
+"""
+
+import logging
+import queue
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+import pytz
+
+from edx_user_state_client.interface import resolve_scope
+from edx_user_state_client.wrapper import XBlockUserStateClientWrapper
+
+log = logging.getLogger(__name__)
+
+# Put on the delivery queue to stop the delivery thread.
+_STOP = object()
+
+
+class StateChange(namedtuple('_StateChange', ['username', 'block_key', 'scope', 'fields', 'updated', 'deleted'])):
+    """
+    A change to the state of a single XBlock.
+
+    Arguments:
+        username: The username of the user whose state changed.
+        block_key: The key of the block whose state changed.
+        scope: The :class:`xblock.fields.Scope` of the state.
+        fields: A tuple of the names of the fields that were set or deleted, or None if the
+            whole block was deleted.
+        updated: A :class:`datetime.datetime` (in UTC) taken once the write returned, so the
+            change was stored at or before it.
+        deleted (bool): Whether the fields were deleted, rather than set.
+    """
+    __slots__ = ()
+
+
+class ChangePublishingUserStateClient(XBlockUserStateClientWrapper):
+    """
+    Publish a :class:`StateChange` for every block written or deleted through this client.
+
+    Subscribers are callables taking a list of :class:`StateChange`. Each write call
+    publishes the changes to all its blocks as one list, and with a ``queue_size`` the
+    changes of several writes are delivered together.
+
+    * Without a ``queue_size``, subscribers are called in the writing thread once the
+      write returns.
+    * With a ``queue_size``, the changes are put on a queue of at most that many writes,
+      and a delivery thread calls the subscribers with the changes of every waiting write,
+      until there are at least ``max_batch`` changes. A write waits while the queue is
+      full, so a slow subscriber slows writers down rather than losing changes.
+
+    Changes are only published once the write returns. A write that raised, even one
+    that may have been partly stored, publishes nothing. ``bulk_load`` doesn't publish
+    changes. The ``delete_all_*`` methods scan the blocks they delete first, but only
+    while there are subscribers. Exceptions raised by subscribers are logged, and don't
+    fail the write or stop the other subscribers.
+
+    Arguments:
+        client (XBlockUserStateClient): The client to write to.
+        queue_size (int): How many writes' changes may wait for delivery, or None to deliver
+            them in the writing thread.
+        max_batch (int): How many changes the delivery thread gathers before it stops adding
+            more writes to a delivery.
+    """
+
+    def __init__(self, client, queue_size=None, max_batch=1000):
+        super().__init__(client)
+        self.max_batch = max_batch
+        self._subscribers = ()
+        self._subscribers_lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        if queue_size is not None:
+            self._queue = queue.Queue(maxsize=queue_size)
+            self._thread = threading.Thread(target=self._deliver_queued, name='user-state-events', daemon=True)
+            self._thread.start()
+
+    def subscribe(self, subscriber):
+        """
+        Call ``subscriber`` with a list of :class:`StateChange` for the changes published from now on.
+
+        Returns ``subscriber``, so this can be used as a decorator.
+        """
+        with self._subscribers_lock:
+            self._subscribers += (subscriber,)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """
+        Stop calling ``subscriber``.
+        """
+        with self._subscribers_lock:
+            self._subscribers = tuple(one for one in self._subscribers if one != subscriber)
+
+    def flush(self):
+        """
+        Wait until every queued change has been delivered.
+        """
+        if self._queue is not None:
+            self._queue.join()
+
+    def close(self):
+        """
+        Deliver every queued change, then stop the delivery thread.
+        """
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+            self._thread = None
+
+    def _deliver(self, changes):
+        for subscriber in self._subscribers:
+            try:
+                subscriber(changes)
+            except Exception:  # pylint: disable=broad-except
+                log.exception('User state change subscriber %r failed', subscriber)
+
+    def _deliver_queued(self):
+        """
+        Deliver the queued changes, combining the changes of waiting writes up to ``max_batch``.
+        """
+        stopping = False
+        while not stopping:
+            changes = self._queue.get()
+            taken = 1
+            if changes is _STOP:
+                changes, stopping = [], True
+            else:
+                changes = list(changes)
+            while not stopping and len(changes) < self.max_batch:
+                try:
+                    more = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                taken += 1
+                if more is _STOP:
+                    stopping = True
+                else:
+                    changes.extend(more)
+            if changes:
+                self._deliver(changes)
+            for _ in range(taken):
+                self._queue.task_done()
+
+    def _publish(self, changes):
+        if not changes or not self._subscribers:
+            return
+        if self._queue is None:
+            self._deliver(changes)
+        else:
+            self._queue.put(changes)
+
+    def _publish_sets(self, username, block_keys_to_state, scope):
+        updated = datetime.now(pytz.utc)
+        self._publish([
+            StateChange(username, block_key, scope, tuple(state), updated, False)
+            for block_key, state in block_keys_to_state.items()
+        ])
+
+    def _publish_deletes(self, username, block_keys, scope, fields):
+        updated = datetime.now(pytz.utc)
+        fields = None if fields is None else tuple(fields)
+        self._publish([StateChange(username, block_key, scope, fields, updated, True) for block_key in block_keys])
+
+    def set_many(self, username, block_keys_to_state, scope=None):
+        scope = resolve_scope(scope)
+        self._client.set_many(username, block_keys_to_state, scope)
+        self._publish_sets(username, block_keys_to_state, scope)
+
+    def set_many_if_unmodified(self, username, block_keys_to_state, expected_updated, scope=None):
+        scope = resolve_scope(scope)
+        self._client.set_many_if_unmodified(username, block_keys_to_state, expected_updated, scope)
+        self._publish_sets(username, block_keys_to_state, scope)
+
+    def delete_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        block_keys = list(block_keys)
+        self._client.delete_many(username, block_keys, scope, fields=fields)
+        self._publish_deletes(username, block_keys, scope, fields)
+
+    def _delete_and_publish(self, entries, scope, delete):
+        """
+        Note the blocks of ``entries`` if there are subscribers, call ``delete()``, and then publish their deletion.
+        """
+        affected = {}
+        if self._subscribers:
+            for entry in entries:
+                affected.setdefault(entry.username, []).append(entry.block_key)
+        deleted = delete()
+        for username, block_keys in affected.items():
+            self._publish_deletes(username, block_keys, scope, None)
+        return deleted
+
+    def delete_all_for_user(self, username, course_keys=None, scope=None, purge_history=False,
+                            batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        if course_keys is None and self._subscribers:
+            raise NotImplementedError("Can't find all of a user's state to publish its deletion; pass course_keys")
+        return self._delete_and_publish(
+            (
+                entry
+                for course_key in course_keys or ()
+                for entry in self._client.iter_all_for_course(course_key, scope=scope)
+                if entry.username == username
+            ),
+            scope,
+            lambda: self._client.delete_all_for_user(
+                username, course_keys, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+            ),
+        )
+
+    def delete_all_for_block(self, block_key, scope=None, purge_history=False, batch_size=1000,
+                             progress=None):
+        scope = resolve_scope(scope)
+        return self._delete_and_publish(
+            self._client.iter_all_for_block(block_key, scope),
+            scope,
+            lambda: self._client.delete_all_for_block(
+                block_key, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+            ),
+        )
+
+    def delete_all_for_course(self, course_key, block_type=None, scope=None, purge_history=False,
+                              batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        return self._delete_and_publish(
+            self._client.iter_all_for_course(course_key, block_type, scope),
+            scope,
+            lambda: self._client.delete_all_for_course(
+                course_key, block_type, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+            ),
+        )
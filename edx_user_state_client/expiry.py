@@ -0,0 +1,404 @@
+"""
+An XBlockUserStateClient that lets fields expire, for short-lived XBlock state such
+as in-progress drafts and rate-limit counters.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+from edx_user_state_client.chunks import iter_chunks
+from edx_user_state_client.interface import resolve_scope
+from edx_user_state_client.ordering import ORDER_BY_USERNAME
+from edx_user_state_client.snapshots import ReadOnlyUserStateClient
+from edx_user_state_client.wrapper import XBlockUserStateClientWrapper
+
+log = logging.getLogger(__name__)
+
+# The expiry time of field ``name`` is stored alongside it, in the field EXPIRY_PREFIX + name.
+EXPIRY_PREFIX = '__expires__.'
+
+
+def _expiry_field(field):
+    """
+    Return the name of the field storing the expiry time of ``field``.
+    """
+    return EXPIRY_PREFIX + field
+
+
+class ExpiringFieldsUserStateClient(XBlockUserStateClientWrapper):
+    """
+    Attach an expiry time to fields written through ``set_many``.
+
+    The expiry time of each field is stored in the same state dict as the field, so
+    every process reading through this wrapper agrees on it. Reads drop expired fields
+    lazily, and a block whose fields have all expired reads as missing. Expired fields
+    are reclaimed in bulk by :meth:`sweep`, which uses a heap of the expiries set
+    through this instance, and by :meth:`sweep_course`, which scans a whole course for
+    expiries set by any process. :meth:`start_sweeper` runs :meth:`sweep` on a
+    background thread. The heap holds at most ``max_scheduled`` expiries; fields
+    written while it is full are still hidden once expired, but only reclaimed by
+    :meth:`sweep_course`.
+
+    Writing a field without a TTL deletes its stored expiry, if this instance knows of
+    it from writing or reading (with ``get_many``) the block, so writing blocks without
+    expiries costs no extra read. An expiry set by another process and not read here
+    survives such a write. Like the heap, at most ``max_scheduled`` blocks with
+    expiries are tracked.
+
+    Sweeping re-reads each field's expiry and then deletes it in a separate call, as
+    there is no conditional delete. A field rewritten between the two is deleted anyway.
+
+    Arguments:
+        client (XBlockUserStateClient): The client to store state in.
+        default_ttls (dict): Maps field names to the TTL, in seconds, used when that
+            field is written without an explicit ``ttl``.
+        clock: A function returning the current time as seconds since the epoch.
+        max_scheduled (int): The most expiries to keep in the heap used by :meth:`sweep`.
+    """
+
+    def __init__(self, client, default_ttls=None, clock=time.time, max_scheduled=100000):
+        super().__init__(client)
+        self.default_ttls = dict(default_ttls or {})
+        self.clock = clock
+        self.max_scheduled = max_scheduled
+        self._heap = []
+        self._sequence = itertools.count()
+        # Maps (username, block key, scope) to the fields known to have a stored expiry.
+        self._expiring = {}
+        # Guards both the heap and _expiring.
+        self._heap_lock = threading.Lock()
+        self._sweeper = None
+        self._stop_sweeper = threading.Event()
+
+    def _visible_state(self, state, now):
+        """
+        Return ``state`` without expiry fields and expired fields, or None if every field has expired.
+        """
+        visible = {}
+        expired = False
+        for field, value in state.items():
+            if field.startswith(EXPIRY_PREFIX):
+                continue
+            expires = state.get(_expiry_field(field))
+            if expires is not None and expires <= now:
+                expired = True
+            else:
+                visible[field] = value
+        if expired and not visible:
+            return None
+        return visible
+
+    def _visible_entries(self, entries, now=None):
+        if now is None:
+            now = self.clock()
+        for entry in entries:
+            state = self._visible_state(entry.state, now)
+            if state is not None:
+                yield entry._replace(state=state)
+
+    def _track(self, block, fields):
+        """
+        Note that ``fields`` of ``block`` (a (username, block key, scope) tuple) have stored expiries.
+        """
+        with self._heap_lock:
+            tracked = self._expiring.get(block)
+            if tracked is None:
+                if len(self._expiring) >= self.max_scheduled:
+                    return
+                tracked = self._expiring[block] = set()
+            tracked.update(fields)
+
+    def _tracking(self, entries, scope):
+        """
+        Yield ``entries``, noting the fields with stored expiries.
+        """
+        for entry in entries:
+            fields = [
+                field[len(EXPIRY_PREFIX):]
+                for field, expires in entry.state.items()
+                if field.startswith(EXPIRY_PREFIX) and expires is not None
+            ]
+            if fields:
+                self._track((entry.username, entry.block_key, scope), fields)
+            yield entry
+
+    def get_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        if fields is not None:
+            fields = list(fields) + [_expiry_field(field) for field in fields]
+        return self._visible_entries(
+            self._tracking(self._client.get_many(username, block_keys, scope, fields=fields), scope)
+        )
+
+    def _with_expiry(self, username, block_keys_to_state, scope, ttl):
+        """
+        Return ``block_keys_to_state`` with the expiry fields to write added, the heap
+        items for the expiring fields, and a dict mapping block keys to the fields written
+        without a TTL.
+        """
+        now = self.clock()
+        expiring = []
+        without_ttl = {}
+        with_expiry = {}
+        for key, state in block_keys_to_state.items():
+            state = dict(state)
+            for field in list(state):
+                if isinstance(ttl, dict):
+                    field_ttl = ttl.get(field, self.default_ttls.get(field))
+                elif ttl is not None:
+                    field_ttl = ttl
+                else:
+                    field_ttl = self.default_ttls.get(field)
+                if field_ttl is None:
+                    without_ttl.setdefault(key, []).append(field)
+                else:
+                    state[_expiry_field(field)] = now + field_ttl
+                    expiring.append((now + field_ttl, next(self._sequence), username, key, scope, field))
+            with_expiry[key] = state
+        return with_expiry, expiring, without_ttl
+
+    def _schedule(self, expiring):
+        """
+        Add ``expiring`` fields to the heap used by :meth:`sweep`, while it has room for them.
+        """
+        with self._heap_lock:
+            for item in expiring[:max(self.max_scheduled - len(self._heap), 0)]:
+                heapq.heappush(self._heap, item)
+        for _, _, username, block_key, scope, field in expiring:
+            self._track((username, block_key, scope), [field])
+
+    def _clear_expiries(self, username, scope, without_ttl):
+        """
+        Delete the known stored expiries of the fields that were written without a TTL.
+
+        Arguments:
+            without_ttl (dict): Maps block keys to the fields written without a TTL.
+        """
+        # delete_many takes one list of fields for all its block keys, so group by that.
+        batches = {}
+        with self._heap_lock:
+            for block_key, fields in without_ttl.items():
+                tracked = self._expiring.get((username, block_key, scope))
+                if not tracked:
+                    continue
+                cleared = tracked.intersection(fields)
+                if cleared:
+                    tracked.difference_update(cleared)
+                    batches.setdefault(tuple(sorted(cleared)), []).append(block_key)
+                if not tracked:
+                    del self._expiring[(username, block_key, scope)]
+        for fields, block_keys in batches.items():
+            self._client.delete_many(username, block_keys, scope, fields=[_expiry_field(field) for field in fields])
+
+    def _forget(self, username, block_keys, scope, fields):
+        """
+        Stop tracking the expiries of ``fields`` (or every field, if None) of deleted blocks.
+        """
+        with self._heap_lock:
+            for block_key in block_keys:
+                tracked = self._expiring.get((username, block_key, scope))
+                if tracked is not None and fields is not None:
+                    tracked.difference_update(fields)
+                if tracked is not None and (fields is None or not tracked):
+                    del self._expiring[(username, block_key, scope)]
+
+    def set_many(self, username, block_keys_to_state, scope=None, ttl=None):
+        """
+        Set fields for a particular XBlock, optionally expiring them.
+
+        Arguments:
+            username: The name of the user whose state should be stored
+            block_keys_to_state (dict): A dict mapping keys to state dicts, overlaid over the stored state.
+            scope (Scope): The scope to store data to, or None for ``Scope.user_state``.
+            ttl: The number of seconds until the fields written expire, or a dict mapping
+                field names to their TTL. Fields without a TTL use ``default_ttls``, and
+                otherwise never expire.
+        """
+        scope = resolve_scope(scope)
+        with_expiry, expiring, without_ttl = self._with_expiry(username, block_keys_to_state, scope, ttl)
+        self._client.set_many(username, with_expiry, scope)
+        self._schedule(expiring)
+        self._clear_expiries(username, scope, without_ttl)
+
+    def set_many_if_unmodified(self, username, block_keys_to_state, expected_updated, scope=None,
+                               ttl=None):
+        """
+        Conditionally set fields for many XBlocks, optionally expiring them.
+
+        See :meth:`~edx_user_state_client.interface.XBlockUserStateClient.set_many_if_unmodified`
+        and :meth:`set_many`.
+        """
+        scope = resolve_scope(scope)
+        with_expiry, expiring, without_ttl = self._with_expiry(username, block_keys_to_state, scope, ttl)
+        self._client.set_many_if_unmodified(username, with_expiry, expected_updated, scope)
+        self._schedule(expiring)
+        self._clear_expiries(username, scope, without_ttl)
+
+    def delete_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        block_keys = list(block_keys)
+        fields = None if fields is None else list(fields)
+        stored_fields = None if fields is None else fields + [_expiry_field(field) for field in fields]
+        self._client.delete_many(username, block_keys, scope, fields=stored_fields)
+        self._forget(username, block_keys, scope, fields)
+
+    def get_history(self, username, block_key, scope=None):
+        scope = resolve_scope(scope)
+        for entry in self._client.get_history(username, block_key, scope):
+            if entry.state is not None:
+                entry = entry._replace(state={
+                    field: value
+                    for field, value in entry.state.items()
+                    if not field.startswith(EXPIRY_PREFIX)
+                })
+            yield entry
+
+    def get_many_as_of(self, username, block_keys, timestamp, scope=None, fields=None):
+        """
+        Hide the fields that had expired at ``timestamp``, rather than now.
+        """
+        scope = resolve_scope(scope)
+        if fields is not None:
+            fields = list(fields) + [_expiry_field(field) for field in fields]
+        return self._visible_entries(
+            self._client.get_many_as_of(username, block_keys, timestamp, scope, fields=fields),
+            timestamp.timestamp(),
+        )
+
+    def snapshot(self):
+        """
+        Return a snapshot of the wrapped client that hides the fields expired at the time it was taken.
+        """
+        now = self.clock()
+        snapshot = self._client.snapshot()
+        return ReadOnlyUserStateClient(
+            ExpiringFieldsUserStateClient(snapshot, self.default_ttls, clock=lambda: now), [snapshot]
+        )
+
+    def iter_all_for_block(self, block_key, scope=None):
+        scope = resolve_scope(scope)
+        return self._visible_entries(self._client.iter_all_for_block(block_key, scope))
+
+    def iter_all_for_blocks(self, block_keys, scope=None):
+        scope = resolve_scope(scope)
+        return self._visible_entries(self._client.iter_all_for_blocks(block_keys, scope))
+
+    def iter_all_for_course(self, course_key, block_type=None, scope=None):
+        scope = resolve_scope(scope)
+        return self._visible_entries(self._client.iter_all_for_course(course_key, block_type, scope))
+
+    def iter_chunks_for_blocks(self, block_keys, scope=None, chunk_size=1000, columnar=False,
+                               fields=None):
+        scope = resolve_scope(scope)
+        return iter_chunks(self.iter_all_for_blocks(block_keys, scope), chunk_size, columnar, fields)
+
+    def iter_chunks_for_course(self, course_key, block_type=None, scope=None, chunk_size=1000,
+                               columnar=False, fields=None):
+        scope = resolve_scope(scope)
+        return iter_chunks(self.iter_all_for_course(course_key, block_type, scope), chunk_size, columnar, fields)
+
+    def iter_all_for_course_sorted(self, course_key, block_type=None, scope=None,
+                                   order_by=ORDER_BY_USERNAME, username_prefix=None):
+        scope = resolve_scope(scope)
+        return self._visible_entries(self._client.iter_all_for_course_sorted(
+            course_key, block_type, scope, order_by=order_by, username_prefix=username_prefix
+        ))
+
+    def _delete_expired(self, expired):
+        """
+        Delete expired fields.
+
+        Arguments:
+            expired (dict): Maps (username, block_key, scope) to a set of expired field names.
+
+        Returns:
+            int: The number of fields deleted.
+        """
+        # delete_many takes one list of fields for all its block keys, so group by that too.
+        batches = {}
+        for (username, block_key, scope), fields in expired.items():
+            batch_fields = tuple(sorted(fields))
+            batches.setdefault((username, scope, batch_fields), []).append(block_key)
+        for (username, scope, fields), block_keys in batches.items():
+            self.delete_many(username, block_keys, scope, fields=list(fields))
+        return sum(len(fields) for fields in expired.values())
+
+    def sweep(self, now=None):
+        """
+        Delete the fields written through this instance whose expiry has passed.
+
+        Each candidate's stored expiry is re-read first, so fields that were rewritten
+        with a later expiry, or without one, are left alone, unless the rewrite lands
+        between that read and the delete.
+
+        Returns:
+            int: The number of fields deleted.
+        """
+        if now is None:
+            now = self.clock()
+        candidates = {}
+        with self._heap_lock:
+            while self._heap and self._heap[0][0] <= now:
+                _, _, username, block_key, scope, field = heapq.heappop(self._heap)
+                candidates.setdefault((username, scope), {}).setdefault(block_key, set()).add(field)
+
+        expired = {}
+        for (username, scope), block_fields in candidates.items():
+            fields = {_expiry_field(field) for block in block_fields.values() for field in block}
+            stored = self._client.get_many(username, list(block_fields), scope, fields=list(fields))
+            for entry in stored:
+                for field in block_fields[entry.block_key]:
+                    expires = entry.state.get(_expiry_field(field))
+                    if expires is not None and expires <= now:
+                        expired.setdefault((username, entry.block_key, scope), set()).add(field)
+        return self._delete_expired(expired)
+
+    def sweep_course(self, course_key, block_type=None, scope=None, now=None):
+        """
+        Scan a whole course and delete every expired field, whichever process wrote it.
+
+        Returns:
+            int: The number of fields deleted.
+        """
+        scope = resolve_scope(scope)
+        if now is None:
+            now = self.clock()
+        expired = {}
+        for entry in self._client.iter_all_for_course(course_key, block_type, scope):
+            for field, expires in entry.state.items():
+                if field.startswith(EXPIRY_PREFIX) and expires is not None and expires <= now:
+                    expired.setdefault((entry.username, entry.block_key, scope), set()).add(
+                        field[len(EXPIRY_PREFIX):]
+                    )
+        return self._delete_expired(expired)
+
+    def start_sweeper(self, interval=60):
+        """
+        Call :meth:`sweep` every ``interval`` seconds on a daemon thread, until :meth:`stop_sweeper`.
+        """
+        if self._sweeper is not None:
+            return
+        self._stop_sweeper.clear()
+
+        def run():
+            while not self._stop_sweeper.wait(interval):
+                try:
+                    self.sweep()
+                except Exception:  # pylint: disable=broad-except
+                    log.exception('Sweeping expired user state fields failed')
+
+        self._sweeper = threading.Thread(target=run, name='user-state-expiry-sweeper', daemon=True)
+        self._sweeper.start()
+
+    def stop_sweeper(self):
+        """
+        Stop the thread started by :meth:`start_sweeper`.
+        """
+        if self._sweeper is None:
+            return
+        self._stop_sweeper.set()
+        self._sweeper.join()
+        self._sweeper = None
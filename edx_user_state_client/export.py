@@ -0,0 +1,286 @@
+"""
+Stream the user state of a course to chunked NDJSON, CSV or Parquet files.
+
+Rows are flattened to one per stored field, and at most one chunk of rows is held
+in memory, so peak memory doesn't grow with the size of the course. NDJSON exports
+can be read back with :func:`iter_exported_state` and loaded with
+:meth:`~edx_user_state_client.interface.XBlockUserStateClient.bulk_load`.
+"""
+
+import bz2
+import csv
+import gzip
+import json
+import lzma
+import os
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from opaque_keys.edx.keys import DefinitionKey, UsageKey
+from xblock.fields import BlockScope, Scope
+
+from edx_user_state_client.interface import XBlockUserState, resolve_scope
+
+EXPORT_COLUMNS = ('username', 'course_key', 'block_key', 'block_type', 'scope', 'field', 'value', 'updated')
+
+_COMPRESSORS = {
+    None: (open, ''),
+    'gzip': (gzip.open, '.gz'),
+    'bz2': (bz2.open, '.bz2'),
+    'xz': (lzma.open, '.xz'),
+}
+
+
+class ExportProgress(namedtuple('_ExportProgress', ['records', 'rows', 'files', 'elapsed', 'eta'])):
+    """
+    How far an export has got, passed to the ``progress`` callback after every chunk.
+
+    Arguments:
+        records: The number of XBlockUserState records read so far.
+        rows: The number of field rows written so far.
+        files: The paths of the chunk files written so far.
+        elapsed: Seconds since the export started.
+        eta: Estimated seconds until the export finishes, or None if ``expected_records`` wasn't given.
+    """
+    __slots__ = ()
+
+
+def iter_field_rows(entries):
+    """
+    Flatten XBlockUserState ``entries`` into one dict per stored field, with keys :data:`EXPORT_COLUMNS`.
+
+    A block with empty state gets one row with ``field`` and ``value`` None, so that it
+    isn't lost on export.
+    """
+    for entry in entries:
+        block_key = entry.block_key
+        common = {
+            'username': entry.username,
+            'course_key': str(getattr(block_key, 'course_key', '')),
+            'block_key': str(block_key),
+            'block_type': getattr(block_key, 'block_type', ''),
+            'scope': entry.scope.name,
+            'updated': entry.updated.isoformat() if entry.updated is not None else None,
+        }
+        for field, value in entry.state.items() or [(None, None)]:
+            row = dict(common)
+            row['field'] = field
+            row['value'] = value
+            yield row
+
+
+class _NDJSONChunkWriter():
+    """
+    Write rows as one JSON object per line.
+    """
+    extension = '.ndjson'
+
+    def __init__(self, path, compression):
+        opener, _ = _COMPRESSORS[compression]
+        self._file = opener(path, 'wt', encoding='utf-8')
+
+    def write(self, row):
+        self._file.write(json.dumps(row, sort_keys=True))
+        self._file.write('\n')
+
+    def close(self):
+        self._file.close()
+
+
+class _CSVChunkWriter():
+    """
+    Write rows as CSV with a header, JSON-encoding the field values.
+    """
+    extension = '.csv'
+
+    def __init__(self, path, compression):
+        opener, _ = _COMPRESSORS[compression]
+        self._file = opener(path, 'wt', encoding='utf-8', newline='')
+        self._writer = csv.DictWriter(self._file, EXPORT_COLUMNS)
+        self._writer.writeheader()
+
+    def write(self, row):
+        row = dict(row)
+        row['value'] = json.dumps(row['value'], sort_keys=True)
+        self._writer.writerow(row)
+
+    def close(self):
+        self._file.close()
+
+
+class _ParquetChunkWriter():
+    """
+    Write rows as a Parquet file, JSON-encoding the field values. Requires ``pyarrow``.
+    """
+    extension = '.parquet'
+
+    def __init__(self, path, compression):
+        try:
+            import pyarrow  # pylint: disable=import-outside-toplevel
+            import pyarrow.parquet  # pylint: disable=import-outside-toplevel
+        except ImportError as exception:
+            raise ImportError('Exporting to parquet requires the pyarrow package') from exception
+        self._pyarrow = pyarrow
+        self._path = path
+        self._compression = compression or 'none'
+        self._columns = {column: [] for column in EXPORT_COLUMNS}
+
+    def write(self, row):
+        for column in EXPORT_COLUMNS:
+            value = row[column]
+            self._columns[column].append(json.dumps(value, sort_keys=True) if column == 'value' else value)
+
+    def close(self):
+        table = self._pyarrow.Table.from_pydict(self._columns)
+        self._pyarrow.parquet.write_table(table, self._path, compression=self._compression)
+
+
+_WRITERS = {
+    'ndjson': _NDJSONChunkWriter,
+    'csv': _CSVChunkWriter,
+    'parquet': _ParquetChunkWriter,
+}
+
+
+def export_course_state(client, course_key, directory, block_type=None, scope=None,
+                        output_format='ndjson', chunk_size=100000, compression=None,
+                        progress=None, expected_records=None, prefix='part'):
+    """
+    Stream every XBlockUserState in a course from ``client`` to chunk files in ``directory``.
+
+    Arguments:
+        client (XBlockUserStateClient): The client to read from, with ``iter_all_for_course``.
+        course_key: The course to export.
+        directory (str): An existing directory to write chunk files to.
+        block_type (str): If given, only export blocks of this type.
+        scope (Scope): The scope to export, or None for ``Scope.user_state``.
+        output_format (str): ``'ndjson'``, ``'csv'`` or ``'parquet'`` (which requires ``pyarrow``).
+        chunk_size (int): The maximum number of field rows per chunk file.
+        compression: For ndjson and csv, None, ``'gzip'``, ``'bz2'`` or ``'xz'``.
+            For parquet, any codec that pyarrow supports.
+        progress: If given, called with an :class:`ExportProgress` after each chunk file is written.
+        expected_records (int): The number of records expected, used to estimate time remaining.
+        prefix (str): The prefix of the chunk file names.
+
+    Returns:
+        The list of paths written, in order.
+
+    If reading or writing raises, the chunk file being written is closed and removed,
+    and the chunk files already finished are left in ``directory``.
+    """
+    scope = resolve_scope(scope)
+    writer_class = _WRITERS[output_format]
+    extension = writer_class.extension
+    if output_format != 'parquet':
+        extension += _COMPRESSORS[compression][1]
+
+    start = time.monotonic()
+    files = []
+    counts = {'records': 0, 'rows': 0}
+    writer = None
+    rows_in_chunk = 0
+
+    def counted(entries):
+        for entry in entries:
+            counts['records'] += 1
+            yield entry
+
+    def finish_chunk(chunk_writer):
+        chunk_writer.close()
+        if progress is not None:
+            elapsed = time.monotonic() - start
+            eta = None
+            if expected_records and counts['records']:
+                remaining = max(expected_records - counts['records'], 0)
+                eta = elapsed / counts['records'] * remaining
+            progress(ExportProgress(counts['records'], counts['rows'], list(files), elapsed, eta))
+
+    try:
+        entries = client.iter_all_for_course(course_key, block_type=block_type, scope=scope)
+        for row in iter_field_rows(counted(entries)):
+            if writer is None:
+                path = os.path.join(directory, f'{prefix}-{len(files):05d}{extension}')
+                writer = writer_class(path, compression)
+                files.append(path)
+                rows_in_chunk = 0
+            writer.write(row)
+            rows_in_chunk += 1
+            counts['rows'] += 1
+            if rows_in_chunk >= chunk_size:
+                chunk_writer, writer = writer, None
+                finish_chunk(chunk_writer)
+
+        if writer is not None:
+            chunk_writer, writer = writer, None
+            finish_chunk(chunk_writer)
+    finally:
+        if writer is not None:
+            writer.close()
+            os.remove(files.pop())
+    return files
+
+
+def parse_block_key(block_key, scope):
+    """
+    Return the block key that was exported as the string ``block_key`` for ``scope``.
+    """
+    if scope.block == BlockScope.USAGE:
+        return UsageKey.from_string(block_key)
+    if scope.block == BlockScope.DEFINITION:
+        return DefinitionKey.from_string(block_key)
+    if scope.block == BlockScope.ALL:
+        return None
+    return block_key
+
+
+def iter_exported_state(paths, block_key_parser=parse_block_key):
+    """
+    Read NDJSON chunk files written by :func:`export_course_state` back into XBlockUserState records.
+
+    The rows for one record are written consecutively, so records are rebuilt one at
+    a time and memory stays bounded.
+
+    Arguments:
+        paths: The chunk files to read, in the order they were written.
+            Compressed files are recognized by their extension.
+        block_key_parser: Called with the exported block key string and the
+            :class:`~xblock.fields.Scope` to rebuild each block key.
+
+    Yields:
+        XBlockUserState for each exported record.
+    """
+    scopes = {scope.name: scope for scope in Scope.scopes()}
+    openers = {extension: opener for opener, extension in _COMPRESSORS.values() if extension}
+    current = None
+    state = {}
+    for path in paths:
+        opener = openers.get(os.path.splitext(path)[1], open)
+        with opener(path, 'rt', encoding='utf-8') as chunk:
+            for line in chunk:
+                row = json.loads(line)
+                identity = (row['username'], row['block_key'], row['scope'], row['updated'])
+                if identity != current:
+                    if current is not None:
+                        yield _exported_record(current, state, scopes, block_key_parser)
+                    current = identity
+                    state = {}
+                if row['field'] is not None:
+                    state[row['field']] = row['value']
+    if current is not None:
+        yield _exported_record(current, state, scopes, block_key_parser)
+
+
+def _exported_record(identity, state, scopes, block_key_parser):
+    """
+    Build the XBlockUserState for the rows read by :func:`iter_exported_state`.
+    """
+    username, block_key, scope_name, updated = identity
+    scope = scopes[scope_name]
+    return XBlockUserState(
+        username,
+        block_key_parser(block_key, scope),
+        state,
+        datetime.fromisoformat(updated) if updated is not None else None,
+        scope,
+    )
@@ -0,0 +1,179 @@
+"""
+An XBlock :class:`~xblock.field_data.FieldData` that reads user state lazily
+through an XBlockUserStateClient.
+"""
+
+import copy
+
+from xblock.field_data import FieldData
+from xblock.fields import BlockScope, Scope
+
+from edx_user_state_client.interface import resolve_scope
+
+_DELETED = object()
+
+
+class LazyUserStateFieldData(FieldData):
+    """
+    FieldData for one user's fields in one scope, read on first access and written back in bulk.
+
+    Nothing is read up front. The first access to a field that isn't loaded yet fetches
+    every field the block's class declares in ``scope`` (and any ``prefetch_fields``),
+    in one ``get_many`` with a ``fields`` projection. The read also covers every
+    registered block that hasn't loaded those fields and either declares the same fields
+    or hasn't been accessed yet. So rendering a page of blocks of the same type makes one
+    read, not one per block or per field name, and blocks of other types aren't read for
+    fields they don't declare.
+
+    ``set`` and ``delete`` only record the change. :meth:`flush` writes every changed
+    field in one ``set_many``, and deletes fields with ``delete_many``.
+
+    Use it for fields of ``scope`` only, for example under a
+    :class:`~xblock.field_data.SplitFieldData` that sends other scopes elsewhere.
+    It is meant for one request, and is not thread-safe.
+
+    Arguments:
+        client (XBlockUserStateClient): The client to read from and write to.
+        username (str): The user whose state this is.
+        block_keys: The keys of blocks likely to be accessed, to batch their reads together.
+        scope (Scope): The scope of the fields this FieldData holds, or None for ``Scope.user_state``.
+        prefetch_fields: Field names to fetch along with the declared fields, for example
+            the fields of other block types that are likely to be accessed.
+    """
+
+    def __init__(self, client, username, block_keys=(), scope=None, prefetch_fields=()):
+        self._client = client
+        self.username = username
+        self.scope = resolve_scope(scope)
+        self.prefetch_fields = frozenset(prefetch_fields)
+        # Maps block keys of accessed blocks to the fields read when one misses.
+        self._fields = {}
+        # Maps block keys to the field names whose values (or absence) have been read.
+        self._loaded = {}
+        # Maps block keys to the stored values of the fields that have been read.
+        self._values = {}
+        # Maps block keys to changed fields, with values or _DELETED.
+        self._dirty = {}
+        self.register(block_keys)
+
+    def register(self, block_keys):
+        """
+        Add ``block_keys`` to the blocks whose fields are read together.
+        """
+        for block_key in block_keys:
+            self._loaded.setdefault(block_key, set())
+            self._values.setdefault(block_key, {})
+
+    def block_key(self, block):
+        """
+        Return the key that ``block``'s fields in this scope are stored under.
+        """
+        if self.scope.block == BlockScope.USAGE:
+            return block.scope_ids.usage_id
+        if self.scope.block == BlockScope.DEFINITION:
+            return block.scope_ids.def_id
+        if self.scope.block == BlockScope.TYPE:
+            return block.scope_ids.block_type
+        return None
+
+    def _fields_to_load(self, block, block_key):
+        """
+        Return the fields to read when a field of ``block`` misses: the prefetch fields,
+        and every field of ``block`` in this scope.
+        """
+        fields = self._fields.get(block_key)
+        if fields is None:
+            declared = {field_name for field_name, field in block.fields.items() if field.scope == self.scope}
+            fields = self._fields[block_key] = self.prefetch_fields | declared
+        return fields
+
+    def _load(self, block_key, fields, name):
+        """
+        Read ``fields`` and ``name`` for ``block_key``, and ``fields`` for every other
+        registered block that hasn't read them all and reads the same ``fields`` on a miss,
+        or hasn't been accessed.
+        """
+        self.register([block_key])
+        same_fields = fields
+        fields = fields | {name}
+        pending = [
+            key for key, loaded in self._loaded.items()
+            if key == block_key or (not fields <= loaded and self._fields.get(key, same_fields) == same_fields)
+        ]
+        for entry in self._client.get_many(self.username, pending, self.scope, fields=sorted(fields)):
+            loaded = self._loaded[entry.block_key]
+            values = self._values[entry.block_key]
+            for field, value in entry.state.items():
+                if field not in loaded:
+                    values[field] = value
+        for key in pending:
+            self._loaded[key] |= fields
+
+    def _lookup(self, block, name):
+        """
+        Return the current value of field ``name`` of ``block``, or _DELETED if it has none.
+        """
+        block_key = self.block_key(block)
+        fields = self._fields_to_load(block, block_key)
+        dirty = self._dirty.get(block_key, {})
+        if name in dirty:
+            return dirty[name]
+        if name not in self._loaded.get(block_key, ()):
+            self._load(block_key, fields, name)
+        return self._values[block_key].get(name, _DELETED)
+
+    def get(self, block, name):
+        value = self._lookup(block, name)
+        if value is _DELETED:
+            raise KeyError(repr(name))
+        return copy.deepcopy(value)
+
+    def has(self, block, name):
+        return self._lookup(block, name) is not _DELETED
+
+    def set(self, block, name, value):
+        self._dirty.setdefault(self.block_key(block), {})[name] = copy.deepcopy(value)
+
+    def delete(self, block, name):
+        self._dirty.setdefault(self.block_key(block), {})[name] = _DELETED
+
+    @property
+    def is_dirty(self):
+        """
+        Whether there are changes that haven't been flushed.
+        """
+        return any(self._dirty.values())
+
+    def flush(self):
+        """
+        Write all changed fields back to the client.
+
+        Set fields are written with one ``set_many``. Deleted fields are removed with one
+        ``delete_many`` per distinct set of deleted field names. If a write raises, the
+        changes are kept, so that ``flush`` can be called again.
+        """
+        to_set = {}
+        to_delete = {}
+        for block_key, changes in self._dirty.items():
+            state = {field: value for field, value in changes.items() if value is not _DELETED}
+            if state:
+                to_set[block_key] = state
+            deleted = frozenset(field for field, value in changes.items() if value is _DELETED)
+            if deleted:
+                to_delete.setdefault(deleted, []).append(block_key)
+
+        if to_set:
+            self._client.set_many(self.username, to_set, self.scope)
+        for fields, block_keys in to_delete.items():
+            self._client.delete_many(self.username, block_keys, self.scope, fields=sorted(fields))
+
+        for block_key, changes in self._dirty.items():
+            self.register([block_key])
+            values = self._values[block_key]
+            for field, value in changes.items():
+                if value is _DELETED:
+                    values.pop(field, None)
+                else:
+                    values[field] = value
+                self._loaded[block_key].add(field)
+        self._dirty = {}
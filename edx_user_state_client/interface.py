@@ -4,8 +4,24 @@ A baseclass for a generic client for accessing XBlock Scope.user_state field dat
 
 from abc import abstractmethod
 from collections import namedtuple
+from itertools import islice
 
-from xblock.fields import Scope
+from edx_user_state_client.chunks import iter_chunks
+from edx_user_state_client.ordering import ORDER_BY_USERNAME, entry_sort_key
+
+
+def resolve_scope(scope):
+    """
+    Return ``scope``, or ``Scope.user_state`` if it is None.
+
+    :mod:`xblock.fields` is imported on first use rather than with this module, so that
+    code which only needs the interface (such as workers iterating exported data)
+    doesn't pay to import the whole XBlock package at startup.
+    """
+    if scope is None:
+        from xblock.fields import Scope  # pylint: disable=import-outside-toplevel
+        return Scope.user_state
+    return scope
 
 
 class XBlockUserState(namedtuple('_XBlockUserState', ['username', 'block_key', 'state', 'updated', 'scope'])):
@@ -77,14 +93,29 @@ class XBlockUserStateClient():
         """
         pass
 
-    def get(self, username, block_key, scope=Scope.user_state, fields=None):
+    class VersionConflict(Exception):
+        """
+        This error is raised if a conditional write finds that the data has been modified
+        since it was read. ``block_keys`` lists the blocks that were modified.
+        """
+        def __init__(self, block_keys):
+            super().__init__(block_keys)
+            self.block_keys = block_keys
+
+    class QuotaExceeded(Exception):
+        """
+        This error is raised if a write would take stored state over a size quota.
+        """
+        pass
+
+    def get(self, username, block_key, scope=None, fields=None):
         """
         Retrieve the stored XBlock state for a single xblock usage.
 
         Arguments:
             username: The name of the user whose state should be retrieved
             block_key: The key identifying which xblock state to load.
-            scope (Scope): The scope to load data from
+            scope (Scope): The scope to load data from, or None for ``Scope.user_state``.
             fields: A list of field values to retrieve. If None, retrieve all stored fields.
 
         Returns:
@@ -93,12 +124,13 @@ class XBlockUserStateClient():
         Raises:
             DoesNotExist if no entry is found.
         """
+        scope = resolve_scope(scope)
         try:
             return next(self.get_many(username, [block_key], scope, fields=fields))
         except StopIteration as exception:
             raise self.DoesNotExist() from exception
 
-    def set(self, username, block_key, state, scope=Scope.user_state):
+    def set(self, username, block_key, state, scope=None):
         """
         Set fields for a particular XBlock.
 
@@ -106,31 +138,33 @@ class XBlockUserStateClient():
             username: The name of the user whose state should be retrieved
             block_key: The key identifying which xblock state to load.
             state (dict): A dictionary mapping field names to values
-            scope (Scope): The scope to store data to
+            scope (Scope): The scope to store data to, or None for ``Scope.user_state``.
         """
+        scope = resolve_scope(scope)
         self.set_many(username, {block_key: state}, scope)
 
-    def delete(self, username, block_key, scope=Scope.user_state, fields=None):
+    def delete(self, username, block_key, scope=None, fields=None):
         """
         Delete the stored XBlock state for a single xblock usage.
 
         Arguments:
             username: The name of the user whose state should be deleted
             block_key: The key identifying which xblock state to delete.
-            scope (Scope): The scope to delete data from
+            scope (Scope): The scope to delete data from, or None for ``Scope.user_state``.
             fields: A list of fields to delete. If None, delete all stored fields.
         """
+        scope = resolve_scope(scope)
         return self.delete_many(username, [block_key], scope, fields=fields)
 
     @abstractmethod
-    def get_many(self, username, block_keys, scope=Scope.user_state, fields=None):
+    def get_many(self, username, block_keys, scope=None, fields=None):
         """
         Retrieve the stored XBlock state for a single xblock usage.
 
         Arguments:
             username: The name of the user whose state should be retrieved
             block_keys: A list of keys identifying which xblock states to load.
-            scope (Scope): The scope to load data from
+            scope (Scope): The scope to load data from, or None for ``Scope.user_state``.
             fields: A list of field values to retrieve. If None, retrieve all stored fields.
 
         Yields:
@@ -140,7 +174,7 @@ class XBlockUserStateClient():
         raise NotImplementedError()
 
     @abstractmethod
-    def set_many(self, username, block_keys_to_state, scope=Scope.user_state):
+    def set_many(self, username, block_keys_to_state, scope=None):
         """
         Set fields for a particular XBlock.
 
@@ -150,24 +184,61 @@ class XBlockUserStateClient():
                 Each state dict maps field names to values. These state dicts
                 are overlaid over the stored state. To delete fields, use
                 :meth:`delete` or :meth:`delete_many`.
-            scope (Scope): The scope to load data from
+            scope (Scope): The scope to store data to, or None for ``Scope.user_state``.
         """
         raise NotImplementedError()
 
+    def set_many_if_unmodified(self, username, block_keys_to_state, expected_updated, scope=None):
+        """
+        Set fields for many XBlocks, but only if none of them has changed since it was read.
+
+        This is a compare-and-set using :attr:`XBlockUserState.updated` as a version, so
+        concurrent submissions for the same blocks can be detected without locking.
+        Either every block is written, or none is.
+
+        Backends should override this with an atomic implementation. This default
+        implementation checks with :meth:`get_many` and then writes with :meth:`set_many`,
+        so it can miss a write that lands between the two.
+
+        Arguments:
+            username: The name of the user whose state should be stored
+            block_keys_to_state (dict): A dict mapping keys to state dicts, overlaid over the
+                stored state as in :meth:`set_many`.
+            expected_updated (dict): A dict mapping each key in ``block_keys_to_state`` to the
+                ``updated`` value it was read with, or to None if it was expected to have no state.
+            scope (Scope): The scope to store data to, or None for ``Scope.user_state``.
+
+        Raises:
+            VersionConflict if any block has been modified since ``expected_updated``.
+        """
+        scope = resolve_scope(scope)
+        self._check_unmodified(username, block_keys_to_state, expected_updated, scope)
+        self.set_many(username, block_keys_to_state, scope)
+
+    def _check_unmodified(self, username, block_keys, expected_updated, scope):
+        """
+        Raise :class:`VersionConflict` if any of ``block_keys`` doesn't have its ``expected_updated`` version.
+        """
+        block_keys = list(block_keys)
+        current = {entry.block_key: entry.updated for entry in self.get_many(username, block_keys, scope, fields=[])}
+        conflicts = [key for key in block_keys if current.get(key) != expected_updated.get(key)]
+        if conflicts:
+            raise self.VersionConflict(conflicts)
+
     @abstractmethod
-    def delete_many(self, username, block_keys, scope=Scope.user_state, fields=None):
+    def delete_many(self, username, block_keys, scope=None, fields=None):
         """
         Delete the stored XBlock state for a many xblock usages.
 
         Arguments:
             username: The name of the user whose state should be deleted
             block_key: The key identifying which xblock state to delete.
-            scope (Scope): The scope to delete data from
+            scope (Scope): The scope to delete data from, or None for ``Scope.user_state``.
             fields: A list of fields to delete. If None, delete all stored fields.
         """
         raise NotImplementedError()
 
-    def get_history(self, username, block_key, scope=Scope.user_state):
+    def get_history(self, username, block_key, scope=None):
         """
         Retrieve history of state changes for a given block for a given
         student.  We don't guarantee that history for many blocks will be fast.
@@ -177,7 +248,7 @@ class XBlockUserStateClient():
         Arguments:
             username: The name of the user whose history should be retrieved.
             block_key: The key identifying which xblock history to retrieve.
-            scope (Scope): The scope to load data from.
+            scope (Scope): The scope to load data from, or None for ``Scope.user_state``.
 
         Yields:
             XBlockUserState entries for each modification to the specified XBlock, from latest
@@ -185,16 +256,355 @@ class XBlockUserStateClient():
         """
         raise NotImplementedError()
 
-    def iter_all_for_block(self, block_key, scope=Scope.user_state):
+    def get_many_as_of(self, username, block_keys, timestamp, scope=None, fields=None):
+        """
+        Retrieve the stored state of many XBlocks as it was at ``timestamp``, such as at a
+        deadline, for regrading and audits.
+
+        Backends should override this to find each block's version with an indexed lookup,
+        such as a query ordered by ``updated`` for each block. This default implementation
+        walks :meth:`get_history` back from the latest entry of each block.
+
+        Arguments:
+            username: The name of the user whose state should be retrieved.
+            block_keys: A list of keys identifying which xblock states to load.
+            timestamp (datetime): The time to read the state as of, in UTC. State stored at
+                exactly ``timestamp`` is included.
+            scope (Scope): The scope to load data from, or None for ``Scope.user_state``.
+            fields: A list of field values to retrieve. If None, retrieve all stored fields.
+
+        Yields:
+            XBlockUserState tuples for each specified block_key that had state at ``timestamp``,
+            with the ``updated`` time of that state. Blocks that had no state then, or whose
+            state had been deleted by then, are skipped.
+        """
+        scope = resolve_scope(scope)
+        for block_key in block_keys:
+            try:
+                entry = next(
+                    (
+                        entry for entry in self.get_history(username, block_key, scope)
+                        if entry.updated is None or entry.updated <= timestamp
+                    ),
+                    None,
+                )
+            except self.DoesNotExist:
+                continue
+            if entry is None or entry.state is None:
+                continue
+            if fields is not None:
+                entry = entry._replace(state={field: entry.state[field] for field in fields if field in entry.state})
+            yield entry
+
+    def bulk_load(self, entries, batch_size=1000):
+        """
+        Load a stream of XBlock state, such as an export or a migration from another store.
+
+        Backends should override this with a fast path that writes ``entries`` in large
+        batches, and stores each with its original ``updated`` timestamp as a history
+        entry. This default implementation replays ``entries`` through :meth:`set_many`
+        and :meth:`delete_many`, grouping as many entries into each call as it can while
+        keeping the entries for each block in order. It can't preserve ``updated``, and
+        it deletes the stored fields that each state lacks before writing it, which adds
+        a history entry.
+
+        Arguments:
+            entries: An iterable of :class:`XBlockUserState`. The entries for each block should
+                be in order from earliest to latest, as the reverse of :meth:`get_history`.
+                An entry with ``state`` None records a deletion.
+            batch_size (int): The number of entries to write at a time.
+
+        Returns:
+            int: The number of entries loaded.
+        """
+        count = 0
+        entries = iter(entries)
+        while True:
+            batch = list(islice(entries, batch_size))
+            if not batch:
+                return count
+            count += len(batch)
+
+            pending = {}
+            for entry in batch:
+                group = pending.setdefault((entry.username, entry.scope), {})
+                if entry.block_key in group:
+                    self._flush_bulk_load(pending)
+                    pending = {(entry.username, entry.scope): {}}
+                    group = pending[(entry.username, entry.scope)]
+                group[entry.block_key] = entry.state
+            self._flush_bulk_load(pending)
+
+    def _flush_bulk_load(self, pending):
+        """
+        Write the states gathered by :meth:`bulk_load`.
+
+        Arguments:
+            pending (dict): Maps (username, scope) to a dict mapping block keys to states.
+        """
+        for (username, scope), block_keys_to_state in pending.items():
+            deleted = [key for key, state in block_keys_to_state.items() if state is None]
+            if deleted:
+                self.delete_many(username, deleted, scope)
+            written = {key: state for key, state in block_keys_to_state.items() if state is not None}
+            if not written:
+                continue
+            # set_many overlays fields, so remove the stored fields each state lacks first.
+            # delete_many takes one list of fields for all its block keys, so group by that.
+            stale = {}
+            for entry in self.get_many(username, list(written), scope):
+                fields = tuple(sorted(set(entry.state) - set(written[entry.block_key])))
+                if fields:
+                    stale.setdefault(fields, []).append(entry.block_key)
+            for fields, block_keys in stale.items():
+                self.delete_many(username, block_keys, scope, fields=list(fields))
+            self.set_many(username, written, scope)
+
+    def delete_all_for_user(self, username, course_keys=None, scope=None, purge_history=False,
+                            batch_size=1000, progress=None):
+        """
+        Delete all of a user's stored state, as for user retirement.
+
+        Backends should override this with a fast path that deletes in the store. This
+        default implementation can only find a user's blocks by scanning whole courses,
+        so it needs ``course_keys``, and it can't purge history.
+
+        Arguments:
+            username: The name of the user whose state should be deleted.
+            course_keys: Only delete the user's state in these courses. If None, delete it everywhere.
+            scope (Scope): The scope to delete data from, or None for ``Scope.user_state``.
+            purge_history (bool): Also remove the deleted blocks' history, rather than
+                recording the deletion in it.
+            batch_size (int): The number of blocks to delete at a time.
+            progress: Called with the number of blocks deleted so far after each batch.
+
+        Returns:
+            int: The number of blocks deleted.
+        """
+        scope = resolve_scope(scope)
+        if course_keys is None:
+            raise NotImplementedError("This client can't find all of a user's state; pass course_keys")
+        self._check_purge_history(purge_history)
+        entries = (
+            entry
+            for course_key in course_keys
+            for entry in self.iter_all_for_course(course_key, scope=scope)
+            if entry.username == username
+        )
+        return self._delete_entries(entries, scope, batch_size, progress)
+
+    def delete_all_for_block(self, block_key, scope=None, purge_history=False, batch_size=1000, progress=None):
+        """
+        Delete every user's stored state for a block.
+
+        Backends should override this with a fast path that deletes in the store. This
+        default implementation streams :meth:`iter_all_for_block`, and deletes with one
+        :meth:`delete_many` per user in each batch. It can't purge history.
+
+        Arguments:
+            block_key: The key identifying which xblock state to delete.
+            scope (Scope): The scope to delete data from, or None for ``Scope.user_state``.
+            purge_history (bool): Also remove the deleted blocks' history, rather than
+                recording the deletion in it.
+            batch_size (int): The number of blocks to delete at a time.
+            progress: Called with the number of blocks deleted so far after each batch.
+
+        Returns:
+            int: The number of blocks deleted.
+        """
+        scope = resolve_scope(scope)
+        self._check_purge_history(purge_history)
+        return self._delete_entries(self.iter_all_for_block(block_key, scope), scope, batch_size, progress)
+
+    def delete_all_for_course(self, course_key, block_type=None, scope=None, purge_history=False,
+                              batch_size=1000, progress=None):
+        """
+        Delete every user's stored state in a course, as for a course reset.
+
+        Backends should override this with a fast path that deletes in the store. This
+        default implementation streams :meth:`iter_all_for_course`, and deletes with one
+        :meth:`delete_many` per user in each batch. It can't purge history.
+
+        Arguments:
+            course_key: The key of the course whose state should be deleted.
+            block_type (str): Only delete the state of blocks of this type, or None for every type.
+            scope (Scope): The scope to delete data from, or None for ``Scope.user_state``.
+            purge_history (bool): Also remove the deleted blocks' history, rather than
+                recording the deletion in it.
+            batch_size (int): The number of blocks to delete at a time.
+            progress: Called with the number of blocks deleted so far after each batch.
+
+        Returns:
+            int: The number of blocks deleted.
+        """
+        scope = resolve_scope(scope)
+        self._check_purge_history(purge_history)
+        return self._delete_entries(
+            self.iter_all_for_course(course_key, block_type, scope), scope, batch_size, progress
+        )
+
+    @staticmethod
+    def _check_purge_history(purge_history):
+        if purge_history:
+            raise NotImplementedError("This client can't purge history")
+
+    def _delete_entries(self, entries, scope, batch_size, progress):
+        """
+        Delete the blocks of ``entries``, reading ``batch_size`` of them before each round of deletes.
+        """
+        count = 0
+        entries = iter(entries)
+        while True:
+            batch = list(islice(entries, batch_size))
+            if not batch:
+                return count
+            by_user = {}
+            for entry in batch:
+                by_user.setdefault(entry.username, []).append(entry.block_key)
+            for username, block_keys in by_user.items():
+                self.delete_many(username, block_keys, scope)
+            count += len(batch)
+            if progress is not None:
+                progress(count)
+
+    def snapshot(self):
+        """
+        Return a read-only client that sees the state stored when it was taken, and none of
+        the writes made since, so that long scans such as exports read consistent state.
+
+        Snapshots reject writes with :class:`PermissionDenied`, and should be closed (see
+        :class:`~edx_user_state_client.snapshots.ReadOnlyClientMixin`). A SQL backend
+        would read a snapshot in one repeatable-read transaction.
+
+        Returns:
+            XBlockUserStateClient: The snapshot.
+
+        Raises:
+            NotImplementedError if this client can't take snapshots.
+        """
+        raise NotImplementedError()
+
+    def iter_all_for_block(self, block_key, scope=None):
         """
         You get no ordering guarantees. If you're using this method, you should be running in an
         async task.
         """
         raise NotImplementedError()
 
-    def iter_all_for_course(self, course_key, block_type=None, scope=Scope.user_state):
+    def iter_all_for_blocks(self, block_keys, scope=None):
+        """
+        Yield the state of every user for each of ``block_keys``, as calling
+        :meth:`iter_all_for_block` for each in turn would, for reports covering many blocks.
+
+        Each XBlockUserState carries its ``block_key``, and the entries of each block are
+        yielded together, in the order of ``block_keys``. A repeated key is only read once.
+
+        Backends should override this to read every block in one pass or query. This
+        default implementation calls :meth:`iter_all_for_block` once per block.
+
+        Arguments:
+            block_keys: The keys identifying which xblock states to load.
+            scope (Scope): The scope to load data from, or None for ``Scope.user_state``.
+
+        Yields:
+            XBlockUserState for each user with state in each block.
+        """
+        scope = resolve_scope(scope)
+        for block_key in dict.fromkeys(block_keys):
+            yield from self.iter_all_for_block(block_key, scope)
+
+    def iter_chunks_for_blocks(self, block_keys, scope=None, chunk_size=1000, columnar=False, fields=None):
+        """
+        Yield the state that :meth:`iter_all_for_blocks` would, in chunks of at most
+        ``chunk_size`` entries, so that consumers can process (or vectorize over) a chunk
+        at a time without the overhead of yielding every entry.
+
+        Backends should override this to read each chunk in one query. This default
+        implementation batches :meth:`iter_all_for_blocks`.
+
+        Arguments:
+            block_keys: The keys identifying which xblock states to load.
+            scope (Scope): The scope to load data from, or None for ``Scope.user_state``.
+            chunk_size (int): The most entries in a chunk.
+            columnar (bool): Whether to yield each chunk as a
+                :class:`~edx_user_state_client.chunks.StateColumns` rather than a list.
+            fields: A list of the fields to return. If None, return all stored fields, and give
+                each columnar chunk a column for every field stored in any of its entries.
+
+        Returns:
+            An iterator of lists of XBlockUserState, or of
+            :class:`~edx_user_state_client.chunks.StateColumns`.
+
+        Raises:
+            ValueError if ``chunk_size`` is less than 1.
+        """
+        scope = resolve_scope(scope)
+        return iter_chunks(self.iter_all_for_blocks(block_keys, scope), chunk_size, columnar, fields)
+
+    def iter_all_for_course(self, course_key, block_type=None, scope=None):
         """
         You get no ordering guarantees. If you're using this method, you should be running in an
         async task.
         """
         raise NotImplementedError()
+
+    def iter_chunks_for_course(self, course_key, block_type=None, scope=None, chunk_size=1000, columnar=False,
+                               fields=None):
+        """
+        Yield the state that :meth:`iter_all_for_course` would, in chunks of at most
+        ``chunk_size`` entries, as :meth:`iter_chunks_for_blocks` does.
+
+        Backends should override this to read each chunk in one query. This default
+        implementation batches :meth:`iter_all_for_course`.
+
+        Arguments:
+            course_key: The key of the course whose state should be yielded.
+            block_type (str): Only yield the state of blocks of this type, or None for every type.
+            scope (Scope): The scope to load data from, or None for ``Scope.user_state``.
+            chunk_size (int): The most entries in a chunk.
+            columnar (bool): Whether to yield each chunk as a
+                :class:`~edx_user_state_client.chunks.StateColumns` rather than a list.
+            fields: A list of the fields to return, as for :meth:`iter_chunks_for_blocks`.
+
+        Returns:
+            An iterator of lists of XBlockUserState, or of
+            :class:`~edx_user_state_client.chunks.StateColumns`.
+
+        Raises:
+            ValueError if ``chunk_size`` is less than 1.
+        """
+        scope = resolve_scope(scope)
+        return iter_chunks(self.iter_all_for_course(course_key, block_type, scope), chunk_size, columnar, fields)
+
+    def iter_all_for_course_sorted(self, course_key, block_type=None, scope=None, order_by=ORDER_BY_USERNAME,
+                                   username_prefix=None):
+        """
+        Yield the state of every user in a course, like :meth:`iter_all_for_course`, but
+        sorted, so that it can be merge-joined with other data sorted the same way (see
+        :func:`~edx_user_state_client.ordering.merge_join`).
+
+        Backends should override this to stream the state in order from the store. This
+        default implementation sorts all of the course's state in memory.
+
+        Arguments:
+            course_key: The key of the course whose state should be yielded.
+            block_type (str): Only yield the state of blocks of this type, or None for every type.
+            scope (Scope): The scope to load data from, or None for ``Scope.user_state``.
+            order_by (str): :data:`~edx_user_state_client.ordering.ORDER_BY_USERNAME` to sort
+                by (username, block key), or :data:`~edx_user_state_client.ordering.ORDER_BY_BLOCK`
+                to sort by (block key, username). Block keys are compared as strings.
+            username_prefix (str): Only yield the state of users whose usernames start with this.
+
+        Returns:
+            An iterator of XBlockUserState, in the order of
+            :func:`~edx_user_state_client.ordering.entry_sort_key`.
+
+        Raises:
+            ValueError if ``order_by`` isn't one of :data:`~edx_user_state_client.ordering.ORDERS`.
+        """
+        scope = resolve_scope(scope)
+        sort_key = entry_sort_key(order_by)
+        entries = self.iter_all_for_course(course_key, block_type, scope)
+        if username_prefix is not None:
+            entries = (entry for entry in entries if entry.username.startswith(username_prefix))
+        return iter(sorted(entries, key=sort_key))
@@ -0,0 +1,54 @@
+"""
+Interning of usernames and opaque keys to small integers, for in-memory indexes.
+"""
+
+import threading
+
+
+class KeyInterner():
+    """
+    Assign each distinct key a small integer id, the first time it is seen.
+
+    Hashing and comparing opaque keys is slow in Python. Hashing a key once per call to
+    find its id lets indexes be built from tuples of small integers, which hash and
+    compare cheaply. The original key is kept, so it can be rebuilt from its id at the
+    API boundary.
+
+    Ids are never reused or released, so an interner grows with the number of distinct
+    keys it has seen.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._keys = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def intern(self, key):
+        """
+        Return the id of ``key``, assigning it a new one if it hasn't been seen.
+        """
+        key_id = self._ids.get(key)
+        if key_id is not None:
+            return key_id
+        with self._lock:
+            key_id = self._ids.get(key)
+            if key_id is None:
+                key_id = len(self._keys)
+                self._keys.append(key)
+                self._ids[key] = key_id
+            return key_id
+
+    def lookup(self, key):
+        """
+        Return the id of ``key``, or None if it hasn't been interned.
+        """
+        return self._ids.get(key)
+
+    def key(self, key_id):
+        """
+        Return the key with id ``key_id``.
+        """
+        return self._keys[key_id]
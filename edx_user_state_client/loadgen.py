@@ -0,0 +1,475 @@
+"""
+Generate load against an XBlockUserStateClient, to capacity-plan backends under
+realistic concurrency.
+
+The workload is either a replay of a trace written by
+:class:`~edx_user_state_client.tracing.TracingUserStateClient`, or a
+:class:`SyntheticWorkload` of users × courses × blocks. Run it as a command::
+
+    python -m edx_user_state_client.loadgen --client mymodule:make_client \\
+        --trace trace.ndjson --rate 500 --concurrency 16
+
+    python -m edx_user_state_client.loadgen --client mymodule:make_client \\
+        --users 1000 --courses 5 --blocks 200 --operations 100000 --populate
+"""
+
+import argparse
+import asyncio
+import importlib
+import itertools
+import random
+import sys
+import threading
+import time
+from collections import defaultdict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pytz
+from opaque_keys import InvalidKeyError
+from opaque_keys.edx.keys import CourseKey
+from opaque_keys.edx.locator import BlockUsageLocator, CourseLocator
+from xblock.fields import Scope
+
+from edx_user_state_client.export import parse_block_key
+from edx_user_state_client.interface import XBlockUserState
+from edx_user_state_client.trace_analysis import read_trace
+
+
+class Operation(namedtuple('_Operation', ['method', 'kwargs'])):
+    """
+    One call to make on an XBlockUserStateClient.
+
+    Arguments:
+        method: The name of the XBlockUserStateClient method to call.
+        kwargs: A dict of keyword arguments to call it with.
+    """
+    __slots__ = ()
+
+    def apply(self, client):
+        """
+        Call this operation on ``client``, consuming any iterator it returns.
+        """
+        result = getattr(client, self.method)(**self.kwargs)
+        if self.method in (
+            'get_many', 'get_many_as_of', 'get_history', 'iter_all_for_block', 'iter_all_for_blocks',
+            'iter_all_for_course', 'iter_all_for_course_sorted', 'iter_chunks_for_blocks', 'iter_chunks_for_course',
+        ):
+            try:
+                for _ in result:
+                    pass
+            except client.DoesNotExist:
+                pass
+
+
+def _parse_key(block_key, scope):
+    """
+    Return ``block_key`` parsed for ``scope``, or as it is if it isn't a valid key.
+    """
+    try:
+        return parse_block_key(block_key, scope)
+    except InvalidKeyError:
+        return block_key
+
+
+def _parse_course_key(course_key):
+    """
+    Return ``course_key`` parsed as a CourseKey, or as it is if it isn't a valid key.
+    """
+    try:
+        return CourseKey.from_string(course_key)
+    except InvalidKeyError:
+        return course_key
+
+
+def operations_from_trace(records):
+    """
+    Yield the Operations recorded in trace ``records``.
+
+    Block keys are parsed back into keys for their scope where possible. Writes store
+    each field's value digest from the trace in place of its original value.
+    """
+    scopes = {scope.name: scope for scope in Scope.scopes()}
+    for record in records:
+        method = record['m']
+        scope = scopes[record.get('s', 'user_state')]
+        keys = [_parse_key(key, scope) for key in record.get('k', [])]
+        if method in ('get', 'get_many'):
+            yield Operation('get_many', {
+                'username': record['u'], 'block_keys': keys, 'scope': scope, 'fields': record.get('f'),
+            })
+        elif method in ('set', 'set_many', 'set_many_if_unmodified'):
+            yield Operation('set_many', {
+                'username': record['u'],
+                'block_keys_to_state': {
+                    _parse_key(key, scope): digests for key, digests in record.get('w', {}).items()
+                },
+                'scope': scope,
+            })
+        elif method in ('delete', 'delete_many'):
+            yield Operation('delete_many', {
+                'username': record['u'], 'block_keys': keys, 'scope': scope, 'fields': record.get('f'),
+            })
+        elif method == 'get_many_as_of':
+            yield Operation('get_many_as_of', {
+                'username': record['u'],
+                'block_keys': keys,
+                'timestamp': datetime.fromisoformat(record['at']),
+                'scope': scope,
+                'fields': record.get('f'),
+            })
+        elif method == 'get_history':
+            yield Operation('get_history', {'username': record['u'], 'block_key': keys[0], 'scope': scope})
+        elif method == 'iter_all_for_block':
+            yield Operation('iter_all_for_block', {'block_key': keys[0], 'scope': scope})
+        elif method == 'iter_all_for_blocks':
+            yield Operation('iter_all_for_blocks', {'block_keys': keys, 'scope': scope})
+        elif method == 'iter_all_for_course':
+            yield Operation('iter_all_for_course', {
+                'course_key': _parse_course_key(record['k'][0]),
+                'block_type': record.get('bt'),
+                'scope': scope,
+            })
+        elif method == 'iter_all_for_course_sorted':
+            yield Operation('iter_all_for_course_sorted', {
+                'course_key': _parse_course_key(record['k'][0]),
+                'block_type': record.get('bt'),
+                'scope': scope,
+                'order_by': record['o'],
+                'username_prefix': record.get('up'),
+            })
+        elif method == 'iter_chunks_for_blocks':
+            yield Operation('iter_chunks_for_blocks', {
+                'block_keys': keys,
+                'scope': scope,
+                'chunk_size': record['cs'],
+                'columnar': record.get('col', False),
+                'fields': record.get('f'),
+            })
+        elif method == 'iter_chunks_for_course':
+            yield Operation('iter_chunks_for_course', {
+                'course_key': _parse_course_key(record['k'][0]),
+                'block_type': record.get('bt'),
+                'scope': scope,
+                'chunk_size': record['cs'],
+                'columnar': record.get('col', False),
+                'fields': record.get('f'),
+            })
+
+
+class SyntheticWorkload():
+    """
+    A random mix of operations over ``users`` × ``courses`` × ``blocks_per_course``.
+
+    Usernames and keys follow the same scheme as the index helpers in
+    :class:`edx_user_state_client.tests._UserStateClientTestUtils`.
+
+    Arguments:
+        users (int): The number of users.
+        courses (int): The number of courses.
+        blocks_per_course (int): The number of blocks in each course.
+        mix (dict): Maps method names to their relative frequency.
+        keys_per_call (int): The most block keys in one ``get_many``, ``set_many`` or ``delete_many``.
+        fields_per_block (int): The number of fields written to each block.
+        seed: The seed for the random choices, so that runs can be repeated.
+    """
+
+    DEFAULT_MIX = {
+        'get_many': 70,
+        'set_many': 20,
+        'delete_many': 2,
+        'get_history': 5,
+        'iter_all_for_block': 2,
+        'iter_all_for_course': 1,
+    }
+
+    def __init__(self, users=100, courses=2, blocks_per_course=50, mix=None, keys_per_call=10,
+                 fields_per_block=4, seed=None):
+        self.users = users
+        self.courses = courses
+        self.blocks_per_course = blocks_per_course
+        self.mix = dict(mix or self.DEFAULT_MIX)
+        self.keys_per_call = keys_per_call
+        self.fields_per_block = fields_per_block
+        self._random = random.Random(seed)
+
+    @staticmethod
+    def username(user):
+        """Return the username for user ``user``."""
+        return f"user{user}"
+
+    @staticmethod
+    def course_key(course):
+        """Return the CourseKey for course ``course``."""
+        return CourseLocator(f'org{course}', f'course{course}', f'run{course}')
+
+    def block_key(self, course, block):
+        """Return the UsageKey for block ``block`` of course ``course``."""
+        return BlockUsageLocator(self.course_key(course), 'block_type', f'block{course * 1000 + block}')
+
+    def _state(self):
+        return {f'field{field}': self._random.randint(0, 100) for field in range(self.fields_per_block)}
+
+    def _block_keys(self, course):
+        count = self._random.randint(1, min(self.keys_per_call, self.blocks_per_course))
+        return [self.block_key(course, block) for block in self._random.sample(range(self.blocks_per_course), count)]
+
+    def populate(self, client, batch_size=1000):
+        """
+        Load a state for every user and block into ``client`` with ``bulk_load``.
+        """
+        now = datetime.now(pytz.utc)
+        return client.bulk_load(
+            (
+                XBlockUserState(self.username(user), self.block_key(course, block), self._state(), now, Scope.user_state)
+                for user in range(self.users)
+                for course in range(self.courses)
+                for block in range(self.blocks_per_course)
+            ),
+            batch_size,
+        )
+
+    def operation(self):
+        """
+        Return one random Operation.
+        """
+        method = self._random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        username = self.username(self._random.randrange(self.users))
+        course = self._random.randrange(self.courses)
+        if method == 'get_many':
+            return Operation(method, {'username': username, 'block_keys': self._block_keys(course)})
+        if method == 'set_many':
+            return Operation(method, {
+                'username': username,
+                'block_keys_to_state': {key: self._state() for key in self._block_keys(course)},
+            })
+        if method == 'delete_many':
+            return Operation(method, {'username': username, 'block_keys': self._block_keys(course)})
+        if method == 'get_history':
+            return Operation(method, {'username': username, 'block_key': self._block_keys(course)[0]})
+        if method == 'iter_all_for_block':
+            return Operation(method, {'block_key': self._block_keys(course)[0]})
+        if method == 'iter_all_for_course':
+            return Operation(method, {'course_key': self.course_key(course)})
+        raise ValueError(f'Unknown method {method!r} in workload mix')
+
+    def operations(self, count):
+        """
+        Yield ``count`` random Operations.
+        """
+        for _ in range(count):
+            yield self.operation()
+
+
+def _percentile(ordered, percent):
+    """
+    Return the nearest-rank ``percent`` percentile of the sorted list ``ordered``.
+    """
+    if not ordered:
+        return 0.0
+    index = max(int(round(percent / 100 * len(ordered))) - 1, 0)
+    return ordered[min(index, len(ordered) - 1)]
+
+
+class LoadReport():
+    """
+    Throughput and latency from a load run.
+
+    Attributes:
+        elapsed: The length of the run, in seconds.
+        latencies: Maps method names to lists of latencies, in seconds.
+        errors: Maps method names to the number of calls that raised.
+    """
+
+    def __init__(self, elapsed, latencies, errors):
+        self.elapsed = elapsed
+        self.latencies = latencies
+        self.errors = errors
+
+    @property
+    def total(self):
+        """The number of operations run."""
+        return sum(len(latencies) for latencies in self.latencies.values())
+
+    @property
+    def throughput(self):
+        """Operations per second."""
+        return self.total / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        """
+        Return a dict mapping each method (and ``'all'``) to its count, errors and p50/p95/p99 latency in ms.
+        """
+        summary = {}
+        groups = dict(self.latencies)
+        groups['all'] = [latency for latencies in self.latencies.values() for latency in latencies]
+        for method, latencies in groups.items():
+            ordered = sorted(latencies)
+            summary[method] = {
+                'count': len(ordered),
+                'errors': sum(self.errors.values()) if method == 'all' else self.errors.get(method, 0),
+                'p50_ms': round(_percentile(ordered, 50) * 1000, 3),
+                'p95_ms': round(_percentile(ordered, 95) * 1000, 3),
+                'p99_ms': round(_percentile(ordered, 99) * 1000, 3),
+            }
+        return summary
+
+    def format(self):
+        """
+        Return this report as human-readable text.
+        """
+        lines = [f'{self.total} operations in {self.elapsed:.2f}s ({self.throughput:.1f}/s)']
+        for method, stats in sorted(self.summary().items()):
+            lines.append(
+                f"{method:20} count={stats['count']} errors={stats['errors']} "
+                f"p50={stats['p50_ms']}ms p95={stats['p95_ms']}ms p99={stats['p99_ms']}ms"
+            )
+        return '\n'.join(lines)
+
+
+class _Recorder():
+    """
+    Thread-safe collection of latencies and errors.
+    """
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lock = threading.Lock()
+
+    def run(self, client, operation, scheduled):
+        """
+        Apply ``operation``, recording its latency from ``scheduled`` (a perf_counter time).
+        """
+        error = False
+        try:
+            operation.apply(client)
+        except Exception:  # pylint: disable=broad-except
+            error = True
+        latency = time.perf_counter() - scheduled
+        with self.lock:
+            self.latencies[operation.method].append(latency)
+            if error:
+                self.errors[operation.method] += 1
+
+
+def run_load(client, operations, concurrency=4, rate=None, duration=None, use_asyncio=False):
+    """
+    Run ``operations`` against ``client`` and report throughput and latency.
+
+    With a target ``rate``, operation ``i`` is scheduled at ``i / rate`` seconds after the
+    start, and its latency is measured from when it was scheduled rather than when a
+    worker got to it, so a backend that falls behind shows up in the tail latencies.
+
+    Arguments:
+        client (XBlockUserStateClient): The client to load.
+        operations: An iterable of :class:`Operation`.
+        concurrency (int): The number of worker threads, or asyncio tasks.
+        rate (float): The target number of operations per second, or None to run flat out.
+        duration (float): Stop scheduling new operations after this many seconds.
+        use_asyncio (bool): Run the workers as asyncio tasks, each calling the client on an executor thread.
+
+    Returns:
+        LoadReport
+    """
+    recorder = _Recorder()
+    operations = iter(operations)
+    counter = itertools.count()
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def next_operation():
+        """Return the next (operation, scheduled time), or None when the run is over."""
+        with lock:
+            operation = next(operations, None)
+            index = next(counter)
+        if operation is None:
+            return None
+        scheduled = start + index / rate if rate else time.perf_counter()
+        if duration is not None and scheduled - start > duration:
+            return None
+        return operation, scheduled
+
+    def worker():
+        while True:
+            item = next_operation()
+            if item is None:
+                return
+            operation, scheduled = item
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            recorder.run(client, operation, scheduled)
+
+    async def async_worker(loop, executor):
+        while True:
+            item = next_operation()
+            if item is None:
+                return
+            operation, scheduled = item
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await loop.run_in_executor(executor, recorder.run, client, operation, scheduled)
+
+    async def run_async():
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            await asyncio.gather(*[async_worker(loop, executor) for _ in range(concurrency)])
+
+    if use_asyncio:
+        asyncio.run(run_async())
+    else:
+        threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    return LoadReport(time.perf_counter() - start, dict(recorder.latencies), dict(recorder.errors))
+
+
+def _load_client(spec):
+    """
+    Return the client made by calling the ``module:callable`` named by ``spec``.
+    """
+    module_name, _, attribute = spec.partition(':')
+    return getattr(importlib.import_module(module_name), attribute)()
+
+
+def main(argv=None):
+    """
+    Run a load test as described by ``argv``, and print its report.
+    """
+    parser = argparse.ArgumentParser(description='Generate load against an XBlockUserStateClient.')
+    parser.add_argument('--client', required=True,
+                        help='module:callable returning the XBlockUserStateClient to load')
+    parser.add_argument('--trace', nargs='*', help='Trace files to replay instead of a synthetic workload')
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--courses', type=int, default=2)
+    parser.add_argument('--blocks', type=int, default=50, help='Blocks per course')
+    parser.add_argument('--operations', type=int, default=10000, help='Synthetic operations to run')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--populate', action='store_true', help='Bulk load every synthetic block first')
+    parser.add_argument('--concurrency', type=int, default=4, help='Worker threads or asyncio tasks')
+    parser.add_argument('--asyncio', action='store_true', help='Use asyncio tasks rather than threads')
+    parser.add_argument('--rate', type=float, default=None, help='Target operations per second')
+    parser.add_argument('--duration', type=float, default=None, help='Stop after this many seconds')
+    args = parser.parse_args(argv)
+
+    client = _load_client(args.client)
+    if args.trace:
+        operations = operations_from_trace(read_trace(args.trace))
+    else:
+        workload = SyntheticWorkload(args.users, args.courses, args.blocks, seed=args.seed)
+        if args.populate:
+            workload.populate(client)
+        operations = workload.operations(args.operations)
+
+    report = run_load(client, operations, args.concurrency, args.rate, args.duration, args.asyncio)
+    print(report.format())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""
+The orders that :meth:`~edx_user_state_client.interface.XBlockUserStateClient.iter_all_for_course_sorted`
+can yield state in, and a streaming merge-join over sorted iterators.
+"""
+
+from itertools import groupby
+
+# Sort by username, then block key.
+ORDER_BY_USERNAME = 'username'
+# Sort by block key, then username.
+ORDER_BY_BLOCK = 'block_key'
+
+ORDERS = (ORDER_BY_USERNAME, ORDER_BY_BLOCK)
+
+
+def check_order(order_by):
+    """
+    Raise ValueError if ``order_by`` isn't one of :data:`ORDERS`.
+    """
+    if order_by not in ORDERS:
+        raise ValueError(f'Unknown order {order_by!r}; expected one of {ORDERS!r}')
+
+
+def entry_sort_key(order_by):
+    """
+    Return a function mapping an XBlockUserState to the key it is sorted by for ``order_by``.
+
+    Block keys are compared as strings, so that keys of different types (and the
+    string keys of scopes other than ``Scope.user_state``) can be ordered, and so
+    that the order matches a database column holding the serialized key.
+    """
+    check_order(order_by)
+    if order_by == ORDER_BY_USERNAME:
+        return lambda entry: (entry.username, str(entry.block_key))
+    return lambda entry: (str(entry.block_key), entry.username)
+
+
+def _sorted_groups(items, key, side):
+    """
+    Yield ``(key, items)`` for each run of ``items`` with the same key, checking that the keys increase.
+    """
+    previous = None
+    for group_key, group in groupby(items, key):
+        if previous is not None and not previous[0] < group_key:
+            raise ValueError(f'The {side} items of merge_join are not sorted: {group_key!r} follows {previous[0]!r}')
+        previous = (group_key,)
+        yield group_key, list(group)
+
+
+def merge_join(left, right, left_key, right_key=None):
+    """
+    Join two iterables that are sorted by the same key, holding only one key's items of each in memory.
+
+    For example, to join a course's state with its enrollments, both sorted by username::
+
+        for username, entries, enrollments in merge_join(
+            client.iter_all_for_course_sorted(course_key, order_by=ORDER_BY_USERNAME),
+            enrollments_sorted_by_username,
+            lambda entry: entry.username,
+            lambda enrollment: enrollment.username,
+        ):
+            ...
+
+    Arguments:
+        left: An iterable sorted by ``left_key``.
+        right: An iterable sorted by ``right_key``.
+        left_key: A function returning the join key of an item of ``left``.
+        right_key: A function returning the join key of an item of ``right``, or None to use ``left_key``.
+
+    Yields:
+        ``(key, left_items, right_items)`` for every key of either side, in order, where
+        ``left_items`` and ``right_items`` are the (possibly empty) lists of items with that key.
+
+    Raises:
+        ValueError if either side isn't sorted by its key.
+    """
+    left_groups = _sorted_groups(left, left_key, 'left')
+    right_groups = _sorted_groups(right, left_key if right_key is None else right_key, 'right')
+    left_group = next(left_groups, None)
+    right_group = next(right_groups, None)
+    while left_group is not None or right_group is not None:
+        if right_group is None or (left_group is not None and left_group[0] < right_group[0]):
+            yield left_group[0], left_group[1], []
+            left_group = next(left_groups, None)
+        elif left_group is None or right_group[0] < left_group[0]:
+            yield right_group[0], [], right_group[1]
+            right_group = next(right_groups, None)
+        else:
+            yield left_group[0], left_group[1], right_group[1]
+            left_group = next(left_groups, None)
+            right_group = next(right_groups, None)
@@ -0,0 +1,311 @@
+"""
+An XBlockUserStateClient that accounts for the size of stored state per user, block
+and course, and enforces size quotas at write time.
+"""
+
+import heapq
+import json
+import threading
+from collections import Counter
+
+from edx_user_state_client.interface import resolve_scope
+from edx_user_state_client.wrapper import XBlockUserStateClientWrapper
+
+
+def field_size(field, value):
+    """
+    Return the number of bytes field ``field`` with ``value`` takes when serialized as JSON.
+    """
+    return len(field.encode()) + len(json.dumps(value, separators=(',', ':'), default=str).encode())
+
+
+class SizeAccountingUserStateClient(XBlockUserStateClientWrapper):
+    """
+    Track the serialized size of every block's state, and the totals per user, block and course.
+
+    Sizes are kept per field, so each write only adjusts the fields it touches. The
+    first write to a block that isn't tracked yet reads its stored state (one
+    ``get_many`` for all such blocks in the write) to learn its size;
+    :meth:`scan_course` learns the size of every block in a course at once. Totals
+    only count tracked blocks.
+
+    A write that would take a block, a user or a course over its quota raises
+    :class:`~edx_user_state_client.interface.XBlockUserStateClient.QuotaExceeded`
+    and writes nothing. Writes that don't grow the total are always allowed, so
+    state that is already over a quota can still be shrunk. ``bulk_load`` is not
+    checked against quotas, and the blocks it loads stop being tracked.
+
+    Arguments:
+        client (XBlockUserStateClient): The client to read from and write to.
+        max_block_bytes (int): The most bytes one user's state for one block may take, or None.
+        max_user_bytes (int): The most bytes all of one user's state may take, or None.
+        max_course_bytes (int): The most bytes all users' state in one course may take, or None.
+        sizer: Called with a field name and value to return its size in bytes.
+    """
+
+    def __init__(self, client, max_block_bytes=None, max_user_bytes=None, max_course_bytes=None,
+                 sizer=field_size):
+        super().__init__(client)
+        self.max_block_bytes = max_block_bytes
+        self.max_user_bytes = max_user_bytes
+        self.max_course_bytes = max_course_bytes
+        self.sizer = sizer
+        self._lock = threading.Lock()
+        # Maps (username, block_key, scope) to dicts mapping field names to sizes.
+        self._fields = {}
+        self._users = Counter()
+        self._blocks = Counter()
+        self._courses = Counter()
+
+    def user_bytes(self, username):
+        """Return the tracked size of ``username``'s state."""
+        return self._users[username]
+
+    def block_bytes(self, block_key):
+        """Return the tracked size of all users' state for ``block_key``."""
+        return self._blocks[block_key]
+
+    def course_bytes(self, course_key):
+        """Return the tracked size of all users' state in ``course_key``."""
+        return self._courses[course_key]
+
+    @staticmethod
+    def _top(totals, count):
+        with_sizes = [(key, size) for key, size in totals.items() if size]
+        return heapq.nlargest(count, with_sizes, key=lambda item: item[1])
+
+    def top_users(self, count=10):
+        """
+        Return the ``count`` users with the most state, as a list of (username, bytes).
+        """
+        with self._lock:
+            return self._top(self._users, count)
+
+    def top_blocks(self, count=10):
+        """
+        Return the ``count`` blocks with the most state across users, as a list of (block_key, bytes).
+        """
+        with self._lock:
+            return self._top(self._blocks, count)
+
+    def top_courses(self, count=10):
+        """
+        Return the ``count`` courses with the most state, as a list of (course_key, bytes).
+        """
+        with self._lock:
+            return self._top(self._courses, count)
+
+    def _sizes(self, state):
+        return {field: self.sizer(field, value) for field, value in state.items()}
+
+    def _replace(self, username, block_key, scope, sizes):
+        """
+        Set the tracked field sizes of a block, adjusting the totals. ``sizes`` of None stops tracking it.
+        """
+        tracked_key = (username, block_key, scope)
+        old = self._fields.pop(tracked_key, None)
+        delta = (sum(sizes.values()) if sizes is not None else 0) - (sum(old.values()) if old is not None else 0)
+        if sizes is not None:
+            self._fields[tracked_key] = sizes
+        self._users[username] += delta
+        self._blocks[block_key] += delta
+        course_key = getattr(block_key, 'course_key', None)
+        if course_key is not None:
+            self._courses[course_key] += delta
+
+    def _track(self, username, block_keys, scope):
+        """
+        Learn the sizes of any of ``block_keys`` that aren't tracked yet.
+        """
+        with self._lock:
+            untracked = [key for key in block_keys if (username, key, scope) not in self._fields]
+        if not untracked:
+            return
+        stored = {entry.block_key: entry.state for entry in self._client.get_many(username, untracked, scope)}
+        with self._lock:
+            for key in untracked:
+                if (username, key, scope) not in self._fields:
+                    self._replace(username, key, scope, self._sizes(stored.get(key, {})))
+
+    def _check(self, username, new_sizes):
+        """
+        Raise QuotaExceeded if replacing tracked block sizes with ``new_sizes`` would go over a quota.
+
+        ``new_sizes`` maps (username, block_key, scope) to total block sizes.
+        """
+        user_delta = 0
+        course_deltas = Counter()
+        for tracked_key, size in new_sizes.items():
+            block_key = tracked_key[1]
+            delta = size - sum(self._fields.get(tracked_key, {}).values())
+            if self.max_block_bytes is not None and delta > 0 and size > self.max_block_bytes:
+                raise self.QuotaExceeded(
+                    f'State for {block_key} would take {size} bytes, over the quota of {self.max_block_bytes}'
+                )
+            user_delta += delta
+            course_key = getattr(block_key, 'course_key', None)
+            if course_key is not None:
+                course_deltas[course_key] += delta
+        if self.max_user_bytes is not None and user_delta > 0:
+            size = self._users[username] + user_delta
+            if size > self.max_user_bytes:
+                raise self.QuotaExceeded(
+                    f'State for {username} would take {size} bytes, over the quota of {self.max_user_bytes}'
+                )
+        if self.max_course_bytes is not None:
+            for course_key, delta in course_deltas.items():
+                size = self._courses[course_key] + delta
+                if delta > 0 and size > self.max_course_bytes:
+                    raise self.QuotaExceeded(
+                        f'State in {course_key} would take {size} bytes, over the quota of {self.max_course_bytes}'
+                    )
+
+    def _accounted_write(self, username, block_keys_to_state, scope, write):
+        """
+        Check ``block_keys_to_state`` against the quotas, then account for it and call ``write()``.
+        """
+        self._track(username, list(block_keys_to_state), scope)
+        with self._lock:
+            updated = {}
+            for key, state in block_keys_to_state.items():
+                tracked_key = (username, key, scope)
+                sizes = dict(self._fields.get(tracked_key, {}))
+                sizes.update(self._sizes(state))
+                updated[tracked_key] = sizes
+            self._check(username, {tracked_key: sum(sizes.values()) for tracked_key, sizes in updated.items()})
+            for (_, key, _), sizes in updated.items():
+                self._replace(username, key, scope, sizes)
+        try:
+            return write()
+        except Exception:
+            # The write may have partly happened, or not at all; learn the sizes again next time.
+            with self._lock:
+                for key in block_keys_to_state:
+                    self._replace(username, key, scope, None)
+            raise
+
+    def set_many(self, username, block_keys_to_state, scope=None):
+        scope = resolve_scope(scope)
+        return self._accounted_write(
+            username, block_keys_to_state, scope,
+            lambda: self._client.set_many(username, block_keys_to_state, scope),
+        )
+
+    def set_many_if_unmodified(self, username, block_keys_to_state, expected_updated, scope=None):
+        scope = resolve_scope(scope)
+        return self._accounted_write(
+            username, block_keys_to_state, scope,
+            lambda: self._client.set_many_if_unmodified(username, block_keys_to_state, expected_updated, scope),
+        )
+
+    def delete_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        block_keys = list(block_keys)
+        try:
+            result = self._client.delete_many(username, block_keys, scope, fields=fields)
+        except Exception:
+            with self._lock:
+                for key in block_keys:
+                    self._replace(username, key, scope, None)
+            raise
+        with self._lock:
+            for key in block_keys:
+                tracked_key = (username, key, scope)
+                if tracked_key not in self._fields:
+                    continue
+                if fields is None:
+                    self._replace(username, key, scope, {})
+                else:
+                    sizes = {
+                        field: size for field, size in self._fields[tracked_key].items() if field not in fields
+                    }
+                    self._replace(username, key, scope, sizes)
+        return result
+
+    def bulk_load(self, entries, batch_size=1000):
+        loaded = set()
+
+        def noting_keys():
+            for entry in entries:
+                loaded.add((entry.username, entry.block_key, entry.scope))
+                yield entry
+
+        try:
+            return self._client.bulk_load(noting_keys(), batch_size)
+        finally:
+            with self._lock:
+                for username, block_key, scope in loaded:
+                    self._replace(username, block_key, scope, None)
+
+    def _delete_all(self, scope, matches, delete):
+        """
+        Call ``delete()``, then zero the tracked blocks in ``scope`` for which ``matches(username, block_key)``.
+
+        If ``delete()`` raises, those blocks stop being tracked instead.
+        """
+        try:
+            result = delete()
+        except Exception:
+            self._replace_matching(scope, matches, None)
+            raise
+        self._replace_matching(scope, matches, {})
+        return result
+
+    def _replace_matching(self, scope, matches, sizes):
+        with self._lock:
+            for username, block_key, one_scope in list(self._fields):
+                if one_scope == scope and matches(username, block_key):
+                    self._replace(username, block_key, scope, None if sizes is None else dict(sizes))
+
+    def delete_all_for_user(self, username, course_keys=None, scope=None, purge_history=False,
+                            batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        course_keys = None if course_keys is None else set(course_keys)
+        return self._delete_all(
+            scope,
+            lambda one_username, block_key: one_username == username and (
+                course_keys is None or getattr(block_key, 'course_key', None) in course_keys
+            ),
+            lambda: self._client.delete_all_for_user(
+                username, course_keys, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+            ),
+        )
+
+    def delete_all_for_block(self, block_key, scope=None, purge_history=False, batch_size=1000,
+                             progress=None):
+        scope = resolve_scope(scope)
+        return self._delete_all(
+            scope,
+            lambda _, one_block_key: one_block_key == block_key,
+            lambda: self._client.delete_all_for_block(
+                block_key, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+            ),
+        )
+
+    def delete_all_for_course(self, course_key, block_type=None, scope=None, purge_history=False,
+                              batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        return self._delete_all(
+            scope,
+            lambda _, block_key: getattr(block_key, 'course_key', None) == course_key and (
+                block_type is None or block_key.block_type == block_type
+            ),
+            lambda: self._client.delete_all_for_course(
+                course_key, block_type, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+            ),
+        )
+
+    def scan_course(self, course_key, block_type=None, scope=None):
+        """
+        Learn the size of every block in ``course_key`` (of ``block_type``, if given).
+
+        Returns:
+            int: The number of blocks scanned.
+        """
+        scope = resolve_scope(scope)
+        count = 0
+        for entry in self._client.iter_all_for_course(course_key, block_type, scope):
+            with self._lock:
+                self._replace(entry.username, entry.block_key, entry.scope, self._sizes(entry.state))
+            count += 1
+        return count
@@ -0,0 +1,188 @@
+"""
+An XBlockUserStateClient that sends writes to a primary and reads to read replicas.
+"""
+
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+from edx_user_state_client.interface import XBlockUserStateClient, resolve_scope
+from edx_user_state_client.ordering import ORDER_BY_USERNAME
+
+
+class ReplicaRoutingUserStateClient(XBlockUserStateClient):
+    """
+    Route writes to a primary client, and reads to replica clients where that is safe.
+
+    * ``set_many``, ``set_many_if_unmodified``, ``delete_many``, the ``delete_all_*``
+      methods and ``bulk_load`` go to the primary.
+    * The ``iter_*`` methods and ``snapshot`` go to the replicas in turn, so
+      analytics scans don't load the primary.
+    * ``get_many`` and ``get_history`` also go to the replicas, except that a user who
+      wrote through this client within the last ``read_your_writes_window`` seconds is
+      kept on the primary, so they always see their own writes despite replication lag.
+      ``delete_all_for_block`` and ``delete_all_for_course`` don't say which users they
+      affected, so after one of them every user is kept on the primary for the window.
+
+    Writes made through other processes aren't tracked, so the window should be
+    longer than the replication lag users can notice within one process.
+
+    Arguments:
+        primary (XBlockUserStateClient): The client for the primary store.
+        replicas (list): Clients for the read replicas. If empty, everything goes to the primary.
+        read_your_writes_window (float): How long to keep a user on the primary after a write, in seconds.
+        clock: A function returning the current time in seconds.
+    """
+
+    def __init__(self, primary, replicas, read_your_writes_window=5, clock=time.monotonic):
+        self.primary = primary
+        self.replicas = list(replicas)
+        self.read_your_writes_window = read_your_writes_window
+        self.clock = clock
+        self._next_replica = itertools.cycle(self.replicas or [primary])
+        self._lock = threading.Lock()
+        # Users by the time of their last write, oldest first, so that expired writes can be
+        # dropped from the front.
+        self._last_writes = OrderedDict()
+        self._everyone_written = None
+
+    def _replica(self):
+        with self._lock:
+            return next(self._next_replica)
+
+    def _note_write(self, username):
+        now = self.clock()
+        with self._lock:
+            self._last_writes[username] = now
+            self._last_writes.move_to_end(username)
+            cutoff = now - self.read_your_writes_window
+            while self._last_writes and next(iter(self._last_writes.values())) <= cutoff:
+                self._last_writes.popitem(last=False)
+
+    def _note_write_for_everyone(self):
+        now = self.clock()
+        with self._lock:
+            self._everyone_written = now
+
+    def client_for_user(self, username):
+        """
+        Return the client that reads for ``username`` should go to.
+        """
+        with self._lock:
+            last_writes = (self._last_writes.get(username), self._everyone_written)
+        now = self.clock()
+        if any(when is not None and now - when < self.read_your_writes_window for when in last_writes):
+            return self.primary
+        return self._replica()
+
+    def get_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        return self.client_for_user(username).get_many(username, block_keys, scope, fields=fields)
+
+    def set_many(self, username, block_keys_to_state, scope=None):
+        scope = resolve_scope(scope)
+        try:
+            return self.primary.set_many(username, block_keys_to_state, scope)
+        finally:
+            self._note_write(username)
+
+    def set_many_if_unmodified(self, username, block_keys_to_state, expected_updated, scope=None):
+        scope = resolve_scope(scope)
+        try:
+            return self.primary.set_many_if_unmodified(username, block_keys_to_state, expected_updated, scope)
+        finally:
+            self._note_write(username)
+
+    def delete_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        try:
+            return self.primary.delete_many(username, block_keys, scope, fields=fields)
+        finally:
+            self._note_write(username)
+
+    def bulk_load(self, entries, batch_size=1000):
+        def noting_writes():
+            for entry in entries:
+                self._note_write(entry.username)
+                yield entry
+
+        return self.primary.bulk_load(noting_writes(), batch_size)
+
+    def delete_all_for_user(self, username, course_keys=None, scope=None, purge_history=False,
+                            batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        try:
+            return self.primary.delete_all_for_user(
+                username, course_keys, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+            )
+        finally:
+            self._note_write(username)
+
+    def delete_all_for_block(self, block_key, scope=None, purge_history=False, batch_size=1000,
+                             progress=None):
+        scope = resolve_scope(scope)
+        try:
+            return self.primary.delete_all_for_block(
+                block_key, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+            )
+        finally:
+            self._note_write_for_everyone()
+
+    def delete_all_for_course(self, course_key, block_type=None, scope=None, purge_history=False,
+                              batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        try:
+            return self.primary.delete_all_for_course(
+                course_key, block_type, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+            )
+        finally:
+            self._note_write_for_everyone()
+
+    def snapshot(self):
+        """
+        Return a snapshot of the next replica. It may not include a user's latest writes,
+        however recent they are.
+        """
+        return self._replica().snapshot()
+
+    def get_history(self, username, block_key, scope=None):
+        scope = resolve_scope(scope)
+        return self.client_for_user(username).get_history(username, block_key, scope)
+
+    def get_many_as_of(self, username, block_keys, timestamp, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        return self.client_for_user(username).get_many_as_of(username, block_keys, timestamp, scope, fields=fields)
+
+    def iter_all_for_block(self, block_key, scope=None):
+        scope = resolve_scope(scope)
+        return self._replica().iter_all_for_block(block_key, scope)
+
+    def iter_all_for_blocks(self, block_keys, scope=None):
+        scope = resolve_scope(scope)
+        return self._replica().iter_all_for_blocks(block_keys, scope)
+
+    def iter_chunks_for_blocks(self, block_keys, scope=None, chunk_size=1000, columnar=False,
+                               fields=None):
+        scope = resolve_scope(scope)
+        return self._replica().iter_chunks_for_blocks(
+            block_keys, scope, chunk_size=chunk_size, columnar=columnar, fields=fields
+        )
+
+    def iter_all_for_course(self, course_key, block_type=None, scope=None):
+        scope = resolve_scope(scope)
+        return self._replica().iter_all_for_course(course_key, block_type, scope)
+
+    def iter_chunks_for_course(self, course_key, block_type=None, scope=None, chunk_size=1000,
+                               columnar=False, fields=None):
+        scope = resolve_scope(scope)
+        return self._replica().iter_chunks_for_course(
+            course_key, block_type, scope, chunk_size=chunk_size, columnar=columnar, fields=fields
+        )
+
+    def iter_all_for_course_sorted(self, course_key, block_type=None, scope=None,
+                                   order_by=ORDER_BY_USERNAME, username_prefix=None):
+        scope = resolve_scope(scope)
+        return self._replica().iter_all_for_course_sorted(
+            course_key, block_type, scope, order_by=order_by, username_prefix=username_prefix
+        )
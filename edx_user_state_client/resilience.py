@@ -0,0 +1,268 @@
+"""
+An XBlockUserStateClient that retries, times out and hedges reads when the backend
+raises :class:`~edx_user_state_client.interface.XBlockUserStateClient.ServiceUnavailable`
+or is slow.
+"""
+
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from edx_user_state_client.chunks import check_chunk_size
+from edx_user_state_client.interface import resolve_scope
+from edx_user_state_client.ordering import ORDER_BY_USERNAME
+from edx_user_state_client.wrapper import XBlockUserStateClientWrapper
+
+_END = object()
+
+
+class ResilientUserStateClient(XBlockUserStateClientWrapper):
+    """
+    Add deadlines, retries and hedged reads in front of an XBlockUserStateClient.
+
+    * Idempotent reads (``get_many``, ``get_many_as_of``, ``get_history`` and the ``iter_*`` methods)
+      that raise ``ServiceUnavailable`` are retried up to ``retries`` times, sleeping a
+      random time between 0 and an exponentially growing cap before each retry ("full
+      jitter"). Iterators are only retried until they produce their first item, so no
+      item is ever repeated. Writes are never retried.
+    * ``deadline`` bounds the total time a call may take, including retries. When there
+      is a deadline or a hedge delay, ``get_many`` runs on a worker thread so that it can
+      be abandoned; otherwise it runs on the calling thread. Other calls stop retrying
+      once the next retry would overrun the deadline.
+    * If a ``replica`` is given, a ``get_many`` that hasn't finished within the
+      ``hedge_percentile`` of recent ``get_many`` latencies is also sent to the replica,
+      and whichever answers first wins. A ``get_many`` that the primary fails with
+      ``ServiceUnavailable`` goes to the replica at once.
+
+    An abandoned read keeps its worker until it finishes. While every worker is held by
+    one, ``get_many`` raises ``ServiceUnavailable`` rather than queueing behind them.
+
+    Arguments:
+        client (XBlockUserStateClient): The client to read from and write to.
+        retries (int): How many times to retry a read that raised ServiceUnavailable.
+        backoff_base (float): The cap on the first retry's delay, in seconds. It doubles for each retry.
+        backoff_max (float): The largest cap on a retry's delay, in seconds.
+        deadline (float): The most time one call may take, in seconds, or None for no limit.
+        replica (XBlockUserStateClient): A client for a replica to send hedged ``get_many`` calls to.
+        hedge_percentile (float): The latency percentile after which a ``get_many`` is hedged.
+        hedge_min_samples (int): How many latencies to observe before hedging.
+        latency_window (int): How many recent latencies the percentile is computed over.
+        max_workers (int): The number of worker threads for ``get_many``.
+        sleep: The function used to wait between retries.
+    """
+
+    def __init__(self, client, retries=3, backoff_base=0.05, backoff_max=1.0, deadline=None,
+                 replica=None, hedge_percentile=95, hedge_min_samples=20, latency_window=1000,
+                 max_workers=8, sleep=time.sleep):
+        super().__init__(client)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self.replica = replica
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.max_workers = max_workers
+        self._latencies = deque(maxlen=latency_window)
+        self._latencies_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='user-state-read')
+        # The number of reads that were given up on but are still running on a worker.
+        self._abandoned = 0
+        self._abandoned_lock = threading.Lock()
+        self._random = random.Random()
+        self._sleep = sleep
+
+    def close(self):
+        """
+        Shut down the worker threads used for ``get_many``.
+        """
+        self._executor.shutdown(wait=False)
+
+    def _deadline_at(self):
+        if self.deadline is None:
+            return None
+        return time.monotonic() + self.deadline
+
+    @staticmethod
+    def _remaining(deadline_at):
+        if deadline_at is None:
+            return None
+        return max(deadline_at - time.monotonic(), 0)
+
+    def _retry(self, operation, deadline_at):
+        """
+        Call ``operation()``, retrying with jittered exponential backoff while it raises ServiceUnavailable.
+        """
+        attempt = 0
+        while True:
+            try:
+                return operation()
+            except self.ServiceUnavailable:
+                if attempt >= self.retries:
+                    raise
+                delay = self._random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+                if deadline_at is not None and time.monotonic() + delay >= deadline_at:
+                    raise
+                attempt += 1
+                self._sleep(delay)
+
+    def hedge_delay(self):
+        """
+        Return how long to wait for the primary before hedging a ``get_many``, or None to not hedge.
+        """
+        if self.replica is None:
+            return None
+        with self._latencies_lock:
+            if len(self._latencies) < self.hedge_min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        index = min(int(len(latencies) * self.hedge_percentile / 100), len(latencies) - 1)
+        return latencies[index]
+
+    def _timed_read(self, username, block_keys, scope, fields):
+        start = time.monotonic()
+        entries = list(self._client.get_many(username, block_keys, scope, fields=fields))
+        with self._latencies_lock:
+            self._latencies.append(time.monotonic() - start)
+        return entries
+
+    def _replica_read(self, username, block_keys, scope, fields):
+        return list(self.replica.get_many(username, block_keys, scope, fields=fields))
+
+    def _submit(self, function, *args):
+        """
+        Run ``function(*args)`` on a worker, unless every worker is held by an abandoned read.
+        """
+        with self._abandoned_lock:
+            if self._abandoned >= self.max_workers:
+                raise self.ServiceUnavailable('Every worker is still running an abandoned read')
+        return self._executor.submit(function, *args)
+
+    def _abandon(self, future):
+        """
+        Give up on ``future``, cancelling it if it hasn't started, and counting it until it finishes if it has.
+        """
+        if future.cancel():
+            return
+        with self._abandoned_lock:
+            self._abandoned += 1
+        future.add_done_callback(self._abandoned_done)
+
+    def _abandoned_done(self, future):  # pylint: disable=unused-argument
+        with self._abandoned_lock:
+            self._abandoned -= 1
+
+    def _read_once(self, username, block_keys, scope, fields, deadline_at):
+        """
+        Read ``block_keys`` from the primary, hedging to the replica if it is slow or fails.
+        """
+        hedge_delay = self.hedge_delay()
+        if hedge_delay is None and deadline_at is None:
+            try:
+                return self._timed_read(username, block_keys, scope, fields)
+            except self.ServiceUnavailable:
+                if self.replica is None:
+                    raise
+                return self._replica_read(username, block_keys, scope, fields)
+
+        futures = [self._submit(self._timed_read, username, block_keys, scope, fields)]
+        hedged = False
+        try:
+            if hedge_delay is not None:
+                remaining = self._remaining(deadline_at)
+                done, _ = wait(futures, timeout=hedge_delay if remaining is None else min(hedge_delay, remaining))
+                if not done:
+                    futures.append(self._submit(self._replica_read, username, block_keys, scope, fields))
+                    hedged = True
+
+            error = None
+            while futures:
+                done, _ = wait(futures, timeout=self._remaining(deadline_at), return_when=FIRST_COMPLETED)
+                if not done:
+                    raise self.ServiceUnavailable('Deadline exceeded reading user state')
+                for future in done:
+                    futures.remove(future)
+                    try:
+                        return future.result()
+                    except self.ServiceUnavailable as exception:
+                        error = exception
+                if self.replica is not None and not hedged:
+                    futures.append(self._submit(self._replica_read, username, block_keys, scope, fields))
+                    hedged = True
+            raise error
+        finally:
+            for future in futures:
+                self._abandon(future)
+
+    def get_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        block_keys = list(block_keys)
+        deadline_at = self._deadline_at()
+        yield from self._retry(
+            lambda: self._read_once(username, block_keys, scope, fields, deadline_at),
+            deadline_at,
+        )
+
+    def _retrying_iter(self, make_iterator):
+        """
+        Yield from ``make_iterator()``, retrying until it produces its first item.
+        """
+        def start():
+            iterator = iter(make_iterator())
+            return iterator, next(iterator, _END)
+
+        iterator, first = self._retry(start, self._deadline_at())
+        if first is _END:
+            return
+        yield first
+        yield from iterator
+
+    def get_history(self, username, block_key, scope=None):
+        scope = resolve_scope(scope)
+        return self._retrying_iter(lambda: self._client.get_history(username, block_key, scope))
+
+    def get_many_as_of(self, username, block_keys, timestamp, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        block_keys = list(block_keys)
+        return self._retrying_iter(lambda: self._client.get_many_as_of(
+            username, block_keys, timestamp, scope, fields=fields
+        ))
+
+    def iter_all_for_block(self, block_key, scope=None):
+        scope = resolve_scope(scope)
+        return self._retrying_iter(lambda: self._client.iter_all_for_block(block_key, scope))
+
+    def iter_all_for_blocks(self, block_keys, scope=None):
+        scope = resolve_scope(scope)
+        block_keys = list(block_keys)
+        return self._retrying_iter(lambda: self._client.iter_all_for_blocks(block_keys, scope))
+
+    def iter_chunks_for_blocks(self, block_keys, scope=None, chunk_size=1000, columnar=False,
+                               fields=None):
+        scope = resolve_scope(scope)
+        block_keys = list(block_keys)
+        check_chunk_size(chunk_size)
+        return self._retrying_iter(lambda: self._client.iter_chunks_for_blocks(
+            block_keys, scope, chunk_size=chunk_size, columnar=columnar, fields=fields
+        ))
+
+    def iter_all_for_course(self, course_key, block_type=None, scope=None):
+        scope = resolve_scope(scope)
+        return self._retrying_iter(lambda: self._client.iter_all_for_course(course_key, block_type, scope))
+
+    def iter_chunks_for_course(self, course_key, block_type=None, scope=None, chunk_size=1000,
+                               columnar=False, fields=None):
+        scope = resolve_scope(scope)
+        check_chunk_size(chunk_size)
+        return self._retrying_iter(lambda: self._client.iter_chunks_for_course(
+            course_key, block_type, scope, chunk_size=chunk_size, columnar=columnar, fields=fields
+        ))
+
+    def iter_all_for_course_sorted(self, course_key, block_type=None, scope=None,
+                                   order_by=ORDER_BY_USERNAME, username_prefix=None):
+        scope = resolve_scope(scope)
+        return self._retrying_iter(lambda: self._client.iter_all_for_course_sorted(
+            course_key, block_type, scope, order_by=order_by, username_prefix=username_prefix
+        ))
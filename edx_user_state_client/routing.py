@@ -0,0 +1,168 @@
+"""
+An XBlockUserStateClient that sends each :class:`~xblock.fields.Scope` to its own store.
+"""
+
+from itertools import islice
+
+from edx_user_state_client.interface import XBlockUserStateClient, resolve_scope
+from edx_user_state_client.ordering import ORDER_BY_USERNAME
+from edx_user_state_client.snapshots import ReadOnlyUserStateClient
+
+
+class ScopeRoutingUserStateClient(XBlockUserStateClient):
+    """
+    Dispatch each call to the client configured for its scope.
+
+    Scopes differ a lot in size and access pattern: ``preferences`` is small, hot and
+    keyed by block type, while ``user_state`` is large, high-churn and keyed by usage.
+    Routing them to separate clients lets each have its own store and cache policy,
+    so bulk problem state can't evict hot preferences. For example::
+
+        ScopeRoutingUserStateClient({
+            Scope.user_state: StudentModuleClient(),
+            Scope.preferences: CachedUserStateClient(PreferencesClient(), max_entries=50000),
+            Scope.user_info: CachedUserStateClient(UserInfoClient(), max_entries=10000),
+        })
+
+    Arguments:
+        routes (dict): A dict mapping :class:`~xblock.fields.Scope` to the XBlockUserStateClient
+            that stores data for that scope.
+        default (XBlockUserStateClient): The client used for scopes not in ``routes``.
+            If None, using an unrouted scope raises :class:`ValueError`.
+    """
+
+    def __init__(self, routes, default=None):
+        self._routes = dict(routes)
+        self._default = default
+
+    def client_for_scope(self, scope):
+        """
+        Return the XBlockUserStateClient that stores data for ``scope``.
+
+        Raises:
+            ValueError if no client is configured for ``scope``.
+        """
+        client = self._routes.get(scope, self._default)
+        if client is None:
+            raise ValueError(f"No XBlockUserStateClient is configured for scope {scope!r}")
+        return client
+
+    def get_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        return self.client_for_scope(scope).get_many(username, block_keys, scope, fields=fields)
+
+    def set_many(self, username, block_keys_to_state, scope=None):
+        scope = resolve_scope(scope)
+        return self.client_for_scope(scope).set_many(username, block_keys_to_state, scope)
+
+    def set_many_if_unmodified(self, username, block_keys_to_state, expected_updated, scope=None):
+        scope = resolve_scope(scope)
+        return self.client_for_scope(scope).set_many_if_unmodified(
+            username, block_keys_to_state, expected_updated, scope
+        )
+
+    def delete_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        return self.client_for_scope(scope).delete_many(username, block_keys, scope, fields=fields)
+
+    def bulk_load(self, entries, batch_size=1000):
+        """
+        Load ``entries`` in batches of ``batch_size``, passing the entries of each scope
+        in a batch to that scope's client.
+        """
+        count = 0
+        entries = iter(entries)
+        while True:
+            batch = list(islice(entries, batch_size))
+            if not batch:
+                return count
+            by_scope = {}
+            for entry in batch:
+                by_scope.setdefault(entry.scope, []).append(entry)
+            for scope, scope_entries in by_scope.items():
+                count += self.client_for_scope(scope).bulk_load(scope_entries, batch_size)
+
+    def delete_all_for_user(self, username, course_keys=None, scope=None, purge_history=False,
+                            batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        return self.client_for_scope(scope).delete_all_for_user(
+            username, course_keys, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+        )
+
+    def delete_all_for_block(self, block_key, scope=None, purge_history=False, batch_size=1000,
+                             progress=None):
+        scope = resolve_scope(scope)
+        return self.client_for_scope(scope).delete_all_for_block(
+            block_key, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+        )
+
+    def delete_all_for_course(self, course_key, block_type=None, scope=None, purge_history=False,
+                              batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        return self.client_for_scope(scope).delete_all_for_course(
+            course_key, block_type, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+        )
+
+    def snapshot(self):
+        """
+        Return a snapshot that routes each scope to a snapshot of its client.
+
+        Each client is snapshotted once, but one after another, so the snapshots of
+        different stores may not be taken at exactly the same moment.
+        """
+        snapshots = {}
+        clients = list(self._routes.values()) + ([] if self._default is None else [self._default])
+        try:
+            for client in clients:
+                if id(client) not in snapshots:
+                    snapshots[id(client)] = client.snapshot()
+        except BaseException:
+            for snapshot in snapshots.values():
+                snapshot.close()
+            raise
+        router = ScopeRoutingUserStateClient(
+            {scope: snapshots[id(client)] for scope, client in self._routes.items()},
+            None if self._default is None else snapshots[id(self._default)],
+        )
+        return ReadOnlyUserStateClient(router, snapshots.values())
+
+    def get_history(self, username, block_key, scope=None):
+        scope = resolve_scope(scope)
+        return self.client_for_scope(scope).get_history(username, block_key, scope)
+
+    def get_many_as_of(self, username, block_keys, timestamp, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        return self.client_for_scope(scope).get_many_as_of(username, block_keys, timestamp, scope, fields=fields)
+
+    def iter_all_for_block(self, block_key, scope=None):
+        scope = resolve_scope(scope)
+        return self.client_for_scope(scope).iter_all_for_block(block_key, scope)
+
+    def iter_all_for_blocks(self, block_keys, scope=None):
+        scope = resolve_scope(scope)
+        return self.client_for_scope(scope).iter_all_for_blocks(block_keys, scope)
+
+    def iter_chunks_for_blocks(self, block_keys, scope=None, chunk_size=1000, columnar=False,
+                               fields=None):
+        scope = resolve_scope(scope)
+        return self.client_for_scope(scope).iter_chunks_for_blocks(
+            block_keys, scope, chunk_size=chunk_size, columnar=columnar, fields=fields
+        )
+
+    def iter_all_for_course(self, course_key, block_type=None, scope=None):
+        scope = resolve_scope(scope)
+        return self.client_for_scope(scope).iter_all_for_course(course_key, block_type, scope)
+
+    def iter_chunks_for_course(self, course_key, block_type=None, scope=None, chunk_size=1000,
+                               columnar=False, fields=None):
+        scope = resolve_scope(scope)
+        return self.client_for_scope(scope).iter_chunks_for_course(
+            course_key, block_type, scope, chunk_size=chunk_size, columnar=columnar, fields=fields
+        )
+
+    def iter_all_for_course_sorted(self, course_key, block_type=None, scope=None,
+                                   order_by=ORDER_BY_USERNAME, username_prefix=None):
+        scope = resolve_scope(scope)
+        return self.client_for_scope(scope).iter_all_for_course_sorted(
+            course_key, block_type, scope, order_by=order_by, username_prefix=username_prefix
+        )
@@ -0,0 +1,627 @@
+"""
+A read cache for XBlockUserStateClient.get_many that is shared between processes,
+using a memcached-compatible server as the store.
+
+:class:`SharedCacheUserStateClient` talks to the server through a pluggable
+:class:`CacheTransport`. :class:`MemcachedTextTransport` speaks the memcached text
+protocol over TCP, and :class:`LocalMemcachedServer` is a small pure-Python server
+speaking the same protocol, for tests and local development.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+import time
+from datetime import datetime
+from itertools import islice
+
+from edx_user_state_client.interface import XBlockUserState, resolve_scope
+from edx_user_state_client.wrapper import XBlockUserStateClientWrapper, project_state
+
+log = logging.getLogger(__name__)
+
+
+class CacheTransportError(Exception):
+    """
+    This error is raised if the cache server can't be reached or returns an invalid response.
+    """
+    pass
+
+
+class CacheTransport():
+    """
+    The operations that :class:`SharedCacheUserStateClient` needs from a cache server.
+
+    Keys are :class:`str` without whitespace, values are :class:`bytes`, and ``expire``
+    is a number of seconds (0 means never). All methods raise :class:`CacheTransportError`
+    if the server can't be used.
+    """
+
+    def get_many(self, keys):
+        """
+        Return a dict mapping each of ``keys`` that is stored to its value.
+        """
+        raise NotImplementedError()
+
+    def set(self, key, value, expire=0):
+        """
+        Store ``value`` under ``key``.
+        """
+        raise NotImplementedError()
+
+    def add(self, key, value, expire=0):
+        """
+        Store ``value`` under ``key`` only if ``key`` isn't already stored.
+
+        Returns:
+            bool: Whether the value was stored.
+        """
+        raise NotImplementedError()
+
+    def incr(self, key, delta=1):
+        """
+        Increment the integer stored under ``key``.
+
+        Returns:
+            int: The new value, or None if ``key`` isn't stored.
+        """
+        raise NotImplementedError()
+
+    def delete(self, key):
+        """
+        Remove ``key``.
+
+        Returns:
+            bool: Whether ``key`` was stored.
+        """
+        raise NotImplementedError()
+
+
+class MemcachedTextTransport(CacheTransport):
+    """
+    A :class:`CacheTransport` speaking the memcached text protocol over TCP.
+
+    A connection is opened lazily, and reopened after errors and in forked children,
+    so one instance can be created before worker processes fork.
+
+    Arguments:
+        host (str): The host of the memcached server.
+        port (int): The port of the memcached server.
+        timeout (float): The socket timeout, in seconds.
+        max_keys_per_get (int): ``get_many`` sends one ``get`` command per this many keys,
+            pipelined over a single round trip.
+    """
+
+    def __init__(self, host='127.0.0.1', port=11211, timeout=1.0, max_keys_per_get=100):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.max_keys_per_get = max_keys_per_get
+        self._lock = threading.Lock()
+        self._pid = None
+        self._sock = None
+        self._rfile = None
+
+    def close(self):
+        """
+        Close the connection to the server, if there is one.
+        """
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._rfile.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = self._rfile = None
+
+    def _request(self, payload, read_response):
+        """
+        Send ``payload`` and return ``read_response(rfile)``, converting failures to CacheTransportError.
+        """
+        with self._lock:
+            try:
+                if self._sock is None or self._pid != os.getpid():
+                    self._sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+                    self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    self._rfile = self._sock.makefile('rb')
+                    self._pid = os.getpid()
+                self._sock.sendall(payload)
+                return read_response(self._rfile)
+            except (OSError, ValueError, CacheTransportError) as exception:
+                self._close()
+                if isinstance(exception, CacheTransportError):
+                    raise
+                raise CacheTransportError(str(exception)) from exception
+
+    @staticmethod
+    def _readline(rfile):
+        line = rfile.readline()
+        if not line.endswith(b'\r\n'):
+            raise CacheTransportError('Connection closed by cache server')
+        line = line[:-2]
+        if line in (b'ERROR',) or line.startswith((b'CLIENT_ERROR', b'SERVER_ERROR')):
+            raise CacheTransportError(line.decode('utf-8', 'replace'))
+        return line
+
+    def get_many(self, keys):
+        keys = list(keys)
+        if not keys:
+            return {}
+        chunks = [keys[i:i + self.max_keys_per_get] for i in range(0, len(keys), self.max_keys_per_get)]
+        payload = b''.join(f"get {' '.join(chunk)}\r\n".encode() for chunk in chunks)
+
+        def read_response(rfile):
+            values = {}
+            ends = 0
+            while ends < len(chunks):
+                line = self._readline(rfile)
+                if line == b'END':
+                    ends += 1
+                    continue
+                parts = line.split()
+                if len(parts) < 4 or parts[0] != b'VALUE':
+                    raise CacheTransportError(f'Unexpected response {line!r}')
+                data = rfile.read(int(parts[3]) + 2)
+                values[parts[1].decode()] = data[:-2]
+            return values
+
+        return self._request(payload, read_response)
+
+    def _store(self, command, key, value, expire):
+        payload = f"{command} {key} 0 {int(expire)} {len(value)}\r\n".encode() + value + b'\r\n'
+        return self._request(payload, self._readline) == b'STORED'
+
+    def set(self, key, value, expire=0):
+        self._store('set', key, value, expire)
+
+    def add(self, key, value, expire=0):
+        return self._store('add', key, value, expire)
+
+    def incr(self, key, delta=1):
+        response = self._request(f"incr {key} {int(delta)}\r\n".encode(), self._readline)
+        if response == b'NOT_FOUND':
+            return None
+        return int(response)
+
+    def delete(self, key):
+        return self._request(f"delete {key}\r\n".encode(), self._readline) == b'DELETED'
+
+
+class _MemcachedRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handle the subset of the memcached text protocol used by MemcachedTextTransport.
+    """
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.split()
+            if not parts:
+                continue
+            command = parts[0].decode()
+            if command == 'quit':
+                return
+            handler = getattr(self, f'_handle_{command}', None)
+            if handler is None:
+                self.wfile.write(b'ERROR\r\n')
+            else:
+                handler([part.decode() for part in parts[1:]])
+
+    def _handle_get(self, keys):
+        for key in keys:
+            value = self.server.lookup(key)
+            if value is not None:
+                self.wfile.write(f'VALUE {key} 0 {len(value)}\r\n'.encode() + value + b'\r\n')
+        self.wfile.write(b'END\r\n')
+
+    _handle_gets = _handle_get
+
+    def _store(self, args, only_new):
+        key, _flags, expire, length = args[:4]
+        value = self.rfile.read(int(length) + 2)[:-2]
+        stored = self.server.store(key, value, int(expire), only_new)
+        if 'noreply' not in args:
+            self.wfile.write(b'STORED\r\n' if stored else b'NOT_STORED\r\n')
+
+    def _handle_set(self, args):
+        self._store(args, only_new=False)
+
+    def _handle_add(self, args):
+        self._store(args, only_new=True)
+
+    def _handle_incr(self, args):
+        value = self.server.incr(args[0], int(args[1]))
+        self.wfile.write(b'NOT_FOUND\r\n' if value is None else f'{value}\r\n'.encode())
+
+    def _handle_delete(self, args):
+        deleted = self.server.remove(args[0])
+        if 'noreply' not in args:
+            self.wfile.write(b'DELETED\r\n' if deleted else b'NOT_FOUND\r\n')
+
+    def _handle_flush_all(self, args):
+        self.server.flush()
+        if 'noreply' not in args:
+            self.wfile.write(b'OK\r\n')
+
+    def _handle_version(self, args):  # pylint: disable=unused-argument
+        self.wfile.write(b'VERSION edx-user-state-client-local\r\n')
+
+
+class LocalMemcachedServer(socketserver.ThreadingTCPServer):
+    """
+    A pure-Python stand-in for memcached, speaking its text protocol on localhost.
+
+    It supports ``get``/``gets`` (with many keys), ``set``, ``add``, ``incr``,
+    ``delete``, ``flush_all``, ``version`` and ``quit``. Use it as a context manager,
+    or call :meth:`start` and :meth:`stop`::
+
+        with LocalMemcachedServer() as server:
+            transport = MemcachedTextTransport(*server.server_address)
+
+    Arguments:
+        port (int): The port to listen on. 0 picks a free port.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    # Relative expiry times are limited to 30 days, as in memcached.
+    MAX_RELATIVE_EXPIRE = 60 * 60 * 24 * 30
+
+    def __init__(self, port=0):
+        super().__init__(('127.0.0.1', port), _MemcachedRequestHandler)
+        self._data = {}
+        self._data_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """
+        Start serving requests on a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop serving requests and close the listening socket.
+        """
+        if self._thread is None:
+            return
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
+        self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _expire_at(self, expire):
+        if expire == 0:
+            return None
+        if expire > self.MAX_RELATIVE_EXPIRE:
+            return expire
+        return time.time() + expire
+
+    def _live(self, key):
+        """
+        Return the live (value, expire_at) stored for ``key``, dropping it if it has expired.
+        """
+        item = self._data.get(key)
+        if item is not None and item[1] is not None and item[1] <= time.time():
+            del self._data[key]
+            item = None
+        return item
+
+    def lookup(self, key):
+        with self._data_lock:
+            item = self._live(key)
+        return None if item is None else item[0]
+
+    def store(self, key, value, expire, only_new):
+        with self._data_lock:
+            if only_new and self._live(key) is not None:
+                return False
+            self._data[key] = (value, self._expire_at(expire))
+            return True
+
+    def incr(self, key, delta):
+        with self._data_lock:
+            item = self._live(key)
+            if item is None:
+                return None
+            value = (int(item[0]) + delta) % 2 ** 64
+            self._data[key] = (str(value).encode(), item[1])
+            return value
+
+    def remove(self, key):
+        with self._data_lock:
+            return self._data.pop(key, None) is not None
+
+    def flush(self):
+        with self._data_lock:
+            self._data.clear()
+
+
+class SharedCacheUserStateClient(XBlockUserStateClientWrapper):
+    """
+    Cache the full state of blocks read through ``get_many`` in a shared cache server.
+
+    * All the keys of one ``get_many`` are looked up with two multi-gets: one for
+      the per-block version numbers and one for the state stored under those versions.
+    * ``set_many`` and ``delete_many`` invalidate by incrementing the version of each
+      written block, rather than deleting its state. A reader that fetched state before
+      the write can only store it under the old version, which is never read again.
+    * Every cached state is also stored under its user's generation number.
+      ``delete_all_for_user`` increments it, orphaning all that user's cached state.
+    * ``delete_all_for_block`` and ``delete_all_for_course`` stream through the blocks
+      they delete, deleting and invalidating ``batch_size`` blocks at a time, and then
+      purge the history through the wrapped client if asked to.
+    * On a miss, a short-lived lock key is ``add``-ed per block, so only one process
+      refills a hot block from the backend. Others poll the cache for up to
+      ``stampede_wait`` seconds before reading the backend themselves.
+
+    State is stored as JSON, so field values must be JSON serializable. If the cache
+    server fails, reads go straight to the wrapped client.
+
+    Arguments:
+        client (XBlockUserStateClient): The client to cache reads from.
+        transport (CacheTransport): The connection to the cache server.
+        prefix (str): A prefix for every cache key, to share a server between deployments.
+        expire (int): How long cached state lives, in seconds.
+        lock_expire (int): How long a refill lock lives if its holder dies, in seconds.
+        stampede_wait (float): How long to wait for another process to refill a block, in seconds.
+        poll_interval (float): How often to check for a refill while waiting, in seconds.
+    """
+
+    def __init__(self, client, transport, prefix='xbus', expire=3600, lock_expire=5,
+                 stampede_wait=0.5, poll_interval=0.01):
+        super().__init__(client)
+        self.transport = transport
+        self.prefix = prefix
+        self.expire = expire
+        self.lock_expire = lock_expire
+        self.stampede_wait = stampede_wait
+        self.poll_interval = poll_interval
+
+    def _name(self, username, block_key, scope):
+        """
+        Return the cache key fragment identifying one block of state.
+        """
+        digest = hashlib.sha1(f'{username}\n{block_key}\n{scope.name}'.encode()).hexdigest()
+        return f'{self.prefix}:{digest}'
+
+    @staticmethod
+    def _new_version():
+        # Versions restart from the clock, so a version key that was evicted can't
+        # come back with a number that old state is still stored under.
+        return str(time.time_ns()).encode()
+
+    @staticmethod
+    def _encode(entry):
+        if entry is None:
+            return b'null'
+        return json.dumps({
+            'state': entry.state,
+            'updated': entry.updated.isoformat() if entry.updated is not None else None,
+        }).encode()
+
+    @staticmethod
+    def _decode(value, username, block_key, scope):
+        data = json.loads(value)
+        if data is None:
+            return None
+        updated = datetime.fromisoformat(data['updated']) if data['updated'] is not None else None
+        return XBlockUserState(username, block_key, data['state'], updated, scope)
+
+    def _fetch(self, username, block_keys, scope):
+        """
+        Read ``block_keys`` from the wrapped client, returning a dict from key to entry or None.
+        """
+        if not block_keys:
+            return {}
+        fetched = {key: None for key in block_keys}
+        for entry in self._client.get_many(username, block_keys, scope):
+            fetched[entry.block_key] = entry
+        return fetched
+
+    def _user_name(self, username):
+        """
+        Return the cache key of the generation of every block of ``username``.
+        """
+        digest = hashlib.sha1(username.encode()).hexdigest()
+        return f'{self.prefix}:{digest}:g'
+
+    def _get_cached(self, username, block_keys, scope):
+        """
+        Return a dict mapping each of ``block_keys`` to its entry, or None if it has no state.
+        """
+        names = {key: self._name(username, key, scope) for key in block_keys}
+        user_key = self._user_name(username)
+        versions = self.transport.get_many([user_key] + [f'{name}:v' for name in names.values()])
+        generation = versions.get(user_key)
+        if generation is None:
+            generation = self._new_version()
+            if not self.transport.add(user_key, generation):
+                return self._fetch(username, block_keys, scope)
+
+        data_keys = {}
+        uncacheable = []
+        for key, name in names.items():
+            version = versions.get(f'{name}:v')
+            if version is None:
+                version = self._new_version()
+                if not self.transport.add(f'{name}:v', version):
+                    uncacheable.append(key)
+                    continue
+            data_keys[key] = f'{name}:s:{generation.decode()}.{version.decode()}'
+
+        found = {}
+        cached = self.transport.get_many(data_keys.values())
+        misses = []
+        for key, data_key in data_keys.items():
+            if data_key in cached:
+                found[key] = self._decode(cached[data_key], username, key, scope)
+            else:
+                misses.append(key)
+
+        locked = [key for key in misses if self.transport.add(f'{names[key]}:lock', b'1', self.lock_expire)]
+        contended = [key for key in misses if key not in locked]
+
+        refilled = self._fetch(username, locked + uncacheable, scope)
+        try:
+            for key in locked:
+                self.transport.set(data_keys[key], self._encode(refilled[key]), self.expire)
+        finally:
+            for key in locked:
+                self.transport.delete(f'{names[key]}:lock')
+        found.update(refilled)
+
+        deadline = time.monotonic() + self.stampede_wait
+        while contended and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            cached = self.transport.get_many(data_keys[key] for key in contended)
+            for key in list(contended):
+                if data_keys[key] in cached:
+                    found[key] = self._decode(cached[data_keys[key]], username, key, scope)
+                    contended.remove(key)
+        found.update(self._fetch(username, contended, scope))
+        return found
+
+    def get_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        block_keys = list(block_keys)
+        unique_keys = list(dict.fromkeys(block_keys))
+        try:
+            found = self._get_cached(username, unique_keys, scope)
+        except CacheTransportError:
+            log.warning('Shared user state cache unavailable, reading from backend', exc_info=True)
+            found = self._fetch(username, unique_keys, scope)
+
+        for key in block_keys:
+            if found[key] is not None:
+                yield project_state(found[key], fields)
+
+    def _invalidate(self, username, block_keys, scope):
+        """
+        Move each of ``block_keys`` to a new version, orphaning any state cached for it.
+        """
+        try:
+            for key in block_keys:
+                version_key = f'{self._name(username, key, scope)}:v'
+                if self.transport.incr(version_key) is None:
+                    self.transport.set(version_key, self._new_version())
+        except CacheTransportError:
+            log.error(
+                'Unable to invalidate shared user state cache for %s; stale state may be served for up to %s seconds',
+                username, self.expire, exc_info=True,
+            )
+
+    def set_many(self, username, block_keys_to_state, scope=None):
+        scope = resolve_scope(scope)
+        try:
+            return self._client.set_many(username, block_keys_to_state, scope)
+        finally:
+            self._invalidate(username, list(block_keys_to_state), scope)
+
+    def set_many_if_unmodified(self, username, block_keys_to_state, expected_updated, scope=None):
+        # Invalidate on conflict too, so that the caller's re-read sees the new version.
+        scope = resolve_scope(scope)
+        try:
+            return self._client.set_many_if_unmodified(username, block_keys_to_state, expected_updated, scope)
+        finally:
+            self._invalidate(username, list(block_keys_to_state), scope)
+
+    def delete_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        block_keys = list(block_keys)
+        try:
+            return self._client.delete_many(username, block_keys, scope, fields=fields)
+        finally:
+            self._invalidate(username, block_keys, scope)
+
+    def bulk_load(self, entries, batch_size=1000):
+        """
+        Load ``entries`` a batch at a time, invalidating each batch's blocks once it is loaded.
+        """
+        count = 0
+        entries = iter(entries)
+        while True:
+            batch = list(islice(entries, batch_size))
+            if not batch:
+                return count
+            try:
+                count += self._client.bulk_load(batch, batch_size)
+            finally:
+                by_user_and_scope = {}
+                for entry in batch:
+                    by_user_and_scope.setdefault((entry.username, entry.scope), {})[entry.block_key] = None
+                for (username, scope), block_keys in by_user_and_scope.items():
+                    self._invalidate(username, list(block_keys), scope)
+
+    def _delete_and_invalidate(self, entries, scope, purge_history, batch_size, progress, purge):
+        """
+        Delete the blocks of ``entries`` a batch at a time with :meth:`delete_many`, which
+        invalidates each batch, and then call ``purge()`` if ``purge_history`` is set.
+        """
+        count = self._delete_entries(entries, scope, batch_size, progress)
+        if purge_history:
+            purge()
+        return count
+
+    def _invalidate_user(self, username):
+        """
+        Move ``username`` to a new generation, orphaning all the state cached for them.
+        """
+        try:
+            user_key = self._user_name(username)
+            if self.transport.incr(user_key) is None:
+                self.transport.set(user_key, self._new_version())
+        except CacheTransportError:
+            log.error(
+                'Unable to invalidate shared user state cache for %s; stale state may be served for up to %s seconds',
+                username, self.expire, exc_info=True,
+            )
+
+    def delete_all_for_user(self, username, course_keys=None, scope=None, purge_history=False,
+                            batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        try:
+            return self._client.delete_all_for_user(
+                username, course_keys, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+            )
+        finally:
+            self._invalidate_user(username)
+
+    def delete_all_for_block(self, block_key, scope=None, purge_history=False, batch_size=1000,
+                             progress=None):
+        scope = resolve_scope(scope)
+        return self._delete_and_invalidate(
+            self._client.iter_all_for_block(block_key, scope),
+            scope, purge_history, batch_size, progress,
+            lambda: self._client.delete_all_for_block(block_key, scope, purge_history=True, batch_size=batch_size),
+        )
+
+    def delete_all_for_course(self, course_key, block_type=None, scope=None, purge_history=False,
+                              batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        return self._delete_and_invalidate(
+            self._client.iter_all_for_course(course_key, block_type, scope),
+            scope, purge_history, batch_size, progress,
+            lambda: self._client.delete_all_for_course(
+                course_key, block_type, scope, purge_history=True, batch_size=batch_size
+            ),
+        )
@@ -0,0 +1,64 @@
+"""
+Read-only, point-in-time views of an XBlockUserStateClient, as returned by
+:meth:`~edx_user_state_client.interface.XBlockUserStateClient.snapshot`.
+"""
+
+from edx_user_state_client.wrapper import XBlockUserStateClientWrapper
+
+
+class ReadOnlyClientMixin():
+    """
+    Make an XBlockUserStateClient a snapshot: every write raises PermissionDenied.
+
+    Snapshots should be closed when they are no longer needed, so the backend can
+    release what it keeps for them, and can be used as context managers to do that::
+
+        with client.snapshot() as snapshot:
+            export(snapshot.iter_all_for_course(course_key))
+    """
+
+    def _reject_write(self, *args, **kwargs):
+        raise self.PermissionDenied('This client is a read-only snapshot')
+
+    set_many = _reject_write
+    set_many_if_unmodified = _reject_write
+    delete_many = _reject_write
+    bulk_load = _reject_write
+    delete_all_for_user = _reject_write
+    delete_all_for_block = _reject_write
+    delete_all_for_course = _reject_write
+
+    def snapshot(self):
+        """
+        Return this snapshot, which is already fixed in time.
+        """
+        return self
+
+    def close(self):
+        """
+        Release whatever the backend keeps for this snapshot.
+        """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class ReadOnlyUserStateClient(ReadOnlyClientMixin, XBlockUserStateClientWrapper):
+    """
+    A snapshot that reads through ``client``, such as a wrapper built over other snapshots.
+
+    Arguments:
+        client (XBlockUserStateClient): The client to read from.
+        snapshots (list): The snapshots that ``client`` reads from, closed when this is closed.
+    """
+
+    def __init__(self, client, snapshots=()):
+        super().__init__(client)
+        self._snapshots = list(snapshots)
+
+    def close(self):
+        for snapshot in self._snapshots:
+            snapshot.close()
@@ -0,0 +1,102 @@
+"""
+Measure how long importing this package's modules takes in a fresh interpreter, to
+keep the startup cost of short-lived workers in check.
+
+Run it as a command to check the import-time budgets::
+
+    python -m edx_user_state_client.startup [module ...]
+
+It exits with status 1 if a module is over its budget, or imports a heavy
+dependency it is budgeted not to.
+
+The test suite always checks that budgeted modules don't import heavy
+dependencies, but only checks their import times when ``CHECK_IMPORT_BUDGETS``
+is set, since those depend on the machine.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Dependencies that take most of the import time of the package.
+HEAVY_MODULES = ('xblock', 'opaque_keys')
+
+# Maps modules to their import-time budget in milliseconds, and whether they may import HEAVY_MODULES.
+IMPORT_BUDGETS = {
+    'edx_user_state_client': (20, False),
+    'edx_user_state_client.interface': (30, False),
+    'edx_user_state_client.trace_analysis': (50, False),
+}
+
+_MEASURE = '''
+import importlib, json, sys, time
+started = time.perf_counter()
+importlib.import_module({module!r})
+elapsed = time.perf_counter() - started
+heavy = sorted(name for name in {heavy!r} if name in sys.modules)
+print(json.dumps({{"ms": elapsed * 1000, "heavy": heavy}}))
+'''
+
+
+def measure_import(module, repeat=5):
+    """
+    Import ``module`` in ``repeat`` fresh interpreters.
+
+    Returns:
+        dict: ``ms``, the median import time in milliseconds, and ``heavy``, the
+        names in :data:`HEAVY_MODULES` that the import loaded.
+    """
+    runs = []
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', _MEASURE.format(module=module, heavy=HEAVY_MODULES)],
+            check=True, capture_output=True, text=True,
+        ).stdout
+        runs.append(json.loads(output))
+    return {'ms': statistics.median(run['ms'] for run in runs), 'heavy': runs[-1]['heavy']}
+
+
+def check_budgets(modules=None, repeat=5):
+    """
+    Measure ``modules`` (or every module in :data:`IMPORT_BUDGETS`) against their budgets.
+
+    Returns:
+        list: A dict per module with ``module``, ``ms``, ``heavy``, ``budget_ms`` and ``ok``.
+    """
+    results = []
+    for module in modules or IMPORT_BUDGETS:
+        budget_ms, heavy_allowed = IMPORT_BUDGETS.get(module, (None, True))
+        measured = measure_import(module, repeat)
+        results.append({
+            'module': module,
+            'ms': round(measured['ms'], 1),
+            'heavy': measured['heavy'],
+            'budget_ms': budget_ms,
+            'ok': (budget_ms is None or measured['ms'] <= budget_ms) and (heavy_allowed or not measured['heavy']),
+        })
+    return results
+
+
+def main(argv=None):
+    """
+    Print the import time of the modules in ``argv``, and return 1 if any is over budget.
+    """
+    parser = argparse.ArgumentParser(description='Measure import times against their budgets.')
+    parser.add_argument('modules', nargs='*', help='Modules to measure (default: every budgeted module)')
+    parser.add_argument('--repeat', type=int, default=5, help='Fresh interpreters to take the median over')
+    args = parser.parse_args(argv)
+
+    results = check_budgets(args.modules, args.repeat)
+    for result in results:
+        budget = f"{result['budget_ms']}ms" if result['budget_ms'] is not None else 'none'
+        print(
+            f"{'ok  ' if result['ok'] else 'OVER'} {result['module']:45} {result['ms']:8.1f}ms "
+            f"budget={budget} heavy={','.join(result['heavy']) or '-'}"
+        )
+    return 0 if all(result['ok'] for result in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
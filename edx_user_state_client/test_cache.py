@@ -0,0 +1,98 @@
+"""
+Tests of the in-process CachedUserStateClient.
+"""
+from unittest import TestCase
+
+from xblock.fields import Scope
+
+from edx_user_state_client.cache import CachedUserStateClient
+from edx_user_state_client.tests import DictUserStateClient, UserStateClientStressTestBase, UserStateClientTestBase
+
+
+class CountingUserStateClient(DictUserStateClient):
+    """
+    A DictUserStateClient that records the block keys requested from get_many.
+    """
+    def __init__(self):
+        super().__init__()
+        self.requested = []
+
+    def get_many(self, username, block_keys, scope=Scope.user_state, fields=None):
+        block_keys = list(block_keys)
+        self.requested.append(block_keys)
+        return super().get_many(username, block_keys, scope, fields)
+
+
+class TestCachedUserStateClient(UserStateClientTestBase, UserStateClientStressTestBase):
+    """
+    Blackbox tests of CachedUserStateClient.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.client = CachedUserStateClient(DictUserStateClient(), max_entries=3)
+
+
+class TestCachedUserStateClientCaching(TestCase):
+    """
+    Tests of when CachedUserStateClient goes to the wrapped client.
+    """
+    def setUp(self):
+        super().setUp()
+        self.backend = CountingUserStateClient()
+        self.client = CachedUserStateClient(self.backend, max_entries=2)
+
+    def test_repeated_reads_hit_cache(self):
+        self.client.set('user', 'a', {'x': 1})
+        self.assertEqual(self.client.get('user', 'a').state, {'x': 1})
+        self.assertEqual(self.client.get('user', 'a', fields=['x']).state, {'x': 1})
+        self.assertEqual(self.backend.requested, [['a']])
+
+    def test_missing_blocks_are_cached(self):
+        self.assertEqual(list(self.client.get_many('user', ['a'])), [])
+        self.assertEqual(list(self.client.get_many('user', ['a'])), [])
+        self.assertEqual(self.backend.requested, [['a']])
+
+    def test_only_misses_are_fetched(self):
+        self.client.set_many('user', {'a': {'x': 1}, 'b': {'x': 2}})
+        self.client.get('user', 'a')
+        self.assertEqual([entry.state for entry in self.client.get_many('user', ['a', 'b'])], [{'x': 1}, {'x': 2}])
+        self.assertEqual(self.backend.requested, [['a'], ['b']])
+
+    def test_write_invalidates(self):
+        self.client.set('user', 'a', {'x': 1})
+        self.client.get('user', 'a')
+        self.client.set('user', 'a', {'x': 2})
+        self.assertEqual(self.client.get('user', 'a').state, {'x': 2})
+        self.client.delete('user', 'a')
+        with self.assertRaises(self.client.DoesNotExist):
+            self.client.get('user', 'a')
+
+    def test_lru_eviction(self):
+        self.client.set_many('user', {'a': {}, 'b': {}, 'c': {}})
+        list(self.client.get_many('user', ['a', 'b']))
+        self.client.get('user', 'a')
+        self.client.get('user', 'c')
+        self.assertEqual(len(self.client), 2)
+        self.client.get('user', 'a')
+        self.client.get('user', 'b')
+        self.assertEqual(self.backend.requested, [['a', 'b'], ['c'], ['b']])
+
+    def test_conflict_invalidates(self):
+        self.client.set('user', 'a', {'x': 1})
+        stale = self.client.get('user', 'a')
+        self.backend.set('user', 'a', {'x': 2})
+        with self.assertRaises(self.client.VersionConflict):
+            self.client.set_many_if_unmodified('user', {'a': {'x': 3}}, {'a': stale.updated})
+        fresh = self.client.get('user', 'a')
+        self.assertEqual(fresh.state, {'x': 2})
+        self.client.set_many_if_unmodified('user', {'a': {'x': 3}}, {'a': fresh.updated})
+        self.assertEqual(self.client.get('user', 'a').state, {'x': 3})
+
+    def test_delete_all_invalidates(self):
+        self.client.set_many('user', {'a': {'x': 1}, 'b': {'x': 2}})
+        list(self.client.get_many('user', ['a', 'b']))
+        self.client.delete_all_for_block('a')
+        self.assertEqual([entry.block_key for entry in self.client.get_many('user', ['a', 'b'])], ['b'])
+        self.assertEqual(self.backend.requested, [['a', 'b'], ['a']])
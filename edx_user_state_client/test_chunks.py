@@ -0,0 +1,45 @@
+"""
+Tests of the chunking helpers.
+"""
+from unittest import TestCase
+
+from edx_user_state_client.chunks import StateColumns, iter_chunks, make_chunk
+from edx_user_state_client.interface import XBlockUserState
+
+
+class TestChunks(TestCase):
+    """
+    Tests of iter_chunks and make_chunk.
+    """
+    entries = [
+        XBlockUserState('alice', 'a', {'score': 1, 'answer': 'x'}, None, None),
+        XBlockUserState('bob', 'a', {'score': 2}, None, None),
+        XBlockUserState('alice', 'b', {'position': 10}, None, None),
+    ]
+
+    def test_iter_chunks(self):
+        self.assertEqual(list(iter_chunks(self.entries, 2)), [self.entries[:2], self.entries[2:]])
+        self.assertEqual(list(iter_chunks(iter(self.entries), 5)), [self.entries])
+        self.assertEqual(list(iter_chunks([], 5)), [])
+        with self.assertRaises(ValueError):
+            iter_chunks(self.entries, 0)
+
+    def test_rows(self):
+        self.assertIs(make_chunk(self.entries), self.entries)
+        self.assertEqual(
+            [entry.state for entry in make_chunk(self.entries, fields=['score'])],
+            [{'score': 1}, {'score': 2}, {}],
+        )
+
+    def test_columns(self):
+        self.assertEqual(make_chunk(self.entries, columnar=True), StateColumns(
+            ['alice', 'bob', 'alice'],
+            ['a', 'a', 'b'],
+            [None, None, None],
+            {'score': [1, 2, None], 'answer': ['x', None, None], 'position': [None, None, 10]},
+        ))
+        self.assertEqual(list(make_chunk(self.entries, columnar=True).fields), ['score', 'answer', 'position'])
+        self.assertEqual(
+            make_chunk(self.entries, columnar=True, fields=['score', 'grade']).fields,
+            {'score': [1, 2, None], 'grade': [None, None, None]},
+        )
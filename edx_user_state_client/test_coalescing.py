@@ -0,0 +1,138 @@
+"""
+Tests of CoalescingUserStateClient.
+"""
+import asyncio
+import threading
+import time
+from unittest import TestCase
+
+from xblock.fields import Scope
+
+from edx_user_state_client.coalescing import CoalescingUserStateClient
+from edx_user_state_client.tests import DictUserStateClient, UserStateClientStressTestBase, UserStateClientTestBase
+
+
+class SlowUserStateClient(DictUserStateClient):
+    """
+    A DictUserStateClient whose reads take ``delay`` seconds, recording each read.
+    """
+    def __init__(self, delay):
+        super().__init__()
+        self.delay = delay
+        self.reads = []
+
+    def get_many(self, username, block_keys, scope=Scope.user_state, fields=None):
+        block_keys = list(block_keys)
+        self.reads.append((block_keys, fields))
+        time.sleep(self.delay)
+        if block_keys == ['broken']:
+            raise self.ServiceUnavailable()
+        return super().get_many(username, block_keys, scope, fields)
+
+
+class TestCoalescingUserStateClient(UserStateClientTestBase, UserStateClientStressTestBase):
+    """
+    Blackbox tests of CoalescingUserStateClient.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.client = CoalescingUserStateClient(DictUserStateClient())
+
+
+class TestBatchingUserStateClient(UserStateClientTestBase, UserStateClientStressTestBase):
+    """
+    Blackbox tests of CoalescingUserStateClient gathering batches.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.client = CoalescingUserStateClient(DictUserStateClient(), batch_window=0.0001)
+
+
+class TestCoalescing(TestCase):
+    """
+    Tests of concurrent calls sharing reads.
+    """
+    def setUp(self):
+        super().setUp()
+        self.backend = SlowUserStateClient(delay=0.2)
+        self.backend.set_many('user', {'a': {'x': 1, 'y': 2}, 'b': {'x': 3}, 'c': {'x': 4}})
+
+    def run_concurrently(self, calls):
+        """Run each of ``calls`` on its own thread, returning their results or errors."""
+        results = [None] * len(calls)
+
+        def run(index, call):
+            try:
+                results[index] = call()
+            except Exception as exception:  # pylint: disable=broad-except
+                results[index] = exception
+
+        threads = [threading.Thread(target=run, args=(index, call)) for index, call in enumerate(calls)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_identical_calls_share_read(self):
+        client = CoalescingUserStateClient(self.backend)
+        results = self.run_concurrently(
+            [lambda: [entry.state for entry in client.get_many('user', ['a', 'b'])]] * 5
+        )
+        self.assertEqual(results, [[{'x': 1, 'y': 2}, {'x': 3}]] * 5)
+        self.assertEqual(len(self.backend.reads), 1)
+        results[0][0]['x'] = 'changed'
+        self.assertEqual(results[1][0]['x'], 1)
+
+    def test_different_calls_read_separately(self):
+        client = CoalescingUserStateClient(self.backend)
+        self.run_concurrently([
+            lambda: list(client.get_many('user', ['a'])),
+            lambda: list(client.get_many('user', ['a'], fields=['x'])),
+        ])
+        self.assertEqual(len(self.backend.reads), 2)
+
+    def test_errors_shared(self):
+        client = CoalescingUserStateClient(self.backend)
+        results = self.run_concurrently([lambda: list(client.get_many('user', ['broken']))] * 3)
+        for result in results:
+            self.assertIsInstance(result, client.ServiceUnavailable)
+        self.assertEqual(len(self.backend.reads), 1)
+
+    def test_overlapping_calls_batched(self):
+        client = CoalescingUserStateClient(self.backend, batch_window=0.1)
+        results = self.run_concurrently([
+            lambda: [entry.state for entry in client.get_many('user', ['a', 'b'], fields=['x'])],
+            lambda: [entry.state for entry in client.get_many('user', ['c', 'b', 'missing'], fields=['y'])],
+            lambda: [entry.state for entry in client.get_many('other', ['a'])],
+        ])
+        self.assertEqual(results, [[{'x': 1}, {'x': 3}], [{}, {}], []])
+        self.assertCountEqual(
+            [(sorted(keys), fields) for keys, fields in self.backend.reads],
+            [(['a', 'b', 'c', 'missing'], ['x', 'y']), (['a'], None)],
+        )
+
+    def test_reads_after_write_start_afresh(self):
+        client = CoalescingUserStateClient(self.backend)
+        reading = threading.Thread(target=lambda: list(client.get_many('user', ['a'])))
+        reading.start()
+        while not self.backend.reads:
+            time.sleep(0.001)
+        client.set('user', 'a', {'x': 2})
+        self.assertEqual(client.get('user', 'a').state, {'x': 2, 'y': 2})
+        reading.join()
+        self.assertEqual(len(self.backend.reads), 2)
+
+    def test_async_calls_share_read(self):
+        client = CoalescingUserStateClient(self.backend)
+
+        async def read_many():
+            return await asyncio.gather(*[client.get_many_async('user', ['a'], fields=['y']) for _ in range(5)])
+
+        results = asyncio.run(read_many())
+        self.assertEqual([[entry.state for entry in result] for result in results], [[{'y': 2}]] * 5)
+        self.assertEqual(len(self.backend.reads), 1)
@@ -0,0 +1,66 @@
+"""
+Tests of DiffingUserStateClient.
+"""
+from unittest import TestCase
+
+from edx_user_state_client.diffing import DiffingUserStateClient
+from edx_user_state_client.tests import DictUserStateClient, RecordingUserStateClient, UserStateClientStressTestBase, UserStateClientTestBase
+
+
+class TestDiffingUserStateClient(UserStateClientTestBase, UserStateClientStressTestBase):
+    """
+    Blackbox tests of DiffingUserStateClient.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.client = DiffingUserStateClient(DictUserStateClient())
+
+
+class TestDeltaWrites(TestCase):
+    """
+    Tests of which writes DiffingUserStateClient passes on.
+    """
+    def setUp(self):
+        super().setUp()
+        self.backend = RecordingUserStateClient()
+        self.client = DiffingUserStateClient(self.backend)
+
+    def test_only_changed_fields_written(self):
+        self.client.set_many('user', {'a': {'x': 1, 'y': [1, 2]}, 'b': {'x': 1}})
+        self.client.set_many('user', {'a': {'x': 2, 'y': [1, 2]}, 'b': {'x': 1}})
+        self.assertEqual(self.backend.writes[-1], {'a': {'x': 2}})
+        self.assertEqual(self.client.get('user', 'a').state, {'x': 2, 'y': [1, 2]})
+        self.assertEqual(len(list(self.client.get_history('user', 'b'))), 1)
+
+    def test_noop_write_skipped(self):
+        self.client.set('user', 'a', {'x': 1})
+        self.client.set('user', 'a', {'x': 1})
+        self.client.set_many('user', {})
+        self.assertEqual(self.backend.writes, [{'a': {'x': 1}}])
+        self.assertEqual(len(list(self.client.get_history('user', 'a'))), 1)
+
+    def test_new_field_written(self):
+        self.client.set('user', 'a', {'x': 1})
+        self.client.set('user', 'a', {'x': 1, 'y': None})
+        self.assertEqual(self.backend.writes[-1], {'a': {'y': None}})
+
+    def test_empty_state_for_new_block_written(self):
+        self.client.set('user', 'a', {})
+        self.assertEqual(self.backend.writes, [{'a': {}}])
+
+    def test_concurrent_write_does_not_win(self):
+        self.client.set('user', 'a', {'x': 1, 'y': 1})
+        get_many = self.backend.get_many
+
+        def racing_get_many(*args, **kwargs):
+            entries = list(get_many(*args, **kwargs))
+            self.backend.get_many = get_many
+            self.backend.set('user', 'a', {'x': 2, 'y': 2})
+            return entries
+
+        self.backend.get_many = racing_get_many
+        self.client.set('user', 'a', {'x': 1, 'y': 3})
+        self.assertEqual(self.backend.writes[-1], {'a': {'x': 1, 'y': 3}})
+        self.assertEqual(self.client.get('user', 'a').state, {'x': 1, 'y': 3})
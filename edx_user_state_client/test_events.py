@@ -0,0 +1,125 @@
+"""
+Tests of ChangePublishingUserStateClient.
+"""
+import threading
+from unittest import TestCase
+
+from opaque_keys.edx.locator import BlockUsageLocator, CourseLocator
+from xblock.fields import Scope
+
+from edx_user_state_client.events import ChangePublishingUserStateClient
+from edx_user_state_client.tests import DictUserStateClient, UserStateClientStressTestBase, UserStateClientTestBase
+
+
+class TestChangePublishingUserStateClient(UserStateClientTestBase, UserStateClientStressTestBase):
+    """
+    Blackbox tests of ChangePublishingUserStateClient, with a queued subscriber.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.client = ChangePublishingUserStateClient(DictUserStateClient(), queue_size=10, max_batch=5)
+        self.client.subscribe(lambda changes: None)
+        self.addCleanup(self.client.close)
+
+
+class TestChangePublishing(TestCase):
+    """
+    Tests of the changes published, and how they are delivered.
+    """
+    def setUp(self):
+        super().setUp()
+        self.backend = DictUserStateClient()
+        self.client = ChangePublishingUserStateClient(self.backend)
+        self.deliveries = []
+        self.client.subscribe(self.deliveries.append)
+
+    def published(self):
+        """Return the published changes as (username, block_key, fields, deleted) tuples, per delivery."""
+        return [
+            [(change.username, change.block_key, change.fields, change.deleted) for change in changes]
+            for changes in self.deliveries
+        ]
+
+    def test_writes_publish(self):
+        self.client.set_many('user', {'a': {'x': 1, 'y': 2}, 'b': {'x': 3}})
+        self.client.delete_many('user', ['a'], fields=['y'])
+        self.client.delete('user', 'b')
+        self.assertEqual(self.published(), [
+            [('user', 'a', ('x', 'y'), False), ('user', 'b', ('x',), False)],
+            [('user', 'a', ('y',), True)],
+            [('user', 'b', None, True)],
+        ])
+        change = self.deliveries[0][0]
+        self.assertEqual(change.scope, Scope.user_state)
+        self.assertGreaterEqual(change.updated, list(self.backend.get_history('user', 'a'))[-1].updated)
+
+    def test_conditional_writes(self):
+        self.client.set_many_if_unmodified('user', {'a': {'x': 1}}, {'a': None})
+        with self.assertRaises(self.client.VersionConflict):
+            self.client.set_many_if_unmodified('user', {'a': {'x': 2}}, {'a': None})
+        self.assertEqual(self.published(), [[('user', 'a', ('x',), False)]])
+
+    def test_rejected_writes_not_published(self):
+        def reject(*args, **kwargs):
+            raise self.backend.QuotaExceeded()
+
+        self.backend.set_many = self.backend.delete_many = reject
+        with self.assertRaises(self.client.QuotaExceeded):
+            self.client.set('user', 'a', {'x': 1})
+        with self.assertRaises(self.client.QuotaExceeded):
+            self.client.delete('user', 'a')
+        self.assertEqual(self.deliveries, [])
+
+    def test_unsubscribe(self):
+        self.client.unsubscribe(self.deliveries.append)
+        self.client.set('user', 'a', {'x': 1})
+        self.assertEqual(self.deliveries, [])
+
+    def test_failing_subscriber(self):
+        @self.client.subscribe
+        def fail(changes):
+            raise ValueError(changes)
+
+        with self.assertLogs('edx_user_state_client.events', 'ERROR'):
+            self.client.set('user', 'a', {'x': 1})
+        self.assertEqual(self.backend.get('user', 'a').state, {'x': 1})
+        self.assertEqual(len(self.deliveries), 1)
+        self.client.unsubscribe(fail)
+
+    def test_delete_all(self):
+        course = CourseLocator('org', 'course', 'run')
+        problem = BlockUsageLocator(course, 'problem', 'p1')
+        for username in ('alice', 'bob'):
+            self.client.set(username, problem, {'x': 1})
+        del self.deliveries[:]
+        self.client.delete_all_for_block(problem)
+        self.assertEqual(self.published(), [[('alice', problem, None, True)], [('bob', problem, None, True)]])
+        with self.assertRaises(NotImplementedError):
+            self.client.delete_all_for_user('alice')
+
+    def test_queued_deliveries_are_batched(self):
+        client = ChangePublishingUserStateClient(self.backend, queue_size=10, max_batch=3)
+        self.addCleanup(client.close)
+        release = threading.Event()
+        started = threading.Event()
+        deliveries = []
+
+        @client.subscribe
+        def deliver(changes):
+            started.set()
+            release.wait()
+            deliveries.append([change.block_key for change in changes])
+
+        client.set('user', 'a', {'x': 1})
+        started.wait()
+        for block_key in 'bcde':
+            client.set('user', block_key, {'x': 1})
+        release.set()
+        client.flush()
+        self.assertEqual(deliveries, [['a'], ['b', 'c', 'd'], ['e']])
+
+        client.delete_many('user', ['a', 'b'])
+        client.close()
+        self.assertEqual(deliveries[-1], ['a', 'b'])
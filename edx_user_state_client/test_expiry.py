@@ -0,0 +1,172 @@
+"""
+Tests of ExpiringFieldsUserStateClient.
+"""
+import threading
+import time
+from datetime import datetime
+from unittest import TestCase
+
+import pytz
+
+from edx_user_state_client.expiry import ExpiringFieldsUserStateClient
+from edx_user_state_client.tests import DictUserStateClient, UserStateClientStressTestBase, UserStateClientTestBase, _UserStateClientTestUtils
+
+
+class TestExpiringFieldsUserStateClient(UserStateClientTestBase, UserStateClientStressTestBase):
+    """
+    Blackbox tests of ExpiringFieldsUserStateClient.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.client = ExpiringFieldsUserStateClient(DictUserStateClient(), default_ttls={'draft': 60})
+
+
+class TestFieldExpiry(_UserStateClientTestUtils):
+    """
+    Tests of how fields expire.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.now = 1000
+        self.backend = DictUserStateClient()
+        self.client = ExpiringFieldsUserStateClient(
+            self.backend, default_ttls={'draft': 60}, clock=lambda: self.now
+        )
+
+    def stored(self, user, block):
+        """Return the state stored in the backend, including expiry fields."""
+        return self.backend.get(self._user(user), self._block(block)).state
+
+    def test_default_ttl(self):
+        self.set(user=0, block=0, state={'draft': 'x', 'answer': 1})
+        self.now += 59
+        self.assertEqual(self.get(user=0, block=0).state, {'draft': 'x', 'answer': 1})
+        self.now += 1
+        self.assertEqual(self.get(user=0, block=0).state, {'answer': 1})
+        self.assertEqual(self.get(user=0, block=0, fields=['draft', 'answer']).state, {'answer': 1})
+
+    def test_explicit_ttl(self):
+        self.client.set_many(self._user(0), {self._block(0): {'a': 1, 'b': 2}}, ttl={'a': 10})
+        self.client.set_many(self._user(0), {self._block(1): {'c': 3}}, ttl=5)
+        self.now += 10
+        self.assertEqual(self.get(user=0, block=0).state, {'b': 2})
+        self.assertEqual(list(self.get_many(user=0, blocks=[1])), [])
+        self.assertCountEqual(self.iter_all_for_course(course=0), [self.get(user=0, block=0)])
+
+    def test_snapshot_expires_at_its_time(self):
+        self.set(user=0, block=0, state={'draft': 'x', 'answer': 1})
+        self.now += 30
+        with self.client.snapshot() as snapshot:
+            self.now += 30
+            self.assertEqual(snapshot.get(self._user(0), self._block(0)).state, {'draft': 'x', 'answer': 1})
+            self.assertEqual(self.get(user=0, block=0).state, {'answer': 1})
+
+    def test_as_of_expires_at_timestamp(self):
+        self.set(user=0, block=0, state={'draft': 'x', 'answer': 1})
+        self.assertEqual(self.get(user=0, block=0).state, {'draft': 'x', 'answer': 1})
+        # The draft had long expired by the real time, which is far past the fake clock.
+        [entry] = self.client.get_many_as_of(
+            self._user(0), [self._block(0)], datetime.now(pytz.utc), fields=['draft', 'answer']
+        )
+        self.assertEqual(entry.state, {'answer': 1})
+
+    def test_rewrite_without_ttl_clears_expiry(self):
+        self.client.set_many(self._user(0), {self._block(0): {'a': 1, 'b': 2}}, ttl=10)
+        self.set(user=0, block=0, state={'a': 3})
+        self.assertEqual(self.stored(0, 0), {'a': 3, 'b': 2, '__expires__.b': 1010})
+        self.now += 10
+        self.assertEqual(self.get(user=0, block=0).state, {'a': 3})
+
+    def test_rewrite_clears_expiry_read_from_other_process(self):
+        other_process = ExpiringFieldsUserStateClient(self.backend, clock=lambda: self.now)
+        other_process.set_many(self._user(0), {self._block(0): {'a': 1}}, ttl=10)
+        self.assertEqual(self.get(user=0, block=0).state, {'a': 1})
+        self.set(user=0, block=0, state={'a': 2})
+        self.assertEqual(self.stored(0, 0), {'a': 2})
+
+    def test_never_expiring_fields_store_no_expiry(self):
+        reads = []
+        get_many = self.backend.get_many
+
+        def counting_get_many(*args, **kwargs):
+            reads.append(args)
+            return get_many(*args, **kwargs)
+
+        self.backend.get_many = counting_get_many
+        self.set(user=0, block=0, state={'a': 1})
+        self.set(user=0, block=0, state={'a': 2})
+        self.assertEqual(reads, [])
+        self.assertEqual(self.stored(0, 0), {'a': 2})
+
+    def test_history_hides_expiry(self):
+        self.set(user=0, block=0, state={'draft': 'x'})
+        self.assertEqual([entry.state for entry in self.get_history(user=0, block=0)], [{'draft': 'x'}])
+
+    def test_sweep(self):
+        self.set(user=0, block=0, state={'draft': 'x', 'answer': 1})
+        self.set(user=0, block=1, state={'draft': 'y'})
+        self.set(user=1, block=0, state={'draft': 'z'})
+        self.now += 30
+        self.set(user=1, block=0, state={'draft': 'z2'})
+        self.now += 30
+        self.assertEqual(self.client.sweep(), 2)
+        self.assertEqual(self.stored(0, 0), {'answer': 1})
+        with self.assertRaises(self.client.DoesNotExist):
+            self.stored(0, 1)
+        self.assertEqual(self.get(user=1, block=0).state, {'draft': 'z2'})
+        self.now += 30
+        self.assertEqual(self.client.sweep(), 1)
+
+    def test_sweep_course(self):
+        other_process = ExpiringFieldsUserStateClient(self.backend, clock=lambda: self.now)
+        other_process.set_many(self._user(0), {self._block(0): {'a': 1}, self._block(1000): {'a': 2}}, ttl=10)
+        self.now += 10
+        self.assertEqual(self.client.sweep(), 0)
+        self.assertEqual(self.client.sweep_course(self._course(0)), 1)
+        self.assertEqual(list(self.backend.get_many(self._user(0), [self._block(0)])), [])
+        self.assertEqual(len(list(self.backend.get_many(self._user(0), [self._block(1000)]))), 1)
+
+
+class TestSweeperThread(TestCase):
+    """
+    Tests of the background sweeper.
+    """
+    def test_start_stop(self):
+        client = ExpiringFieldsUserStateClient(DictUserStateClient())
+        client.set_many('user', {'block': {'a': 1}}, ttl=0.01)
+        client.start_sweeper(interval=0.01)
+        client.start_sweeper(interval=0.01)
+        deadline = time.time() + 5
+        while list(client.wrapped_client.get_many('user', ['block'])) and time.time() < deadline:
+            time.sleep(0.01)
+        client.stop_sweeper()
+        client.stop_sweeper()
+        self.assertEqual(list(client.wrapped_client.get_many('user', ['block'])), [])
+
+    def test_sweeper_survives_errors(self):
+        client = ExpiringFieldsUserStateClient(DictUserStateClient())
+        swept = threading.Event()
+        calls = []
+
+        def sweep():
+            calls.append(None)
+            if len(calls) == 1:
+                raise client.ServiceUnavailable()
+            swept.set()
+
+        client.sweep = sweep
+        with self.assertLogs('edx_user_state_client.expiry', 'ERROR'):
+            client.start_sweeper(interval=0.01)
+            self.assertTrue(swept.wait(5))
+        client.stop_sweeper()
+
+    def test_heap_is_capped(self):
+        client = ExpiringFieldsUserStateClient(DictUserStateClient(), max_scheduled=2)
+        client.set_many('user', {'block': {'a': 1, 'b': 2, 'c': 3}}, ttl=0)
+        client.set_many('user', {'other': {'a': 1}}, ttl=0)
+        self.assertEqual(client.sweep(), 2)
+        self.assertEqual(list(client.get_many('user', ['block', 'other'])), [])
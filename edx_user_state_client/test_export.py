@@ -0,0 +1,107 @@
+"""
+Tests of streaming course state export.
+"""
+import csv
+import gzip
+import json
+import os
+import shutil
+import tempfile
+from itertools import islice
+
+from edx_user_state_client.export import export_course_state, iter_exported_state
+from edx_user_state_client.tests import DictUserStateClient, _UserStateClientTestUtils
+
+
+class TestExportCourseState(_UserStateClientTestUtils):
+    """
+    Tests of export_course_state.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.client = DictUserStateClient()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        for user in range(3):
+            self.set_many(user, {0: {'a': user, 'b': [user]}, 1: {'c': 'd'}, 1000: {'e': 'f'}})
+
+    def read_ndjson(self, paths, opener=open):
+        """Return all the rows in the ndjson ``paths``."""
+        rows = []
+        for path in paths:
+            with opener(path, 'rt') as chunk:
+                rows.extend(json.loads(line) for line in chunk)
+        return rows
+
+    def test_ndjson_chunks(self):
+        paths = export_course_state(self.client, self._course(0), self.directory, chunk_size=4)
+        self.assertEqual(
+            [path.rsplit('/', 1)[1] for path in paths],
+            ['part-00000.ndjson', 'part-00001.ndjson', 'part-00002.ndjson']
+        )
+        rows = self.read_ndjson(paths)
+        self.assertCountEqual(
+            [(row['username'], row['block_key'], row['field'], row['value']) for row in rows],
+            [(self._user(user), str(self._block(0)), 'a', user) for user in range(3)] +
+            [(self._user(user), str(self._block(0)), 'b', [user]) for user in range(3)] +
+            [(self._user(user), str(self._block(1)), 'c', 'd') for user in range(3)]
+        )
+        self.assertEqual({row['course_key'] for row in rows}, {str(self._course(0))})
+        self.assertEqual({row['block_type'] for row in rows}, {'block_type'})
+
+    def test_block_type_filter(self):
+        self.assertEqual(
+            export_course_state(self.client, self._course(0), self.directory, block_type='other'),
+            []
+        )
+
+    def test_gzip(self):
+        paths = export_course_state(self.client, self._course(1), self.directory, compression='gzip')
+        self.assertTrue(paths[0].endswith('.ndjson.gz'))
+        self.assertEqual(len(self.read_ndjson(paths, gzip.open)), 3)
+
+    def test_csv(self):
+        paths = export_course_state(self.client, self._course(0), self.directory, output_format='csv')
+        with open(paths[0], newline='') as chunk:
+            rows = list(csv.DictReader(chunk))
+        self.assertEqual(len(rows), 9)
+        self.assertIn('[1]', [row['value'] for row in rows])
+
+    def test_progress(self):
+        reports = []
+        export_course_state(
+            self.client, self._course(0), self.directory, chunk_size=3,
+            progress=reports.append, expected_records=6,
+        )
+        self.assertEqual([report.rows for report in reports], [3, 6, 9])
+        self.assertEqual(len(reports[-1].files), 3)
+        self.assertEqual(reports[-1].records, 6)
+        self.assertEqual(reports[-1].eta, 0)
+
+    def test_failure_removes_unfinished_chunk(self):
+        iter_all_for_course = self.client.iter_all_for_course
+
+        def failing_entries(*args, **kwargs):
+            yield from islice(iter_all_for_course(*args, **kwargs), 3)
+            raise self.client.ServiceUnavailable()
+
+        self.client.iter_all_for_course = failing_entries
+        with self.assertRaises(self.client.ServiceUnavailable):
+            export_course_state(self.client, self._course(0), self.directory, chunk_size=4, compression='gzip')
+        self.assertEqual(os.listdir(self.directory), ['part-00000.ndjson.gz'])
+        self.assertEqual(len(self.read_ndjson([os.path.join(self.directory, 'part-00000.ndjson.gz')], gzip.open)), 4)
+
+    def test_round_trip(self):
+        paths = export_course_state(self.client, self._course(0), self.directory, chunk_size=2, compression='gzip')
+        restored = DictUserStateClient()
+        self.assertEqual(restored.bulk_load(iter_exported_state(paths)), 6)
+        self.assertCountEqual(restored.iter_all_for_course(self._course(0)), self.iter_all_for_course(0))
+
+    def test_round_trip_empty_state(self):
+        self.set(user=0, block=2, state={})
+        paths = export_course_state(self.client, self._course(0), self.directory)
+        restored = DictUserStateClient()
+        self.assertEqual(restored.bulk_load(iter_exported_state(paths)), 7)
+        self.assertEqual(restored.get(self._user(0), self._block(2)).state, {})
@@ -0,0 +1,120 @@
+"""
+Tests of LazyUserStateFieldData.
+"""
+from unittest import TestCase
+
+from xblock.core import XBlock
+from xblock.fields import Integer, List, Scope, ScopeIds
+from xblock.test.tools import TestRuntime
+
+from edx_user_state_client.field_data import LazyUserStateFieldData
+from edx_user_state_client.tests import RecordingUserStateClient
+
+
+class ProblemBlock(XBlock):
+    """
+    An XBlock with a few user_state fields.
+    """
+    score = Integer(scope=Scope.user_state, default=0)
+    attempts = Integer(scope=Scope.user_state, default=0)
+    answers = List(scope=Scope.user_state)
+
+
+class HintBlock(XBlock):
+    """
+    An XBlock with a different user_state field.
+    """
+    shown = Integer(scope=Scope.user_state, default=0)
+
+
+class TestLazyUserStateFieldData(TestCase):
+    """
+    Tests of when LazyUserStateFieldData reads and writes, and what XBlocks see through it.
+    """
+    def setUp(self):
+        super().setUp()
+        self.backend = RecordingUserStateClient()
+        self.backend.set_many('user', {
+            'a': {'score': 1, 'attempts': 2, 'answers': ['x']},
+            'b': {'score': 3},
+        })
+        self.backend.calls = []
+        self.field_data = LazyUserStateFieldData(self.backend, 'user', ['a', 'b', 'c'])
+        self.runtime = TestRuntime(services={'field-data': self.field_data})
+
+    def block(self, usage_id):
+        """Return a ProblemBlock stored under ``usage_id``."""
+        return self.runtime.construct_xblock_from_class(
+            ProblemBlock, ScopeIds('user', 'problem', usage_id, usage_id)
+        )
+
+    def test_first_access_batches_declared_fields(self):
+        blocks = [self.block(key) for key in 'abc']
+        self.assertEqual(self.backend.calls, [])
+        self.assertEqual([block.score for block in blocks], [1, 3, 0])
+        self.assertEqual(self.backend.calls, [('get_many', ['a', 'b', 'c'], ['answers', 'attempts', 'score'])])
+        self.assertEqual([block.attempts for block in blocks], [2, 0, 0])
+        self.assertEqual([block.answers for block in blocks], [['x'], [], []])
+        self.assertEqual(len(self.backend.calls), 1)
+
+    def test_other_block_type_loads_its_fields(self):
+        self.assertEqual([self.block(key).score for key in 'abc'], [1, 3, 0])
+        block = self.runtime.construct_xblock_from_class(HintBlock, ScopeIds('user', 'hint', 'd', 'd'))
+        self.assertEqual(block.shown, 0)
+        self.assertEqual(self.backend.calls[1:], [('get_many', ['d'], ['shown'])])
+        self.assertEqual(self.block('e').attempts, 0)
+        self.assertEqual(self.backend.calls[2:], [('get_many', ['e'], ['answers', 'attempts', 'score'])])
+
+    def test_prefetch_fields(self):
+        self.field_data = LazyUserStateFieldData(self.backend, 'user', ['a', 'b'], prefetch_fields=['shown'])
+        self.runtime = TestRuntime(services={'field-data': self.field_data})
+        block = self.block('a')
+        self.assertEqual((block.score, block.attempts), (1, 2))
+        self.assertEqual(self.backend.calls, [('get_many', ['a', 'b'], ['answers', 'attempts', 'score', 'shown'])])
+
+    def test_unregistered_block_joins_batch(self):
+        self.assertEqual(self.block('d').score, 0)
+        self.assertEqual(self.backend.calls, [('get_many', ['a', 'b', 'c', 'd'], ['answers', 'attempts', 'score'])])
+
+    def test_writes_back_dirty_fields(self):
+        first, second = self.block('a'), self.block('c')
+        first.score = 5
+        first.save()
+        second.attempts = 1
+        second.save()
+        del first.attempts
+        first.save()
+        self.assertTrue(self.field_data.is_dirty)
+        self.assertEqual([call[0] for call in self.backend.calls], [])
+
+        self.field_data.flush()
+        self.assertFalse(self.field_data.is_dirty)
+        self.assertEqual(self.backend.calls, [
+            ('set_many', {'a': {'score': 5}, 'c': {'attempts': 1}}),
+            ('delete_many', ['a'], ['attempts']),
+        ])
+        self.assertEqual(self.backend.get('user', 'a').state, {'score': 5, 'answers': ['x']})
+        self.assertEqual(self.backend.get('user', 'c').state, {'attempts': 1})
+
+        self.backend.calls = []
+        self.assertEqual((first.score, first.attempts, second.attempts), (5, 0, 1))
+        self.field_data.flush()
+        self.assertEqual(self.backend.calls, [])
+
+    def test_get_returns_copies(self):
+        block = self.block('a')
+        answers = self.field_data.get(block, 'answers')
+        answers.append('y')
+        self.assertEqual(self.field_data.get(block, 'answers'), ['x'])
+        self.assertFalse(self.field_data.is_dirty)
+
+    def test_has(self):
+        block = self.block('b')
+        self.assertTrue(self.field_data.has(block, 'score'))
+        self.assertFalse(self.field_data.has(block, 'attempts'))
+        self.field_data.set(block, 'attempts', 1)
+        self.assertTrue(self.field_data.has(block, 'attempts'))
+        self.field_data.delete(block, 'score')
+        self.assertFalse(self.field_data.has(block, 'score'))
+        with self.assertRaises(KeyError):
+            self.field_data.get(block, 'score')
@@ -0,0 +1,30 @@
+"""
+Tests of KeyInterner.
+"""
+from unittest import TestCase
+
+from opaque_keys.edx.locator import BlockUsageLocator, CourseLocator
+
+from edx_user_state_client.interning import KeyInterner
+
+
+class TestKeyInterner(TestCase):
+    """
+    Tests of KeyInterner.
+    """
+    def test_interns_equal_keys_once(self):
+        interner = KeyInterner()
+        course = CourseLocator('org', 'course', 'run')
+        first = interner.intern(BlockUsageLocator(course, 'problem', 'p1'))
+        second = interner.intern(BlockUsageLocator(course, 'problem', 'p2'))
+        self.assertEqual((first, second), (0, 1))
+        self.assertEqual(interner.intern(BlockUsageLocator(course, 'problem', 'p1')), first)
+        self.assertEqual(interner.key(second), BlockUsageLocator(course, 'problem', 'p2'))
+        self.assertEqual(len(interner), 2)
+
+    def test_lookup_does_not_intern(self):
+        interner = KeyInterner()
+        self.assertIsNone(interner.lookup('user'))
+        self.assertEqual(len(interner), 0)
+        interner.intern('user')
+        self.assertEqual(interner.lookup('user'), 0)
@@ -0,0 +1,160 @@
+"""
+Tests of the load generator.
+"""
+import io
+import json
+import os
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+from datetime import datetime
+from unittest import TestCase
+
+import pytz
+from opaque_keys.edx.locator import CourseLocator
+
+from edx_user_state_client.loadgen import (
+    LoadReport, Operation, SyntheticWorkload, _percentile, main, operations_from_trace, run_load
+)
+from edx_user_state_client.ordering import ORDER_BY_BLOCK
+from edx_user_state_client.tests import DictUserStateClient
+from edx_user_state_client.tracing import TracingUserStateClient
+
+
+def make_client():
+    """Return an empty client, for ``--client``."""
+    return DictUserStateClient()
+
+
+class TestOperations(TestCase):
+    """
+    Tests of the workloads.
+    """
+    def test_replays_trace(self):
+        trace = io.StringIO()
+        client = TracingUserStateClient(DictUserStateClient(), trace)
+        client.set_many('user', {'a': {'x': 1}, 'b': {'y': 2}})
+        list(client.get_many('user', ['a', 'b'], fields=['x']))
+        client.delete_many('user', ['b'])
+        list(client.get_history('user', 'a'))
+        list(client.iter_all_for_block('a'))
+        list(client.iter_all_for_blocks(['a', 'b']))
+        list(client.iter_all_for_course_sorted(CourseLocator('org', 'course', 'run'), order_by=ORDER_BY_BLOCK))
+        list(client.iter_chunks_for_blocks(['a'], chunk_size=10, columnar=True, fields=['x']))
+        list(client.iter_chunks_for_course(CourseLocator('org', 'course', 'run'), block_type='problem'))
+        list(client.get_many_as_of('user', ['a'], datetime(2020, 1, 1, tzinfo=pytz.utc)))
+
+        records = [json.loads(line) for line in trace.getvalue().splitlines()]
+        operations = list(operations_from_trace(records))
+        self.assertEqual(
+            [operation.method for operation in operations],
+            [
+                'set_many', 'get_many', 'delete_many', 'get_history', 'iter_all_for_block', 'iter_all_for_blocks',
+                'iter_all_for_course_sorted', 'iter_chunks_for_blocks', 'iter_chunks_for_course', 'get_many_as_of',
+            ],
+        )
+        self.assertEqual(operations[1].kwargs['fields'], ['x'])
+        self.assertEqual(operations[5].kwargs['block_keys'], ['a', 'b'])
+        self.assertEqual(operations[6].kwargs['order_by'], ORDER_BY_BLOCK)
+        self.assertEqual(
+            (operations[7].kwargs['chunk_size'], operations[7].kwargs['columnar'], operations[7].kwargs['fields']),
+            (10, True, ['x']),
+        )
+        self.assertEqual(operations[8].kwargs['block_type'], 'problem')
+        self.assertEqual(operations[9].kwargs['timestamp'], datetime(2020, 1, 1, tzinfo=pytz.utc))
+
+        replayed = DictUserStateClient()
+        for operation in operations:
+            operation.apply(replayed)
+        self.assertEqual(set(replayed.get('user', 'a').state), {'x'})
+        with self.assertRaises(replayed.DoesNotExist):
+            replayed.get('user', 'b')
+
+    def test_synthetic_workload_is_repeatable(self):
+        first = list(SyntheticWorkload(seed=1).operations(50))
+        second = list(SyntheticWorkload(seed=1).operations(50))
+        self.assertEqual(first, second)
+
+    def test_synthetic_workload_mix(self):
+        workload = SyntheticWorkload(users=3, courses=1, blocks_per_course=5, mix={'get_many': 1}, seed=0)
+        operations = list(workload.operations(20))
+        self.assertEqual({operation.method for operation in operations}, {'get_many'})
+        self.assertTrue(all(1 <= len(operation.kwargs['block_keys']) <= 5 for operation in operations))
+
+    def test_populate(self):
+        client = DictUserStateClient()
+        workload = SyntheticWorkload(users=2, courses=2, blocks_per_course=3, fields_per_block=2, seed=0)
+        self.assertEqual(workload.populate(client), 12)
+        self.assertEqual(len(list(client.iter_all_for_course(workload.course_key(1)))), 6)
+        self.assertEqual(len(client.get(workload.username(1), workload.block_key(0, 2)).state), 2)
+
+
+class TestRunLoad(TestCase):
+    """
+    Tests of running a workload and reporting on it.
+    """
+    def test_percentile(self):
+        ordered = list(range(1, 101))
+        self.assertEqual(_percentile(ordered, 50), 50)
+        self.assertEqual(_percentile(ordered, 99), 99)
+        self.assertEqual(_percentile([], 50), 0.0)
+
+    def test_runs_every_operation(self):
+        client = DictUserStateClient()
+        workload = SyntheticWorkload(users=10, courses=2, blocks_per_course=10, seed=0)
+        workload.populate(client)
+        for use_asyncio in (False, True):
+            report = run_load(client, workload.operations(200), concurrency=4, use_asyncio=use_asyncio)
+            self.assertEqual(report.total, 200)
+            self.assertEqual(report.summary()['all']['count'], 200)
+            self.assertGreater(report.throughput, 0)
+
+    def test_counts_errors(self):
+        client = DictUserStateClient()
+        operations = [Operation('get_many', {'username': 'user', 'block_keys': ['a']}), Operation('get', {})]
+        report = run_load(client, operations, concurrency=1)
+        self.assertEqual(report.errors, {'get': 1})
+        self.assertEqual(report.summary()['all']['errors'], 1)
+
+    def test_rate_and_duration(self):
+        operations = (Operation('get_many', {'username': 'user', 'block_keys': ['a']}) for _ in range(1000))
+        report = run_load(DictUserStateClient(), operations, concurrency=2, rate=100, duration=0.2)
+        self.assertLessEqual(report.total, 21)
+        self.assertGreaterEqual(report.elapsed, 0.19)
+
+    def test_format(self):
+        report = LoadReport(2.0, {'get_many': [0.001, 0.002], 'set_many': [0.004]}, {'set_many': 1})
+        text = report.format()
+        self.assertIn('3 operations in 2.00s (1.5/s)', text)
+        self.assertIn('set_many', text)
+        self.assertIn('errors=1', text)
+
+
+class TestMain(TestCase):
+    """
+    Tests of running the load generator as a command.
+    """
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def run_main(self, *argv):
+        """Return what ``main(argv)`` prints."""
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.assertEqual(main(['--client', 'edx_user_state_client.test_loadgen:make_client', *argv]), 0)
+        return output.getvalue()
+
+    def test_synthetic(self):
+        output = self.run_main('--operations', '100', '--populate', '--seed', '1', '--users', '5')
+        self.assertIn('100 operations', output)
+
+    def test_trace(self):
+        path = os.path.join(self.directory, 'trace.ndjson')
+        client = TracingUserStateClient(DictUserStateClient(), path)
+        client.set_many('user', {'a': {'x': 1}})
+        list(client.get_many('user', ['a']))
+        client.close()
+        output = self.run_main('--trace', path, '--asyncio')
+        self.assertIn('2 operations', output)
@@ -0,0 +1,44 @@
+"""
+Tests of the sort orders and merge_join.
+"""
+from operator import itemgetter
+from unittest import TestCase
+
+from edx_user_state_client.interface import XBlockUserState
+from edx_user_state_client.ordering import ORDER_BY_BLOCK, ORDER_BY_USERNAME, entry_sort_key, merge_join
+
+
+class TestOrdering(TestCase):
+    """
+    Tests of entry_sort_key and merge_join.
+    """
+    def test_entry_sort_key(self):
+        entry = XBlockUserState('user', 12, {}, None, None)
+        self.assertEqual(entry_sort_key(ORDER_BY_USERNAME)(entry), ('user', '12'))
+        self.assertEqual(entry_sort_key(ORDER_BY_BLOCK)(entry), ('12', 'user'))
+        with self.assertRaises(ValueError):
+            entry_sort_key('updated')
+
+    def test_merge_join(self):
+        left = [('a', 1), ('a', 2), ('c', 3), ('d', 4)]
+        right = [{'key': 'b'}, {'key': 'c'}, {'key': 'c'}, {'key': 'e'}]
+        self.assertEqual(list(merge_join(left, right, itemgetter(0), itemgetter('key'))), [
+            ('a', [('a', 1), ('a', 2)], []),
+            ('b', [], [{'key': 'b'}]),
+            ('c', [('c', 3)], [{'key': 'c'}, {'key': 'c'}]),
+            ('d', [('d', 4)], []),
+            ('e', [], [{'key': 'e'}]),
+        ])
+        self.assertEqual(list(merge_join([], [1, 2], lambda item: item)), [(1, [], [1]), (2, [], [2])])
+
+    def test_merge_join_is_lazy(self):
+        def left():
+            yield from [1, 2]
+            raise AssertionError('read too far')
+
+        joined = merge_join(left(), iter([1, 2, 3]), lambda item: item)
+        self.assertEqual(next(joined), (1, [1], [1]))
+
+    def test_merge_join_unsorted(self):
+        with self.assertRaises(ValueError):
+            list(merge_join([1, 3, 2], [], lambda item: item))
@@ -0,0 +1,118 @@
+"""
+Tests of SizeAccountingUserStateClient.
+"""
+from unittest import TestCase
+
+from opaque_keys.edx.locator import BlockUsageLocator, CourseLocator
+
+from edx_user_state_client.quotas import SizeAccountingUserStateClient, field_size
+from edx_user_state_client.test_cache import CountingUserStateClient
+from edx_user_state_client.tests import DictUserStateClient, UserStateClientStressTestBase, UserStateClientTestBase
+
+
+class TestSizeAccountingUserStateClient(UserStateClientTestBase, UserStateClientStressTestBase):
+    """
+    Blackbox tests of SizeAccountingUserStateClient.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.client = SizeAccountingUserStateClient(DictUserStateClient(), max_block_bytes=1000)
+
+
+class TestSizeAccounting(TestCase):
+    """
+    Tests of the sizes tracked, and the quotas enforced.
+    """
+    course = CourseLocator('org', 'course', 'run')
+    other_course = CourseLocator('org', 'other', 'run')
+
+    def setUp(self):
+        super().setUp()
+        self.backend = CountingUserStateClient()
+        self.first = BlockUsageLocator(self.course, 'problem', 'p1')
+        self.second = BlockUsageLocator(self.course, 'problem', 'p2')
+        self.elsewhere = BlockUsageLocator(self.other_course, 'problem', 'p1')
+        self.client = SizeAccountingUserStateClient(self.backend, sizer=lambda field, value: len(value))
+
+    def test_field_size(self):
+        self.assertEqual(field_size('a', 'xy'), 5)
+        self.assertEqual(field_size('ab', {'c': [1, 2]}), 13)
+
+    def test_tracks_totals(self):
+        self.client.set_many('alice', {self.first: {'a': 'xxx', 'b': 'yy'}, self.elsewhere: {'a': 'x'}})
+        self.client.set_many('bob', {self.first: {'a': 'xxxxxxx'}})
+        self.client.set_many('alice', {self.first: {'a': 'x'}, self.second: {'c': 'zzzz'}})
+        self.assertEqual(self.client.user_bytes('alice'), 8)
+        self.assertEqual(self.client.block_bytes(self.first), 10)
+        self.assertEqual(self.client.course_bytes(self.course), 14)
+        self.assertEqual(self.client.course_bytes(self.other_course), 1)
+        self.assertEqual(self.client.top_users(1), [('alice', 8)])
+        self.assertEqual(self.client.top_blocks(), [(self.first, 10), (self.second, 4), (self.elsewhere, 1)])
+        self.assertEqual(self.client.top_courses(), [(self.course, 14), (self.other_course, 1)])
+
+        self.client.delete_many('alice', [self.first], fields=['b'])
+        self.client.delete_many('bob', [self.first])
+        self.assertEqual(self.client.block_bytes(self.first), 1)
+        self.assertEqual(self.client.top_users(), [('alice', 6)])
+
+    def test_learns_untracked_sizes_once(self):
+        self.backend.set_many('alice', {self.first: {'a': 'xxxx'}, self.second: {'b': 'yy'}})
+        self.client.set_many('alice', {self.first: {'c': 'z'}, self.second: {'b': 'y'}})
+        self.assertEqual(self.backend.requested, [[self.first, self.second]])
+        self.assertEqual(self.client.user_bytes('alice'), 6)
+        self.client.set_many('alice', {self.first: {'c': 'zz'}})
+        self.assertEqual(len(self.backend.requested), 1)
+
+    def test_scan_course(self):
+        self.backend.set_many('alice', {self.first: {'a': 'xxxx'}, self.elsewhere: {'a': 'x'}})
+        self.backend.set_many('bob', {self.second: {'a': 'xx'}})
+        self.assertEqual(self.client.scan_course(self.course), 2)
+        self.assertEqual(self.client.course_bytes(self.course), 6)
+        self.assertEqual(self.client.course_bytes(self.other_course), 0)
+
+    def test_quotas(self):
+        client = SizeAccountingUserStateClient(
+            self.backend, max_block_bytes=5, max_user_bytes=8, max_course_bytes=10,
+            sizer=lambda field, value: len(value),
+        )
+        client.set_many('alice', {self.first: {'a': 'xxxxx'}})
+        with self.assertRaises(client.QuotaExceeded):
+            client.set_many('alice', {self.first: {'b': 'x'}})
+        with self.assertRaises(client.QuotaExceeded):
+            client.set_many('alice', {self.second: {'a': 'xxxx'}})
+        client.set_many('bob', {self.first: {'a': 'xxxxx'}})
+        with self.assertRaises(client.QuotaExceeded):
+            client.set_many('carol', {self.second: {'a': 'x'}})
+        client.set_many('carol', {self.elsewhere: {'a': 'x'}})
+
+        self.assertEqual(self.backend.get('alice', self.first).state, {'a': 'xxxxx'})
+        with self.assertRaises(self.backend.DoesNotExist):
+            self.backend.get('alice', self.second)
+        self.assertEqual(client.course_bytes(self.course), 10)
+
+        # Shrinking state that is over a lowered quota is still allowed.
+        client.max_block_bytes = 2
+        client.set_many('alice', {self.first: {'a': 'xxx'}})
+        self.assertEqual(client.user_bytes('alice'), 3)
+
+    def test_failed_write_stops_tracking(self):
+        self.client.set_many('alice', {self.first: {'a': 'xx'}})
+        updated = self.client.get('alice', self.first).updated
+        self.client.set_many('alice', {self.first: {'a': 'xxxx'}})
+        with self.assertRaises(self.client.VersionConflict):
+            self.client.set_many_if_unmodified('alice', {self.first: {'a': 'xxxxxxxx'}}, {self.first: updated})
+        self.assertEqual(self.client.user_bytes('alice'), 0)
+        self.client.set_many('alice', {self.first: {'b': 'y'}})
+        self.assertEqual(self.client.user_bytes('alice'), 5)
+
+    def test_delete_all(self):
+        self.client.set_many('alice', {self.first: {'a': 'xx'}, self.elsewhere: {'a': 'xxx'}})
+        self.client.set_many('bob', {self.first: {'a': 'x'}, self.second: {'a': 'xxxx'}})
+        self.client.delete_all_for_block(self.first)
+        self.assertEqual((self.client.user_bytes('alice'), self.client.user_bytes('bob')), (3, 4))
+        self.client.delete_all_for_user('alice', course_keys=[self.other_course])
+        self.assertEqual(self.client.user_bytes('alice'), 0)
+        self.client.delete_all_for_course(self.course)
+        self.assertEqual(self.client.top_courses(), [])
@@ -0,0 +1,85 @@
+"""
+Tests of ReplicaRoutingUserStateClient.
+"""
+from unittest import TestCase
+
+from edx_user_state_client.replicas import ReplicaRoutingUserStateClient
+from edx_user_state_client.tests import DictUserStateClient, UserStateClientStressTestBase, UserStateClientTestBase
+
+
+class TestReplicaRoutingUserStateClient(UserStateClientTestBase, UserStateClientStressTestBase):
+    """
+    Blackbox tests of ReplicaRoutingUserStateClient, with replicas that replicate instantly.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        store = DictUserStateClient()
+        self.client = ReplicaRoutingUserStateClient(store, [store, store], read_your_writes_window=0)
+
+
+class TestReplicaRouting(TestCase):
+    """
+    Tests of which client each call goes to.
+    """
+    def setUp(self):
+        super().setUp()
+        self.now = 0
+        self.primary = DictUserStateClient()
+        self.replicas = [DictUserStateClient(), DictUserStateClient()]
+        for replica in self.replicas:
+            replica.set('user', 'a', {'x': 'replica'})
+            replica.set('reader', 'a', {'x': 'replica'})
+        self.client = ReplicaRoutingUserStateClient(
+            self.primary, self.replicas, read_your_writes_window=5, clock=lambda: self.now
+        )
+
+    def test_writes_go_to_primary(self):
+        self.client.set('user', 'a', {'x': 'primary'})
+        self.client.delete('user', 'b')
+        self.assertEqual(self.primary.get('user', 'a').state, {'x': 'primary'})
+        self.assertEqual(self.replicas[0].get('user', 'a').state, {'x': 'replica'})
+
+    def test_read_your_writes(self):
+        self.client.set('user', 'a', {'x': 'primary'})
+        self.now = 4
+        self.assertEqual(self.client.get('user', 'a').state, {'x': 'primary'})
+        self.assertEqual(next(self.client.get_history('user', 'a')).state, {'x': 'primary'})
+        self.assertEqual(self.client.get('reader', 'a').state, {'x': 'replica'})
+        self.now = 5
+        self.assertEqual(self.client.get('user', 'a').state, {'x': 'replica'})
+
+    def test_scans_balanced_over_replicas(self):
+        self.replicas[1].set('other', 'a', {'x': 'second'})
+        self.client.set('user', 'a', {'x': 'primary'})
+        self.assertEqual(len(list(self.client.iter_all_for_block('a'))), 2)
+        self.assertEqual(len(list(self.client.iter_all_for_block('a'))), 3)
+        self.assertEqual(len(list(self.client.iter_all_for_block('a'))), 2)
+
+    def test_no_replicas(self):
+        client = ReplicaRoutingUserStateClient(self.primary, [])
+        self.primary.set('user', 'a', {'x': 'primary'})
+        self.assertEqual(list(client.iter_all_for_block('a'))[0].state, {'x': 'primary'})
+
+    def test_bulk_load_and_conditional_writes(self):
+        self.client.set_many_if_unmodified('other', {'a': {'x': 'primary'}}, {'a': None})
+        self.assertEqual(self.client.get('other', 'a').state, {'x': 'primary'})
+        self.client.bulk_load(self.replicas[0].iter_all_for_block('a'))
+        self.assertEqual(self.client.get('reader', 'a').state, {'x': 'replica'})
+        self.assertEqual(self.primary.get('reader', 'a').state, {'x': 'replica'})
+
+    def test_tracked_writers_pruned(self):
+        for user in range(3):
+            self.client.set(f'user{user}', 'a', {})
+            self.now += 3
+        self.client.set('user1', 'a', {})
+        self.assertEqual(list(self.client._last_writes), ['user2', 'user1'])  # pylint: disable=protected-access
+
+    def test_delete_all_keeps_everyone_on_primary(self):
+        self.primary.set('reader', 'a', {'x': 'primary'})
+        self.client.delete_all_for_block('b')
+        self.now = 4
+        self.assertEqual(self.client.get('reader', 'a').state, {'x': 'primary'})
+        self.now = 5
+        self.assertEqual(self.client.get('reader', 'a').state, {'x': 'replica'})
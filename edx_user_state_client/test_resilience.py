@@ -0,0 +1,164 @@
+"""
+Tests of ResilientUserStateClient.
+"""
+import threading
+import time
+from unittest import TestCase
+
+from xblock.fields import Scope
+
+from edx_user_state_client.resilience import ResilientUserStateClient
+from edx_user_state_client.tests import DictUserStateClient, UserStateClientTestBase
+
+
+class FlakyUserStateClient(DictUserStateClient):
+    """
+    A DictUserStateClient whose calls raise ServiceUnavailable ``failures`` times, and take ``delay`` seconds.
+    """
+    def __init__(self, failures=0, delay=0):
+        super().__init__()
+        self.failures = failures
+        self.delay = delay
+        self.calls = 0
+
+    def _call(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.failures:
+            self.failures -= 1
+            raise self.ServiceUnavailable()
+
+    def get_many(self, username, block_keys, scope=Scope.user_state, fields=None):
+        self._call()
+        return super().get_many(username, block_keys, scope, fields)
+
+    def set_many(self, username, block_keys_to_state, scope=Scope.user_state):
+        self._call()
+        return super().set_many(username, block_keys_to_state, scope)
+
+    def iter_all_for_block(self, block_key, scope=Scope.user_state):
+        self._call()
+        return super().iter_all_for_block(block_key, scope)
+
+
+class TestResilientUserStateClient(UserStateClientTestBase):
+    """
+    Blackbox tests of ResilientUserStateClient.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.client = ResilientUserStateClient(DictUserStateClient(), deadline=5, replica=DictUserStateClient())
+        self.addCleanup(self.client.close)
+
+
+class TestResilience(TestCase):
+    """
+    Tests of retries, deadlines and hedging.
+    """
+    def make_client(self, backend, **kwargs):
+        """Return a ResilientUserStateClient for ``backend`` that records its sleeps."""
+        self.sleeps = []
+        client = ResilientUserStateClient(backend, sleep=self.sleeps.append, **kwargs)
+        self.addCleanup(client.close)
+        return client
+
+    def test_read_retried(self):
+        backend = FlakyUserStateClient()
+        backend.set('user', 'a', {'x': 1})
+        backend.failures = 2
+        client = self.make_client(backend, backoff_base=0.1)
+        self.assertEqual(client.get('user', 'a').state, {'x': 1})
+        self.assertEqual(backend.calls, 1 + 3)
+        self.assertEqual(len(self.sleeps), 2)
+        self.assertLessEqual(self.sleeps[0], 0.1)
+        self.assertLessEqual(self.sleeps[1], 0.2)
+
+    def test_retries_exhausted(self):
+        client = self.make_client(FlakyUserStateClient(failures=5), retries=2)
+        with self.assertRaises(client.ServiceUnavailable):
+            client.get('user', 'a')
+        self.assertEqual(len(self.sleeps), 2)
+
+    def test_writes_not_retried(self):
+        backend = FlakyUserStateClient(failures=1)
+        client = self.make_client(backend)
+        with self.assertRaises(client.ServiceUnavailable):
+            client.set('user', 'a', {'x': 1})
+        self.assertEqual(backend.calls, 1)
+
+    def test_iterator_retried(self):
+        backend = FlakyUserStateClient()
+        backend.set('user', 'a', {'x': 1})
+        backend.failures = 1
+        client = self.make_client(backend)
+        self.assertEqual([entry.state for entry in client.iter_all_for_block('a')], [{'x': 1}])
+        self.assertEqual(list(client.iter_all_for_block('missing')), [])
+
+    def test_history_does_not_exist_not_retried(self):
+        client = self.make_client(DictUserStateClient())
+        with self.assertRaises(client.DoesNotExist):
+            next(client.get_history('user', 'a'))
+        self.assertEqual(self.sleeps, [])
+
+    def test_deadline(self):
+        client = self.make_client(FlakyUserStateClient(delay=0.5), deadline=0.05)
+        start = time.monotonic()
+        with self.assertRaises(client.ServiceUnavailable):
+            client.get('user', 'a')
+        self.assertLess(time.monotonic() - start, 0.4)
+
+    def test_hedged_read(self):
+        primary = FlakyUserStateClient()
+        primary.set('user', 'a', {'x': 'primary'})
+        replica = DictUserStateClient()
+        replica.set('user', 'a', {'x': 'replica'})
+        client = self.make_client(primary, replica=replica, hedge_min_samples=3, hedge_percentile=50)
+        for _ in range(3):
+            self.assertIsNone(client.hedge_delay())
+            self.assertEqual(client.get('user', 'a').state, {'x': 'primary'})
+        self.assertIsNotNone(client.hedge_delay())
+        primary.delay = 0.5
+        self.assertEqual(client.get('user', 'a').state, {'x': 'replica'})
+
+    def test_hedge_survives_primary_failure(self):
+        primary = FlakyUserStateClient()
+        replica = DictUserStateClient()
+        replica.set('user', 'a', {'x': 'replica'})
+        client = self.make_client(primary, replica=replica, hedge_min_samples=1, retries=0)
+        list(client.get_many('user', []))
+        primary.delay, primary.failures = 0.2, 1
+        self.assertEqual(client.get('user', 'a').state, {'x': 'replica'})
+
+    def test_reads_on_calling_thread_without_deadline_or_hedge(self):
+        threads = []
+
+        class RecordingClient(DictUserStateClient):
+            """A DictUserStateClient that records which threads read from it."""
+            def get_many(self, username, block_keys, scope=None, fields=None):
+                threads.append(threading.get_ident())
+                return super().get_many(username, block_keys, scope, fields)
+
+        client = self.make_client(RecordingClient())
+        list(client.get_many('user', ['a']))
+        self.assertEqual(threads, [threading.get_ident()])
+
+    def test_fast_primary_failure_hedged_at_once(self):
+        replica = DictUserStateClient()
+        replica.set('user', 'a', {'x': 'replica'})
+        for deadline in (None, 5):
+            primary = FlakyUserStateClient(failures=1)
+            client = self.make_client(primary, replica=replica, retries=0, deadline=deadline)
+            self.assertEqual(client.get('user', 'a').state, {'x': 'replica'})
+
+    def test_abandoned_reads_bounded(self):
+        primary = FlakyUserStateClient(delay=0.5)
+        client = self.make_client(primary, deadline=0.05, max_workers=1, retries=0)
+        with self.assertRaises(client.ServiceUnavailable):
+            client.get('user', 'a')
+        start = time.monotonic()
+        with self.assertRaises(client.ServiceUnavailable):
+            client.get('user', 'a')
+        self.assertLess(time.monotonic() - start, 0.1)
+        self.assertEqual(primary.calls, 1)
@@ -0,0 +1,63 @@
+"""
+Tests of ScopeRoutingUserStateClient.
+"""
+from unittest import TestCase
+
+from xblock.fields import Scope
+
+from edx_user_state_client.cache import CachedUserStateClient
+from edx_user_state_client.routing import ScopeRoutingUserStateClient
+from edx_user_state_client.tests import DictUserStateClient, UserStateClientStressTestBase, UserStateClientTestBase
+
+
+class TestScopeRoutingUserStateClient(UserStateClientTestBase, UserStateClientStressTestBase):
+    """
+    Blackbox tests of ScopeRoutingUserStateClient.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.client = ScopeRoutingUserStateClient({
+            Scope.user_state: DictUserStateClient(),
+            Scope.preferences: DictUserStateClient(),
+        })
+
+
+class TestScopeRouting(TestCase):
+    """
+    Tests that each scope is sent to its own client.
+    """
+    def setUp(self):
+        super().setUp()
+        self.user_state = DictUserStateClient()
+        self.preferences = CachedUserStateClient(DictUserStateClient(), max_entries=10)
+        self.client = ScopeRoutingUserStateClient(
+            {Scope.user_state: self.user_state, Scope.preferences: self.preferences},
+        )
+
+    def test_scopes_are_separate(self):
+        self.client.set('user', 'problem', {'a': 1}, scope=Scope.preferences)
+        self.client.set('user', 'problem', {'a': 2}, scope=Scope.user_state)
+        self.assertEqual(self.client.get('user', 'problem', scope=Scope.preferences).state, {'a': 1})
+        self.assertEqual(self.user_state.get('user', 'problem').state, {'a': 2})
+        with self.assertRaises(self.client.DoesNotExist):
+            self.user_state.get('user', 'problem', scope=Scope.preferences)
+
+    def test_unrouted_scope(self):
+        with self.assertRaises(ValueError):
+            self.client.get('user', None, scope=Scope.user_info)
+
+    def test_default_client(self):
+        default = DictUserStateClient()
+        client = ScopeRoutingUserStateClient({}, default=default)
+        client.set('user', None, {'a': 1}, scope=Scope.user_info)
+        self.assertEqual(default.get('user', None, scope=Scope.user_info).state, {'a': 1})
+
+    def test_bulk_state_does_not_evict_preferences(self):
+        self.client.set('user', 'problem', {'a': 1}, scope=Scope.preferences)
+        self.client.get('user', 'problem', scope=Scope.preferences)
+        for block in range(100):
+            self.client.set('user', f'block{block}', {'a': block})
+            self.client.get('user', f'block{block}')
+        self.assertEqual(len(self.preferences), 1)
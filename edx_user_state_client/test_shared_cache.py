@@ -0,0 +1,182 @@
+"""
+Tests of SharedCacheUserStateClient and the memcached text protocol transport.
+"""
+from unittest import TestCase
+
+from xblock.fields import Scope
+
+from edx_user_state_client.interface import XBlockUserState
+from edx_user_state_client.shared_cache import (
+    CacheTransportError,
+    LocalMemcachedServer,
+    MemcachedTextTransport,
+    SharedCacheUserStateClient
+)
+from edx_user_state_client.test_cache import CountingUserStateClient
+from edx_user_state_client.tests import DictUserStateClient, UserStateClientStressTestBase, UserStateClientTestBase
+
+
+class _LocalServerMixin(TestCase):
+    """
+    Run a LocalMemcachedServer for the duration of each test.
+    """
+    __test__ = False
+
+    def setUp(self):
+        super().setUp()
+        self.server = LocalMemcachedServer().start()
+        self.addCleanup(self.server.stop)
+
+    def transport(self, **kwargs):
+        """Return a new transport connected to the local server."""
+        transport = MemcachedTextTransport(*self.server.server_address, **kwargs)
+        self.addCleanup(transport.close)
+        return transport
+
+
+class TestSharedCacheUserStateClient(_LocalServerMixin, UserStateClientTestBase, UserStateClientStressTestBase):
+    """
+    Blackbox tests of SharedCacheUserStateClient.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.client = SharedCacheUserStateClient(DictUserStateClient(), self.transport())
+
+
+class TestMemcachedTextTransport(_LocalServerMixin):
+    """
+    Tests of MemcachedTextTransport against LocalMemcachedServer.
+    """
+    __test__ = True
+
+    def test_get_many_batches(self):
+        transport = self.transport(max_keys_per_get=2)
+        for i in range(5):
+            transport.set(f'k{i}', str(i).encode())
+        self.assertEqual(
+            transport.get_many([f'k{i}' for i in range(6)]),
+            {f'k{i}': str(i).encode() for i in range(5)},
+        )
+
+    def test_add_incr_delete(self):
+        transport = self.transport()
+        self.assertTrue(transport.add('k', b'1'))
+        self.assertFalse(transport.add('k', b'2'))
+        self.assertEqual(transport.incr('k'), 2)
+        self.assertIsNone(transport.incr('missing'))
+        self.assertTrue(transport.delete('k'))
+        self.assertFalse(transport.delete('k'))
+
+    def test_binary_values(self):
+        transport = self.transport()
+        transport.set('k', b'a\r\nb')
+        self.assertEqual(transport.get_many(['k']), {'k': b'a\r\nb'})
+
+    def test_server_unavailable(self):
+        transport = self.transport()
+        self.server.stop()
+        with self.assertRaises(CacheTransportError):
+            transport.get_many(['k'])
+
+
+class TestSharedCaching(_LocalServerMixin):
+    """
+    Tests of how SharedCacheUserStateClient shares state between clients.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.backend = CountingUserStateClient()
+        # Two clients sharing a backend and cache server, standing in for two processes.
+        self.first = SharedCacheUserStateClient(self.backend, self.transport(), stampede_wait=0.05)
+        self.second = SharedCacheUserStateClient(self.backend, self.transport(), stampede_wait=0.05)
+
+    def test_read_shared_between_processes(self):
+        self.backend.set_many('user', {'a': {'x': 1}, 'b': {'x': 2}})
+        self.assertEqual(len(list(self.first.get_many('user', ['a', 'b', 'c']))), 2)
+        self.assertEqual(
+            [entry.state for entry in self.second.get_many('user', ['a', 'b', 'c'], fields=['x'])],
+            [{'x': 1}, {'x': 2}],
+        )
+        self.assertEqual(self.backend.requested, [['a', 'b', 'c']])
+
+    def test_write_invalidates_other_processes(self):
+        self.backend.set('user', 'a', {'x': 1})
+        self.second.get('user', 'a')
+        self.first.set('user', 'a', {'x': 2})
+        self.assertEqual(self.second.get('user', 'a').state, {'x': 2})
+        self.first.delete('user', 'a')
+        with self.assertRaises(self.second.DoesNotExist):
+            self.second.get('user', 'a')
+
+    def test_delete_all_invalidates_other_processes(self):
+        self.backend.set_many('user', {'a': {'x': 1}})
+        self.backend.set_many('other', {'a': {'x': 2}})
+        self.second.get('user', 'a')
+        self.second.get('other', 'a')
+        self.assertEqual(self.first.delete_all_for_block('a'), 2)
+        self.assertEqual(list(self.second.get_many('user', ['a'])), [])
+        self.assertEqual(list(self.second.get_many('other', ['a'])), [])
+        self.backend.set_many('user', {'b': {'x': 3}, 'c': {'x': 4}})
+        self.second.get('user', 'b')
+        self.assertEqual(self.first.delete_all_for_user('user'), 2)
+        self.assertEqual(list(self.second.get_many('user', ['b', 'c'])), [])
+
+    def test_delete_all_streams_batches(self):
+        self.backend.set_many('user', {'a': {'x': 1}})
+        self.backend.set_many('other', {'a': {'x': 2}})
+        self.second.get('user', 'a')
+        progress = []
+        self.assertEqual(
+            self.first.delete_all_for_block('a', purge_history=True, batch_size=1, progress=progress.append), 2
+        )
+        self.assertEqual(progress, [1, 2])
+        self.assertEqual(list(self.second.get_many('user', ['a'])), [])
+        with self.assertRaises(self.backend.DoesNotExist):
+            next(self.backend.get_history('user', 'a'))
+
+    def test_bulk_load_invalidates_each_batch(self):
+        self.backend.set('user', 'a', {'x': 1})
+        self.second.get('user', 'a')
+        seen = []
+
+        def entries():
+            yield XBlockUserState('user', 'a', {'x': 2}, None, Scope.user_state)
+            seen.append(self.second.get('user', 'a').state)
+            yield XBlockUserState('user', 'b', {'x': 3}, None, Scope.user_state)
+
+        self.assertEqual(self.first.bulk_load(entries(), batch_size=1), 2)
+        self.assertEqual(seen, [{'x': 2}])
+        self.assertEqual(self.second.get('user', 'b').state, {'x': 3})
+
+    def test_stale_refill_is_not_read(self):
+        self.backend.set('user', 'a', {'x': 1})
+        name = self.first._name('user', 'a', Scope.user_state)  # pylint: disable=protected-access
+        self.first.get('user', 'a')
+        stale_key = [key for key in self.server._data if key.startswith(f'{name}:s:')]  # pylint: disable=protected-access
+        self.first.set('user', 'a', {'x': 2})
+        # A reader that fetched before the write stores under the old version.
+        self.first.transport.set(stale_key[0], b'{"state": {"x": 1}, "updated": null}')
+        self.assertEqual(self.second.get('user', 'a').state, {'x': 2})
+
+    def test_stampede_guard(self):
+        self.backend.set('user', 'a', {'x': 1})
+        self.first.get('user', 'a')
+        self.first.set('user', 'a', {'x': 2})
+        name = self.first._name('user', 'a', Scope.user_state)  # pylint: disable=protected-access
+        self.first.transport.add(f'{name}:lock', b'1')
+        self.backend.requested = []
+        # Another process holds the refill lock and never fills, so this waits then reads through.
+        self.assertEqual(self.second.get('user', 'a').state, {'x': 2})
+        self.assertEqual(self.backend.requested, [['a']])
+        self.assertEqual(self.server.lookup(f'{name}:lock'), b'1')
+
+    def test_cache_down_reads_backend(self):
+        self.backend.set('user', 'a', {'x': 1})
+        self.server.stop()
+        self.assertEqual(self.first.get('user', 'a').state, {'x': 1})
+        self.first.set('user', 'a', {'x': 2})
+        self.assertEqual(self.first.get('user', 'a').state, {'x': 2})
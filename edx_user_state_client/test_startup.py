@@ -0,0 +1,46 @@
+"""
+Tests of import times, and of the lazily imported default scope.
+"""
+import io
+import os
+from contextlib import redirect_stdout
+from unittest import TestCase, skipUnless
+
+from xblock.fields import Scope
+
+from edx_user_state_client.interface import resolve_scope
+from edx_user_state_client.startup import IMPORT_BUDGETS, check_budgets, main
+from edx_user_state_client.tests import DictUserStateClient
+
+
+class TestStartup(TestCase):
+    """
+    Tests that the import-light modules stay within their import-time budgets.
+    """
+    def test_no_heavy_imports(self):
+        results = check_budgets(repeat=1)
+        self.assertEqual([result['module'] for result in results], list(IMPORT_BUDGETS))
+        for result in results:
+            self.assertEqual(result['heavy'], [], result)
+
+    # Wall-clock times depend on the machine and its load, so only check them when asked to.
+    @skipUnless(os.environ.get('CHECK_IMPORT_BUDGETS'), 'set CHECK_IMPORT_BUDGETS to check import times')
+    def test_budgets(self):
+        for result in check_budgets(repeat=3):
+            self.assertTrue(result['ok'], result)
+
+    def test_reports_heavy_imports(self):
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.assertEqual(main(['edx_user_state_client.field_data', '--repeat', '1']), 0)
+        self.assertIn('heavy=xblock', output.getvalue())
+
+    def test_default_scope(self):
+        self.assertIs(resolve_scope(None), Scope.user_state)
+        self.assertIs(resolve_scope(Scope.preferences), Scope.preferences)
+        client = DictUserStateClient()
+        client.set('user', 'block', {'a': 1})
+        self.assertEqual(client.get('user', 'block').scope, Scope.user_state)
+        client.delete('user', 'block')
+        with self.assertRaises(client.DoesNotExist):
+            client.get('user', 'block', Scope.user_state)
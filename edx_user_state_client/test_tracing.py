@@ -0,0 +1,123 @@
+"""
+Tests of TracingUserStateClient and trace analysis.
+"""
+import io
+import json
+import os
+import shutil
+import tempfile
+from contextlib import redirect_stdout
+from unittest import TestCase
+
+from edx_user_state_client.trace_analysis import analyze, main
+from edx_user_state_client.tests import DictUserStateClient, UserStateClientStressTestBase, UserStateClientTestBase
+from edx_user_state_client.tracing import TracingUserStateClient
+
+
+class TestTracingUserStateClient(UserStateClientTestBase, UserStateClientStressTestBase):
+    """
+    Blackbox tests of TracingUserStateClient.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.client = TracingUserStateClient(DictUserStateClient(), io.StringIO())
+
+
+class TestTraceAnalysis(TestCase):
+    """
+    Tests of what traces record, and what the analyzer finds in them.
+    """
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'trace.ndjson')
+        self.client = TracingUserStateClient(DictUserStateClient(), self.path)
+        self.addCleanup(self.client.close)
+
+    def records(self):
+        """Return the records written so far."""
+        with open(self.path, encoding='utf-8') as trace:
+            return [json.loads(line) for line in trace]
+
+    def render_unit(self, blocks):
+        """Read each block's state one at a time, as an N+1 caller would."""
+        for block in blocks:
+            try:
+                self.client.get('user', block)
+            except self.client.DoesNotExist:
+                pass
+
+    def test_records(self):
+        self.client.set_many('user', {'a': {'x': 1, 'y': 2}})
+        list(self.client.get_many('user', ['a', 'b'], fields=['x']))
+        with self.assertRaises(self.client.DoesNotExist):
+            next(self.client.get_history('user', 'b'))
+        set_record, get_record, history_record = self.records()
+        self.assertEqual(set_record['m'], 'set_many')
+        self.assertEqual(set_record['u'], 'user')
+        self.assertEqual(set_record['s'], 'user_state')
+        self.assertEqual(sorted(set_record['w']['a']), ['x', 'y'])
+        self.assertEqual((get_record['k'], get_record['f'], get_record['n'], get_record['nf']), (['a', 'b'], ['x'], 1, 1))
+        self.assertIn('test_tracing.py', get_record['st'][0])
+        self.assertGreaterEqual(get_record['ms'], 0)
+        self.assertEqual(history_record['e'], 'DoesNotExist')
+
+    def test_records_chunks(self):
+        self.client.set_many('user', {'a': {'x': 1, 'y': 2}, 'b': {'x': 3}})
+        list(self.client.iter_chunks_for_blocks(['a', 'b'], chunk_size=1, columnar=True))
+        list(self.client.iter_chunks_for_blocks(['a', 'b'], fields=['y']))
+        _, columnar_record, rows_record = self.records()
+        self.assertEqual(
+            (columnar_record['cs'], columnar_record['col'], columnar_record['n'], columnar_record['nf']), (1, True, 2, 3)
+        )
+        self.assertEqual((rows_record['cs'], rows_record['f'], rows_record['n'], rows_record['nf']), (1000, ['y'], 2, 1))
+        self.assertNotIn('col', rows_record)
+
+    def test_analysis(self):
+        self.client.set_many('user', {'a': {'x': 1}, 'b': {'x': 2}, 'c': {'x': 3}})
+        self.render_unit(['a', 'b', 'c', 'd'])
+        list(self.client.get_many('user', ['a', 'b']))
+        self.client.set('user', 'a', {'x': 1})
+        self.client.set('user', 'b', {'x': 5})
+
+        report = analyze(self.records())
+        self.assertEqual(len(report['n_plus_one']), 1)
+        self.assertEqual(report['n_plus_one'][0]['calls'], 4)
+        self.assertIn('render_unit', report['n_plus_one'][0]['site'])
+        self.assertEqual(report['hot_keys'][:2], [{'block_key': 'a', 'reads': 2}, {'block_key': 'b', 'reads': 2}])
+        self.assertEqual(
+            [(row['writes'], row['redundant_blocks'], row['redundant_fields']) for row in report['redundant_writes']],
+            [(1, 1, 1)]
+        )
+        self.assertEqual(sum(row['reads'] for row in report['wide_reads']), 5)
+        self.assertEqual({row['method'] for row in report['methods']}, {'get', 'get_many', 'set', 'set_many'})
+
+    def test_writes_after_delete_not_redundant(self):
+        self.client.set('user', 'a', {'x': 1, 'y': 2})
+        self.client.delete('user', 'a')
+        self.client.set('user', 'a', {'x': 1, 'y': 2})
+        self.client.delete('user', 'a', fields=['x'])
+        self.client.set('user', 'a', {'x': 1, 'y': 2})
+        self.client.delete_all_for_block('a')
+        self.client.set('user', 'a', {'x': 1})
+
+        report = analyze(self.records())
+        self.assertEqual(
+            [(row['writes'], row['redundant_blocks'], row['redundant_fields']) for row in report['redundant_writes']],
+            [(1, 0, 1)]
+        )
+
+    def test_command(self):
+        self.render_unit(['a', 'b', 'c'])
+        output = io.StringIO()
+        with redirect_stdout(output):
+            self.assertEqual(main([self.path]), 0)
+        self.assertIn('N+1 single-key reads', output.getvalue())
+        self.assertIn('calls=3', output.getvalue())
+        output = io.StringIO()
+        with redirect_stdout(output):
+            main([self.path, '--json'])
+        self.assertEqual(json.loads(output.getvalue())['redundant_writes'], [])
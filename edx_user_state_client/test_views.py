@@ -0,0 +1,155 @@
+"""
+Tests of MaterializedViewUserStateClient.
+"""
+from unittest import TestCase
+
+from opaque_keys.edx.locator import BlockUsageLocator, CourseLocator
+from xblock.fields import Scope
+
+from edx_user_state_client.tests import DictUserStateClient, UserStateClientStressTestBase, UserStateClientTestBase
+from edx_user_state_client.views import MaterializedView, MaterializedViewUserStateClient
+
+
+class TestMaterializedViewUserStateClient(UserStateClientTestBase, UserStateClientStressTestBase):
+    """
+    Blackbox tests of MaterializedViewUserStateClient.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.client = MaterializedViewUserStateClient(
+            DictUserStateClient(), [MaterializedView('grades', ['a', 'b'])]
+        )
+
+
+class FailingUserStateClient(DictUserStateClient):
+    """
+    A DictUserStateClient whose set_many writes and then raises, while ``fail`` is set,
+    or raises QuotaExceeded without writing, while ``reject`` is set.
+    """
+    fail = False
+    reject = False
+
+    def set_many(self, username, block_keys_to_state, scope=Scope.user_state):
+        if self.reject:
+            raise self.QuotaExceeded('over quota')
+        super().set_many(username, block_keys_to_state, scope)
+        if self.fail:
+            raise self.ServiceUnavailable('set_many failed after writing')
+
+
+class TestMaterializedViews(TestCase):
+    """
+    Tests of how views are built and kept up to date.
+    """
+    course = CourseLocator('org', 'course', 'run')
+    other_course = CourseLocator('org', 'other', 'run')
+
+    def setUp(self):
+        super().setUp()
+        self.backend = FailingUserStateClient()
+        self.problem = BlockUsageLocator(self.course, 'problem', 'p1')
+        self.video = BlockUsageLocator(self.course, 'video', 'v1')
+        self.backend.set_many('alice', {
+            self.problem: {'score': 1, 'answer': 'x'},
+            self.video: {'position': 10},
+        })
+        self.backend.set_many('bob', {self.problem: {'attempts': 2}})
+        self.scans = 0
+        iter_all_for_course = self.backend.iter_all_for_course
+
+        def counting_iter_all_for_course(*args, **kwargs):
+            self.scans += 1
+            return iter_all_for_course(*args, **kwargs)
+
+        self.backend.iter_all_for_course = counting_iter_all_for_course
+        self.client = MaterializedViewUserStateClient(self.backend, [
+            MaterializedView('grades', ['score', 'attempts'], block_type='problem'),
+            MaterializedView('progress', ['score', 'position']),
+        ])
+
+    def test_builds_once(self):
+        self.assertEqual(self.client.summary('grades', self.course, 'alice'), {self.problem: {'score': 1}})
+        self.assertEqual(self.client.course_summaries('grades', self.course), {
+            'alice': {self.problem: {'score': 1}},
+            'bob': {self.problem: {'attempts': 2}},
+        })
+        self.assertEqual(self.client.summary('progress', self.course, 'alice'), {
+            self.problem: {'score': 1},
+            self.video: {'position': 10},
+        })
+        self.assertEqual(self.client.summary('grades', self.course, 'carol'), {})
+        self.assertEqual(self.scans, 2)
+
+    def test_updates_incrementally(self):
+        self.client.summary('grades', self.course, 'alice')
+        self.client.set_many('alice', {self.problem: {'score': 5, 'answer': 'y'}, self.video: {'score': 1}})
+        self.client.set_many('carol', {self.problem: {'attempts': 1}})
+        self.client.delete_many('bob', [self.problem])
+        self.assertEqual(self.client.course_summaries('grades', self.course), {
+            'alice': {self.problem: {'score': 5}},
+            'carol': {self.problem: {'attempts': 1}},
+        })
+
+        self.client.delete_many('alice', [self.problem], fields=['score'])
+        self.client.set_many('alice', {BlockUsageLocator(self.other_course, 'problem', 'p1'): {'score': 1}})
+        self.assertEqual(self.client.summary('grades', self.course, 'alice'), {})
+        self.assertEqual(self.scans, 1)
+
+    def test_conditional_set(self):
+        self.client.summary('grades', self.course, 'bob')
+        updated = self.client.get('bob', self.problem).updated
+        self.client.set_many_if_unmodified('bob', {self.problem: {'attempts': 3}}, {self.problem: updated})
+        with self.assertRaises(self.client.VersionConflict):
+            self.client.set_many_if_unmodified('bob', {self.problem: {'attempts': 4}}, {self.problem: updated})
+        self.assertEqual(self.client.summary('grades', self.course, 'bob'), {self.problem: {'attempts': 3}})
+        self.assertEqual(self.scans, 1)
+
+    def test_rejected_writes_keep_views(self):
+        self.client.summary('grades', self.course, 'alice')
+        self.backend.reject = True
+        with self.assertRaises(self.client.QuotaExceeded):
+            self.client.set_many('alice', {self.problem: {'score': 7}})
+        self.assertEqual(self.client.summary('grades', self.course, 'alice'), {self.problem: {'score': 1}})
+        self.assertEqual(self.scans, 1)
+
+    def test_writes_during_build_are_kept(self):
+        iter_all_for_course = self.backend.iter_all_for_course
+
+        def writing_iter_all_for_course(*args, **kwargs):
+            entries = list(iter_all_for_course(*args, **kwargs))
+            self.client.set_many('carol', {self.problem: {'score': 9}})
+            self.client.delete_many('bob', [self.problem])
+            return iter(entries)
+
+        self.backend.iter_all_for_course = writing_iter_all_for_course
+        self.assertEqual(self.client.course_summaries('grades', self.course), {
+            'alice': {self.problem: {'score': 1}},
+            'carol': {self.problem: {'score': 9}},
+        })
+
+    def test_failed_write_rebuilds(self):
+        self.client.summary('grades', self.course, 'alice')
+        self.backend.fail = True
+        with self.assertRaises(self.client.ServiceUnavailable):
+            self.client.set_many('alice', {self.problem: {'score': 7}})
+        self.backend.fail = False
+        self.assertEqual(self.client.summary('grades', self.course, 'alice'), {self.problem: {'score': 7}})
+        self.assertEqual(self.scans, 2)
+
+    def test_summaries_are_copies(self):
+        self.client.summary('grades', self.course, 'alice')[self.problem]['score'] = 100
+        self.assertEqual(self.client.summary('grades', self.course, 'alice'), {self.problem: {'score': 1}})
+
+    def test_delete_all(self):
+        self.client.summary('grades', self.course, 'alice')
+        self.client.summary('progress', self.course, 'alice')
+        self.client.delete_all_for_user('alice', course_keys=[self.course])
+        self.client.delete_all_for_block(self.problem)
+        self.assertEqual(self.client.course_summaries('grades', self.course), {})
+        self.assertEqual(self.client.course_summaries('progress', self.course), {})
+        self.client.set_many('carol', {self.problem: {'score': 2}})
+        self.client.delete_all_for_course(self.course)
+        self.assertEqual(self.client.course_summaries('grades', self.course), {})
+        self.assertEqual(self.scans, 3)
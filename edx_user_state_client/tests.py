@@ -13,15 +13,27 @@ test suite, use the snippet:
             super(TestDictUserStateClient, self).setUp()
             self.client = MyUserStateClient()  # Add your setup here
 
+To also test that your backend is correct under concurrent use, add
+UserStateClientStressTestBase to the bases of your test case.
+
 """
-from datetime import datetime
+import functools
+import gc
+import threading
+import weakref
+from datetime import datetime, timedelta
+from itertools import islice
 from unittest import TestCase
 
 import pytz
 from opaque_keys.edx.locator import BlockUsageLocator, CourseLocator
 from xblock.fields import Scope
 
-from edx_user_state_client.interface import XBlockUserStateClient, XBlockUserState
+from edx_user_state_client.chunks import check_chunk_size, make_chunk
+from edx_user_state_client.interface import XBlockUserStateClient, XBlockUserState, resolve_scope
+from edx_user_state_client.interning import KeyInterner
+from edx_user_state_client.ordering import ORDER_BY_BLOCK, ORDER_BY_USERNAME, check_order
+from edx_user_state_client.snapshots import ReadOnlyClientMixin
 
 
 class _UserStateClientTestUtils(TestCase):
@@ -233,6 +245,16 @@ class _UserStateClientTestCRUD(_UserStateClientTestUtils):
         self.assertEqual(self.get(user=0, block=0, fields=['b']).state, {'b': 'c'})
         self.assertEqual(self.get(user=0, block=0, fields=['a', 'b']).state, {'a': 'b', 'b': 'c'})
 
+    def test_none_scope_is_user_state(self):
+        username, block_key = self._user(0), self._block(0)
+        self.client.set_many(username, {block_key: {'a': 'b'}}, None)
+        self.assertEqual(next(self.client.get_many(username, [block_key], Scope.user_state)).state, {'a': 'b'})
+        self.client.set_many(username, {block_key: {'c': 'd'}}, Scope.user_state)
+        self.assertEqual(next(self.client.get_many(username, [block_key], None)).state, {'a': 'b', 'c': 'd'})
+        self.assertEqual(next(self.client.get_history(username, block_key, None)).state, {'a': 'b', 'c': 'd'})
+        self.client.delete_many(username, [block_key], None)
+        self.assertEqual(list(self.client.get_many(username, [block_key], Scope.user_state)), [])
+
     def test_get_missing_block(self):
         self.set(user=0, block=1, state={})
         with self.assertRaises(self.client.DoesNotExist):
@@ -461,6 +483,37 @@ class _UserStateClientTestHistory(_UserStateClientTestUtils):
             [{'a': 1}]
         )
 
+    def test_get_many_as_of(self):
+        self.set(user=0, block=1, state={'b': 1})
+        self.set(user=0, block=0, state={'a': 0})
+        self.set(user=0, block=0, state={'a': 1})
+        self.delete(user=0, block=0)
+        self.set(user=0, block=0, state={'a': 3})
+        history = list(self.get_history(user=0, block=0))
+        self.assertEqual([entry.state for entry in history], [{'a': 3}, None, {'a': 1}, {'a': 0}])
+        block_keys = [self._block(block) for block in (0, 1, 2)]
+
+        def get_many_as_of(timestamp, user=0, fields=None):
+            return [
+                (entry.block_key, entry.state, entry.updated)
+                for entry in self.client.get_many_as_of(
+                    self._user(user), block_keys, timestamp, scope=self.scope, fields=fields
+                )
+            ]
+
+        first_updated = next(self.get_history(user=0, block=1)).updated
+        for entry in history:
+            expected = [(self._block(1), {'b': 1}, first_updated)]
+            if entry.state is not None:
+                expected.insert(0, (self._block(0), entry.state, entry.updated))
+            self.assertEqual(get_many_as_of(entry.updated), expected)
+        self.assertEqual(get_many_as_of(first_updated - timedelta(microseconds=1)), [])
+        self.assertEqual(get_many_as_of(history[-1].updated, fields=['a']), [
+            (self._block(0), {'a': 0}, history[-1].updated),
+            (self._block(1), {}, first_updated),
+        ])
+        self.assertEqual(get_many_as_of(history[0].updated, user=1), [])
+
 
 class _UserStateClientTestIterAll(_UserStateClientTestUtils):
     """
@@ -515,6 +568,24 @@ class _UserStateClientTestIterAll(_UserStateClientTestUtils):
             ]
         )
 
+    def test_iter_many_blocks(self):
+        for user in range(2):
+            self.set_many(user, {0: {'a': user}, 1: {'b': user}, 1000: {'c': user}, 2: {'d': user}})
+        self.delete(user=1, block=1)
+
+        entries = list(self.client.iter_all_for_blocks(
+            [self._block(block) for block in (1000, 1, 3, 1000)], scope=self.scope
+        ))
+        self.assertEqual(
+            [entry.block_key for entry in entries],
+            [self._block(1000), self._block(1000), self._block(1)],
+        )
+        self.assertCountEqual(
+            ((entry.username, entry.state) for entry in entries),
+            [(self._user(0), {'c': 0}), (self._user(1), {'c': 1}), (self._user(0), {'b': 0})],
+        )
+        self.assertEqual(list(self.client.iter_all_for_blocks([], scope=self.scope)), [])
+
     def test_iter_course_empty(self):
         self.assertCountEqual(
             self.iter_all_for_course(course=0),
@@ -588,9 +659,401 @@ class _UserStateClientTestIterAll(_UserStateClientTestUtils):
         )
 
 
+class _UserStateClientTestIterSorted(_UserStateClientTestUtils):
+    """
+    Blackbox tests of XBlockUserStateClient sorted course iteration.
+    """
+
+    __test__ = False
+
+    def iter_all_for_course_sorted(self, course, order_by, block_type=None, username_prefix=None):
+        """
+        Yield the state for all users for the specified course, sorted by ``order_by``.
+
+        This wraps :meth:`~XBlockUserStateClient.iter_all_for_course_sorted`
+        to take indexes rather than actual values, to make tests easier
+        to write concisely.
+        """
+        return self.client.iter_all_for_course_sorted(
+            course_key=self._course(course),
+            block_type=block_type,
+            scope=self.scope,
+            order_by=order_by,
+            username_prefix=username_prefix,
+        )
+
+    def _populate_unsorted(self):
+        """
+        Store state in course 0 whose usernames and block keys sort differently as strings than as numbers.
+        """
+        for user in (10, 2, 1):
+            self.set_many(user, {block: {'user': user, 'block': block} for block in (5, 12, 3)})
+        self.set(user=20, block=1012, state={'other': 'course'})
+        self.delete(user=2, block=12)
+        return [
+            (self._user(user), self._block(block))
+            for user in (10, 2, 1) for block in (5, 12, 3)
+            if (user, block) != (2, 12)
+        ]
+
+    def test_iter_course_sorted_by_username(self):
+        expected = sorted(self._populate_unsorted(), key=lambda pair: (pair[0], str(pair[1])))
+        self.assertEqual(
+            [(item.username, item.block_key) for item in self.iter_all_for_course_sorted(0, ORDER_BY_USERNAME)],
+            expected,
+        )
+
+    def test_iter_course_sorted_by_block(self):
+        expected = sorted(self._populate_unsorted(), key=lambda pair: (str(pair[1]), pair[0]))
+        entries = list(self.iter_all_for_course_sorted(0, ORDER_BY_BLOCK))
+        self.assertEqual([(item.username, item.block_key) for item in entries], expected)
+        self.assertEqual(entries[0].state, {'user': 1, 'block': 12})
+
+    def test_iter_course_sorted_username_prefix(self):
+        self._populate_unsorted()
+        self.set(user=11, block=3, state={'a': 1})
+        self.assertEqual(
+            [
+                (item.username, item.block_key)
+                for item in self.iter_all_for_course_sorted(0, ORDER_BY_BLOCK, username_prefix='user1')
+            ],
+            [
+                (self._user(user), self._block(block))
+                for user, block in [(1, 12), (10, 12), (1, 3), (10, 3), (11, 3), (1, 5), (10, 5)]
+            ],
+        )
+        self.assertEqual(list(self.iter_all_for_course_sorted(0, ORDER_BY_USERNAME, username_prefix='nobody')), [])
+
+    def test_iter_course_sorted_filters(self):
+        self._populate_unsorted()
+        self.assertEqual(list(self.iter_all_for_course_sorted(0, ORDER_BY_USERNAME, block_type='other_type')), [])
+        self.assertEqual(list(self.iter_all_for_course_sorted(2, ORDER_BY_BLOCK)), [])
+        self.assertEqual(
+            [item.username for item in self.iter_all_for_course_sorted(1, ORDER_BY_USERNAME)],
+            [self._user(20)],
+        )
+        with self.assertRaises(ValueError):
+            list(self.iter_all_for_course_sorted(0, 'state'))
+
+
+class _UserStateClientTestIterChunks(_UserStateClientTestUtils):
+    """
+    Blackbox tests of XBlockUserStateClient chunked iteration.
+    """
+
+    __test__ = False
+
+    def _populate_chunks(self):
+        """
+        Store state for 5 users in each of blocks 0 and 1 of course 0, and some in course 1.
+        """
+        for user in range(5):
+            self.set_many(user, {0: {'a': user, 'b': 'x'}, 1: {'c': user}, 1000: {'a': 'other'}})
+        self.delete(user=4, block=0)
+        self.set(user=5, block=0, state={'b': 'y'})
+
+    def test_iter_chunks_for_blocks(self):
+        self._populate_chunks()
+        block_keys = [self._block(1), self._block(0), self._block(1)]
+        chunks = list(self.client.iter_chunks_for_blocks(block_keys, scope=self.scope, chunk_size=3))
+        self.assertEqual([len(chunk) for chunk in chunks], [3, 3, 3, 1])
+        entries = [entry for chunk in chunks for entry in chunk]
+        self.assertEqual([entry.block_key for entry in entries], [self._block(1)] * 5 + [self._block(0)] * 5)
+        self.assertCountEqual(
+            ((entry.username, entry.block_key, entry.state) for entry in entries),
+            ((entry.username, entry.block_key, entry.state)
+             for entry in self.client.iter_all_for_blocks(block_keys, scope=self.scope)),
+        )
+        self.assertEqual(list(self.client.iter_chunks_for_blocks([], scope=self.scope)), [])
+
+    def test_iter_chunks_for_course_columnar(self):
+        self._populate_chunks()
+        chunks = list(self.client.iter_chunks_for_course(
+            self._course(0), scope=self.scope, chunk_size=4, columnar=True, fields=['a', 'b']
+        ))
+        self.assertEqual([len(chunk.usernames) for chunk in chunks], [4, 4, 2])
+        self.assertCountEqual(
+            (
+                row
+                for chunk in chunks
+                for row in zip(chunk.usernames, chunk.block_keys, chunk.updated, chunk.fields['a'], chunk.fields['b'])
+            ),
+            (
+                (entry.username, entry.block_key, entry.updated, entry.state.get('a'), entry.state.get('b'))
+                for entry in self.iter_all_for_course(course=0)
+            ),
+        )
+
+    def test_iter_chunks_columns(self):
+        self.set_many(user=0, block_to_state={0: {'a': 1}, 1: {'b': 2}})
+        [chunk] = self.client.iter_chunks_for_blocks(
+            [self._block(0), self._block(1)], scope=self.scope, columnar=True
+        )
+        self.assertEqual(chunk.usernames, [self._user(0), self._user(0)])
+        self.assertEqual(chunk.block_keys, [self._block(0), self._block(1)])
+        self.assertEqual(chunk.fields, {'a': [1, None], 'b': [None, 2]})
+
+    def test_iter_chunks_filters(self):
+        self._populate_chunks()
+        self.assertEqual(list(self.client.iter_chunks_for_course(self._course(2), scope=self.scope)), [])
+        self.assertEqual(
+            list(self.client.iter_chunks_for_course(self._course(0), block_type='other_type', scope=self.scope)), []
+        )
+        [chunk] = self.client.iter_chunks_for_course(self._course(1), scope=self.scope, fields=['b'])
+        self.assertEqual([entry.state for entry in chunk], [{}] * 5)
+        [chunk] = self.client.iter_chunks_for_blocks([self._block(1)], scope=self.scope, fields=['c', 'd'])
+        self.assertCountEqual(
+            ((entry.username, entry.state) for entry in chunk),
+            [(self._user(user), {'c': user}) for user in range(5)],
+        )
+        with self.assertRaises(ValueError):
+            list(self.client.iter_chunks_for_blocks([self._block(0)], scope=self.scope, chunk_size=0))
+
+
+class _UserStateClientTestSnapshot(_UserStateClientTestUtils):
+    """
+    Blackbox tests of XBlockUserStateClient snapshots, skipped for clients that can't take them.
+    """
+
+    __test__ = False
+
+    def take_snapshot(self):
+        """
+        Return a snapshot of the client, or skip the test if it can't take one.
+        """
+        try:
+            snapshot = self.client.snapshot()
+        except NotImplementedError:
+            self.skipTest('This client does not take snapshots')
+        self.addCleanup(snapshot.close)
+        return snapshot
+
+    def test_snapshot_ignores_later_writes(self):
+        for user in range(2):
+            self.set_many(user, {0: {'a': user}, 1: {'b': user}})
+        snapshot = self.take_snapshot()
+
+        self.set_many(user=0, block_to_state={0: {'a': 'new'}, 2: {'c': 'new'}})
+        self.delete(user=1, block=0)
+        self.delete(user=0, block=1, fields=['b'])
+        self.set(user=2, block=0, state={'a': 'new'})
+
+        def states(entries):
+            return sorted((entry.username, entry.block_key.block_id, entry.state) for entry in entries)
+
+        self.assertEqual(
+            states(snapshot.get_many(self._user(0), [self._block(0), self._block(1), self._block(2)], self.scope)),
+            [(self._user(0), 'block0', {'a': 0}), (self._user(0), 'block1', {'b': 0})],
+        )
+        with self.assertRaises(self.client.DoesNotExist):
+            snapshot.get(self._user(2), self._block(0), self.scope)
+        self.assertEqual(
+            states(snapshot.iter_all_for_block(self._block(0), self.scope)),
+            [(self._user(0), 'block0', {'a': 0}), (self._user(1), 'block0', {'a': 1})],
+        )
+        self.assertEqual(len(list(snapshot.iter_all_for_course(self._course(0), scope=self.scope))), 4)
+        self.assertEqual(
+            [entry.state for entry in snapshot.iter_all_for_course_sorted(self._course(0), scope=self.scope)],
+            [{'a': 0}, {'b': 0}, {'a': 1}, {'b': 1}],
+        )
+        self.assertEqual(
+            [entry.state for entry in snapshot.get_history(self._user(1), self._block(0), self.scope)],
+            [{'a': 1}],
+        )
+        with self.assertRaises(self.client.DoesNotExist):
+            next(snapshot.get_history(self._user(2), self._block(0), self.scope))
+
+        self.assertEqual(self.get(user=0, block=0).state, {'a': 'new'})
+        self.assertEqual(len(list(self.iter_all_for_course(course=0))), 4)
+
+    def test_snapshot_during_scan(self):
+        for user in range(3):
+            self.set(user=user, block=0, state={'a': user})
+        snapshot = self.take_snapshot()
+        entries = snapshot.iter_all_for_block(self._block(0), self.scope)
+        first = next(entries)
+        for user in range(4):
+            self.set(user=user, block=0, state={'a': 'new'})
+        self.assertCountEqual(
+            [entry.state for entry in [first] + list(entries)],
+            [{'a': 0}, {'a': 1}, {'a': 2}],
+        )
+
+    def test_snapshot_is_read_only(self):
+        self.set(user=0, block=0, state={'a': 0})
+        with self.take_snapshot() as snapshot:
+            with self.assertRaises(self.client.PermissionDenied):
+                snapshot.set(self._user(0), self._block(0), {'a': 1}, self.scope)
+            with self.assertRaises(self.client.PermissionDenied):
+                snapshot.delete_many(self._user(0), [self._block(0)], self.scope)
+            with self.assertRaises(self.client.PermissionDenied):
+                snapshot.delete_all_for_block(self._block(0), self.scope)
+            self.assertIs(snapshot.snapshot(), snapshot)
+        self.assertEqual(self.get(user=0, block=0).state, {'a': 0})
+
+
+class _UserStateClientTestBulkLoad(_UserStateClientTestUtils):
+    """
+    Blackbox tests of XBlockUserStateClient bulk loading.
+    """
+
+    __test__ = False
+
+    def _entry(self, user, block, state):
+        """Return an XBlockUserState for ``user`` and ``block`` to load."""
+        return XBlockUserState(self._user(user), self._block(block), state, datetime.now(pytz.utc), self.scope)
+
+    def test_bulk_load(self):
+        loaded = self.client.bulk_load(
+            (self._entry(user, block, {'a': user, 'b': block}) for user in range(3) for block in range(3)),
+            batch_size=4,
+        )
+        self.assertEqual(loaded, 9)
+        self.assertEqual(self.get(user=2, block=1).state, {'a': 2, 'b': 1})
+        self.assertCountEqual(
+            (item.username for item in self.iter_all_for_block(block=0)),
+            [self._user(user) for user in range(3)]
+        )
+
+    def test_bulk_load_history(self):
+        self.client.bulk_load([
+            self._entry(0, 0, {'a': 0}),
+            self._entry(0, 1, {'a': 'other'}),
+            self._entry(0, 0, {'a': 1}),
+            self._entry(0, 0, None),
+            self._entry(0, 0, {'a': 2}),
+        ])
+        self.assertEqual(
+            [history.state for history in self.get_history(user=0, block=0)],
+            [{'a': 2}, None, {'a': 1}, {'a': 0}]
+        )
+        self.assertEqual(self.get(user=0, block=1).state, {'a': 'other'})
+
+    def test_bulk_load_replaces_state(self):
+        self.set(user=0, block=1, state={'a': 0, 'c': 0})
+        self.client.bulk_load([
+            self._entry(0, 0, {'a': 1, 'b': 1}),
+            self._entry(0, 0, {'a': 2}),
+            self._entry(0, 1, {'a': 1}),
+        ])
+        self.assertEqual(self.get(user=0, block=0).state, {'a': 2})
+        self.assertEqual(self.get(user=0, block=1).state, {'a': 1})
+
+
+class _UserStateClientTestConditionalSet(_UserStateClientTestUtils):
+    """
+    Blackbox tests of XBlockUserStateClient conditional writes.
+    """
+
+    __test__ = False
+
+    def set_many_if_unmodified(self, user, block_to_state, block_to_updated):
+        """
+        Conditionally set the state for the specified user and blocks.
+
+        This wraps :meth:`~XBlockUserStateClient.set_many_if_unmodified`
+        to take indexes rather than actual values to make tests easier
+        to write concisely.
+        """
+        return self.client.set_many_if_unmodified(
+            username=self._user(user),
+            block_keys_to_state={self._block(block): state for block, state in block_to_state.items()},
+            expected_updated={self._block(block): updated for block, updated in block_to_updated.items()},
+            scope=self.scope,
+        )
+
+    def test_set_if_unmodified(self):
+        self.set(user=0, block=0, state={'a': 'b'})
+        updated = self.get(user=0, block=0).updated
+        self.set_many_if_unmodified(user=0, block_to_state={0: {'c': 'd'}}, block_to_updated={0: updated})
+        self.assertEqual(self.get(user=0, block=0).state, {'a': 'b', 'c': 'd'})
+
+    def test_set_if_unmodified_conflict(self):
+        self.set(user=0, block=0, state={'a': 'b'})
+        updated = self.get(user=0, block=0).updated
+        self.set(user=0, block=0, state={'a': 'c'})
+        with self.assertRaises(self.client.VersionConflict) as context:
+            self.set_many_if_unmodified(user=0, block_to_state={0: {'a': 'd'}}, block_to_updated={0: updated})
+        self.assertEqual(context.exception.block_keys, [self._block(0)])
+        self.assertEqual(self.get(user=0, block=0).state, {'a': 'c'})
+
+    def test_set_if_unmodified_new_block(self):
+        self.set_many_if_unmodified(user=0, block_to_state={0: {'a': 'b'}}, block_to_updated={0: None})
+        self.assertEqual(self.get(user=0, block=0).state, {'a': 'b'})
+        with self.assertRaises(self.client.VersionConflict):
+            self.set_many_if_unmodified(user=0, block_to_state={0: {'a': 'c'}}, block_to_updated={0: None})
+
+    def test_set_if_unmodified_all_or_nothing(self):
+        self.set_many(user=0, block_to_state={0: {'a': 0}, 1: {'a': 1}})
+        updated = {entry.block_key: entry.updated for entry in self.get_many(user=0, blocks=[0, 1])}
+        self.set(user=0, block=1, state={'a': 2})
+        with self.assertRaises(self.client.VersionConflict) as context:
+            self.set_many_if_unmodified(
+                user=0,
+                block_to_state={0: {'a': 3}, 1: {'a': 3}},
+                block_to_updated={0: updated[self._block(0)], 1: updated[self._block(1)]},
+            )
+        self.assertEqual(context.exception.block_keys, [self._block(1)])
+        self.assertEqual(self.get(user=0, block=0).state, {'a': 0})
+
+
+class _UserStateClientTestDeleteAll(_UserStateClientTestUtils):
+    """
+    Blackbox tests of XBlockUserStateClient bulk deletes.
+    """
+
+    __test__ = False
+
+    def test_delete_all_for_block(self):
+        for user in range(3):
+            self.set(user=user, block=0, state={'a': user})
+        self.set(user=0, block=1, state={'a': 'other'})
+        progress = []
+        deleted = self.client.delete_all_for_block(
+            self._block(0), scope=self.scope, batch_size=2, progress=progress.append
+        )
+        self.assertEqual(deleted, 3)
+        self.assertEqual(progress[-1], 3)
+        self.assertEqual(list(self.iter_all_for_block(block=0)), [])
+        self.assertEqual(self.get(user=0, block=1).state, {'a': 'other'})
+        self.assertIsNone(next(self.get_history(user=1, block=0)).state)
+
+    def test_delete_all_for_course(self):
+        for user in range(2):
+            self.set_many(user=user, block_to_state={0: {'a': 0}, 1: {'a': 1}, 1000: {'a': 1000}})
+        self.assertEqual(self.client.delete_all_for_course(self._course(0), scope=self.scope, batch_size=3), 4)
+        self.assertEqual(list(self.iter_all_for_course(course=0)), [])
+        self.assertEqual(len(list(self.iter_all_for_course(course=1))), 2)
+        self.assertEqual(self.client.delete_all_for_course(self._course(0), scope=self.scope), 0)
+
+    def test_delete_all_for_course_block_type(self):
+        self.set(user=0, block=0, state={'a': 0})
+        self.assertEqual(
+            self.client.delete_all_for_course(self._course(0), block_type='other_type', scope=self.scope), 0
+        )
+        self.assertEqual(self.get(user=0, block=0).state, {'a': 0})
+
+    def test_delete_all_for_user(self):
+        for user in range(2):
+            self.set_many(user=user, block_to_state={0: {'a': 0}, 1000: {'a': 1000}, 2000: {'a': 2000}})
+        deleted = self.client.delete_all_for_user(
+            self._user(0), course_keys=[self._course(0), self._course(1)], scope=self.scope
+        )
+        self.assertEqual(deleted, 2)
+        self.assertEqual(list(self.get_many(user=0, blocks=[0, 1000])), [])
+        self.assertEqual(self.get(user=0, block=2000).state, {'a': 2000})
+        self.assertEqual(len(list(self.get_many(user=1, blocks=[0, 1000, 2000]))), 3)
+
+
 class UserStateClientTestBase(_UserStateClientTestCRUD,
                               _UserStateClientTestHistory,
-                              _UserStateClientTestIterAll):
+                              _UserStateClientTestIterAll,
+                              _UserStateClientTestIterSorted,
+                              _UserStateClientTestIterChunks,
+                              _UserStateClientTestSnapshot,
+                              _UserStateClientTestBulkLoad,
+                              _UserStateClientTestConditionalSet,
+                              _UserStateClientTestDeleteAll):
     """
     Blackbox tests for XBlockUserStateClient implementations.
     """
@@ -598,29 +1061,316 @@ class UserStateClientTestBase(_UserStateClientTestCRUD,
     __test__ = False
 
 
+class UserStateClientStressTestBase(_UserStateClientTestUtils):
+    """
+    Blackbox tests of XBlockUserStateClient implementations under concurrent use.
+
+    Threads make overlapping ``set_many``, ``delete_many`` and ``get_many`` calls on
+    the same blocks. Reads must only see states that some sequence of the writes
+    could have produced, and afterwards the stored state and ``get_history`` must be
+    consistent with some order of the writes that keeps each thread's own calls in
+    the order it made them.
+
+    Backends opt in by adding it next to :class:`UserStateClientTestBase`::
+
+        class TestMyUserStateClient(UserStateClientTestBase, UserStateClientStressTestBase):
+            __test__ = True
+
+    Raise ``stress_threads`` and ``stress_rounds`` to stress a backend harder.
+    """
+
+    __test__ = False
+
+    stress_threads = 4
+    stress_rounds = 40
+    stress_blocks = 3
+
+    def _run_concurrently(self, workers):
+        """
+        Run each of ``workers`` in its own thread, starting them together, and re-raise
+        the first exception that any of them raised.
+        """
+        barrier = threading.Barrier(len(workers))
+        errors = []
+
+        def run(worker):
+            barrier.wait()
+            try:
+                worker()
+            except BaseException as exc:  # pylint: disable=broad-except
+                errors.append(exc)
+
+        threads = [threading.Thread(target=run, args=(worker,)) for worker in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def _reader(self, user, check):
+        """
+        Return a reader that calls ``check`` on the state of every block it reads, until ``done`` is set.
+        """
+        def read(done):
+            while not done.is_set():
+                for entry in self.get_many(user=user, blocks=range(self.stress_blocks)):
+                    check(entry.state)
+        return read
+
+    def _run_writers_and_readers(self, writers, readers):
+        """
+        Run ``writers`` and ``readers`` concurrently, stopping the readers once every writer is done.
+        """
+        done = threading.Event()
+        running = [len(writers)]
+        lock = threading.Lock()
+
+        def finishing(writer):
+            def write():
+                try:
+                    writer()
+                finally:
+                    with lock:
+                        running[0] -= 1
+                        if not running[0]:
+                            done.set()
+            return write
+
+        self._run_concurrently(
+            [finishing(writer) for writer in writers] + [functools.partial(reader, done) for reader in readers]
+        )
+
+    def _assert_history_consistent(self, user, block, current):
+        """
+        Assert that the history of ``block`` is latest first, and ends in its ``current`` state.
+
+        Returns:
+            list: The state dicts in the history, earliest first, with deletions as empty dicts.
+        """
+        history = list(self.get_history(user=user, block=block))
+        self.assertEqual(
+            [entry.updated for entry in history],
+            sorted((entry.updated for entry in history), reverse=True),
+        )
+        self.assertEqual(history[0].state or None, current)
+        return [entry.state or {} for entry in reversed(history)]
+
+    def test_concurrent_field_writes(self):
+        # Each writer owns one field of every block, writes increasing values to it,
+        # and sometimes deletes it, so the final value of each field is known.
+        blocks = range(self.stress_blocks)
+        expected = {block: {} for block in blocks}
+        fields = [f'field{writer}' for writer in range(self.stress_threads)]
+
+        def writer(field):
+            def write():
+                for value in range(self.stress_rounds):
+                    self.set_many(user=0, block_to_state={block: {field: value} for block in blocks})
+                    for block in blocks:
+                        expected[block][field] = value
+                    if value % 3 == 1:
+                        block = value % self.stress_blocks
+                        self.delete_many(user=0, blocks=[block], fields=[field])
+                        del expected[block][field]
+            return write
+
+        def check(state):
+            for field, value in state.items():
+                self.assertIn(field, fields)
+                self.assertIn(value, range(self.stress_rounds))
+
+        self._run_writers_and_readers(
+            [writer(field) for field in fields],
+            [self._reader(0, check) for _ in range(2)],
+        )
+
+        current = {entry.block_key: entry.state for entry in self.get_many(user=0, blocks=blocks)}
+        for block in blocks:
+            self.assertEqual(current.get(self._block(block)), expected[block] or None)
+            history = self._assert_history_consistent(0, block, expected[block] or None)
+            for field in fields:
+                values = [state[field] for state in history if field in state]
+                self.assertEqual(values, sorted(values))
+
+    def test_concurrent_block_writes(self):
+        # Writers overwrite every field of the blocks at once, and sometimes delete
+        # them, so every state seen must be from a single write.
+        blocks = range(self.stress_blocks)
+        last_written = {}
+
+        def writer(index):
+            def write():
+                for value in range(self.stress_rounds):
+                    token = index * self.stress_rounds + value
+                    self.set_many(user=0, block_to_state={block: {'a': token, 'b': token} for block in blocks})
+                    for block in blocks:
+                        last_written[index, block] = {'a': token, 'b': token}
+                    if value % 4 == 2:
+                        block = value % self.stress_blocks
+                        self.delete_many(user=0, blocks=[block])
+                        last_written[index, block] = None
+            return write
+
+        def check(state):
+            self.assertEqual(set(state), {'a', 'b'})
+            self.assertEqual(state['a'], state['b'])
+
+        self._run_writers_and_readers(
+            [writer(index) for index in range(self.stress_threads)],
+            [self._reader(0, check) for _ in range(2)],
+        )
+
+        current = {entry.block_key: entry.state for entry in self.get_many(user=0, blocks=blocks)}
+        for block in blocks:
+            state = current.get(self._block(block))
+            # The last write to the block must have been the last write of one of the threads.
+            self.assertIn(state, [last_written[index, block] for index in range(self.stress_threads)])
+            for one_state in self._assert_history_consistent(0, block, state):
+                if one_state:
+                    check(one_state)
+
+    def test_concurrent_users(self):
+        # Writers for different users of the same blocks must not see or lose each other's writes.
+        blocks = range(self.stress_blocks)
+
+        def writer(user):
+            def write():
+                for value in range(self.stress_rounds):
+                    if value % 5 == 3:
+                        self.delete_many(user=user, blocks=blocks)
+                        self.assertEqual(list(self.get_many(user=user, blocks=blocks)), [])
+                    self.set_many(user=user, block_to_state={block: {'a': value} for block in blocks})
+                    self.assertEqual(
+                        [entry.state for entry in self.get_many(user=user, blocks=blocks)],
+                        [{'a': value}] * self.stress_blocks,
+                    )
+            return write
+
+        self._run_concurrently([writer(user) for user in range(self.stress_threads)])
+
+        for user in range(self.stress_threads):
+            for block in blocks:
+                self.assertEqual(self.get(user=user, block=block).state, {'a': self.stress_rounds - 1})
+                history = self._assert_history_consistent(user, block, {'a': self.stress_rounds - 1})
+                values = [state['a'] for state in history if state]
+                self.assertEqual(values, sorted(values))
+
+
 class DictUserStateClient(XBlockUserStateClient):
     """
     The simplest possible in-memory implementation of DictUserStateClient,
     for testing the tests.
+
+    Usernames, block keys, course keys, block types and scopes are interned to small
+    integers (see :class:`~edx_user_state_client.interning.KeyInterner`), so the
+    history and the indexes for ``iter_all_for_block`` and ``iter_all_for_course``
+    are keyed by integer tuples, and opaque keys are only hashed once per call.
     """
     def __init__(self):
+        self._users = KeyInterner()
+        self._blocks = KeyInterner()
+        self._scopes = KeyInterner()
+        self._courses = KeyInterner()
+        self._block_types = KeyInterner()
+        # Maps (user id, block id, scope id) to the history of that block, latest first.
         self._history = {}
+        # Map block ids to the ids of their courses and block types.
+        self._block_course_ids = {}
+        self._block_type_ids = {}
+        # Map (block id, scope id) to user ids, user ids to (block id, scope id), and
+        # (course id, scope id) to block ids. They are dicts with None values, used as
+        # insertion-ordered sets.
+        self._users_by_block = {}
+        self._blocks_by_user = {}
+        self._blocks_by_course = {}
+        # The live snapshots, which must be told before a block's history changes.
+        self._snapshots = weakref.WeakSet()
+        self._lock = threading.RLock()
+
+    def _lookup(self, username, block_key, scope):
+        """
+        Return the history key for a block, or None if it has never been stored.
+        """
+        key = (self._users.lookup(username), self._blocks.lookup(block_key), self._scopes.lookup(scope))
+        return key if key in self._history else None
+
+    def _intern(self, username, block_key, scope):
+        """
+        Return the history key for a block, adding it to the indexes if it is new.
+        """
+        block_id = self._blocks.intern(block_key)
+        scope_id = self._scopes.intern(scope)
+        key = (self._users.intern(username), block_id, scope_id)
+        if key not in self._history:
+            self._history[key] = []
+            self._users_by_block.setdefault((block_id, scope_id), {})[key[0]] = None
+            self._blocks_by_user.setdefault(key[0], {})[(block_id, scope_id)] = None
+            course_key = getattr(block_key, 'course_key', None)
+            if course_key is not None:
+                course_id = self._courses.intern(course_key)
+                self._blocks_by_course.setdefault((course_id, scope_id), {})[block_id] = None
+                self._block_course_ids[block_id] = course_id
+                self._block_type_ids[block_id] = self._block_types.intern(block_key.block_type)
+        return key
+
+    def _versions(self, history_key):
+        """
+        Return the history of the block with ``history_key``, latest first, or None if it has none.
+        """
+        return self._history.get(history_key)
 
-    def _add_state(self, username, block_key, scope, state):
+    def _current(self, history_key):
         """
-        Add the specified state to the state history of this block.
+        Return the latest history entry of the block with ``history_key``, or None if it has none.
         """
-        history_list = self._history.setdefault((username, block_key, scope), [])
-        history_list.insert(0, XBlockUserState(username, block_key, state, datetime.now(pytz.utc), scope))
+        history_list = self._history.get(history_key)
+        return history_list[0] if history_list else None
 
-    def get_many(self, username, block_keys, scope=Scope.user_state, fields=None):
-        for key in block_keys:
-            if (username, key, scope) not in self._history:
-                continue
+    def _block_user_ids(self, block_id, scope_id):
+        """
+        Return the ids of the users with history for block ``block_id``.
+        """
+        return list(self._users_by_block.get((block_id, scope_id), ()))
+
+    def _preserve(self, history_key, purging=False):
+        """
+        Let the live snapshots save the history of ``history_key`` before it is changed or purged.
+        """
+        for snapshot in list(self._snapshots):
+            snapshot.save(history_key, self._history.get(history_key), purging)
+
+    def snapshot(self):
+        """
+        Taking a snapshot copies nothing. Before the first change to a block after a
+        snapshot is taken, the snapshot saves a copy of the block's history then.
+        """
+        with self._lock:
+            snapshot = DictUserStateSnapshot(self)
+            self._snapshots.add(snapshot)
+            return snapshot
 
-            entry = self._history[(username, key, scope)][0]
+    @staticmethod
+    def _add_state(history_list, username, block_key, scope, state):
+        """
+        Add the specified state to the state history ``history_list`` of this block.
+        """
+        updated = datetime.now(pytz.utc)
+        if history_list and history_list[0].updated is not None and history_list[0].updated >= updated:
+            # Keep versions distinct, so set_many_if_unmodified can tell them apart.
+            updated = history_list[0].updated + timedelta(microseconds=1)
+        history_list.insert(0, XBlockUserState(username, block_key, state, updated, scope))
+
+    def get_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        user_id = self._users.lookup(username)
+        scope_id = self._scopes.lookup(scope)
+        if user_id is None or scope_id is None:
+            return
 
-            if entry.state is None:
+        for key in block_keys:
+            entry = self._current((user_id, self._blocks.lookup(key), scope_id))
+            if entry is None or entry.state is None:
                 continue
 
             if fields is None:
@@ -634,33 +1384,72 @@ class DictUserStateClient(XBlockUserStateClient):
                 if field in entry.state
             })
 
-    def set_many(self, username, block_keys_to_state, scope=Scope.user_state):
-        for key, state in list(block_keys_to_state.items()):
-            if (username, key, scope) in self._history:
-                current_state = self._history[(username, key, scope)][0].state.copy()
-                current_state.update(state)
-                self._add_state(username, key, scope, current_state)
-            else:
-                self._add_state(username, key, scope, state)
-
-    def delete_many(self, username, block_keys, scope=Scope.user_state, fields=None):
-        for key in block_keys:
-            if (username, key, scope) not in self._history:
-                continue
-
-            if fields is None:
-                self._add_state(username, key, scope, None)
-            else:
-                state = self._history[(username, key, scope)][0].state.copy()
-                for field in fields:
-                    if field in state:
-                        del state[field]
-                if not state:
-                    self._add_state(username, key, scope, None)
+    def set_many(self, username, block_keys_to_state, scope=None):
+        scope = resolve_scope(scope)
+        with self._lock:
+            for key, state in list(block_keys_to_state.items()):
+                history_key = self._intern(username, key, scope)
+                self._preserve(history_key)
+                history_list = self._history[history_key]
+                if history_list:
+                    current_state = dict(history_list[0].state or {})
+                    current_state.update(state)
+                    self._add_state(history_list, username, key, scope, current_state)
                 else:
-                    self._add_state(username, key, scope, state)
-
-    def get_history(self, username, block_key, scope=Scope.user_state):
+                    self._add_state(history_list, username, key, scope, dict(state))
+
+    def set_many_if_unmodified(self, username, block_keys_to_state, expected_updated, scope=None):
+        scope = resolve_scope(scope)
+        with self._lock:
+            super().set_many_if_unmodified(username, block_keys_to_state, expected_updated, scope)
+
+    def delete_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        with self._lock:
+            for key in block_keys:
+                history_key = self._lookup(username, key, scope)
+                if history_key is None:
+                    continue
+
+                self._preserve(history_key)
+                history_list = self._history[history_key]
+                if fields is None:
+                    self._add_state(history_list, username, key, scope, None)
+                else:
+                    state = dict(history_list[0].state or {})
+                    for field in fields:
+                        if field in state:
+                            del state[field]
+                    if not state:
+                        self._add_state(history_list, username, key, scope, None)
+                    else:
+                        self._add_state(history_list, username, key, scope, state)
+
+    def bulk_load(self, entries, batch_size=1000):
+        """
+        Inserts each entry into its block's history in order of ``updated``, holding the
+        lock for ``batch_size`` entries at a time. Entries without an ``updated`` time are
+        stored as of now.
+        """
+        count = 0
+        entries = iter(entries)
+        while True:
+            batch = list(islice(entries, batch_size))
+            if not batch:
+                return count
+            with self._lock:
+                for entry in batch:
+                    entry = entry._replace(
+                        state=None if entry.state is None else dict(entry.state),
+                        updated=entry.updated or datetime.now(pytz.utc),
+                    )
+                    history_key = self._intern(entry.username, entry.block_key, entry.scope)
+                    history_list = self._history[history_key]
+                    self._preserve(history_key)
+                    history_list.insert(self._index_as_of(history_list, entry.updated), entry)
+            count += len(batch)
+
+    def get_history(self, username, block_key, scope=None):
         """
         Retrieve history of state changes for a given block for a given
         student.  We don't guarantee that history for many blocks will be fast.
@@ -670,48 +1459,392 @@ class DictUserStateClient(XBlockUserStateClient):
         Arguments:
             username: The name of the user whose history should be retrieved.
             block_key (UsageKey): The UsageKey identifying which xblock history to retrieve.
-            scope (Scope): The scope to load data from.
+            scope (Scope): The scope to load data from, or None for ``Scope.user_state``.
 
         Yields:
             UserStateHistory entries for each modification to the specified XBlock, from latest
             to earliest.
         """
-        if (username, block_key, scope) not in self._history:
+        scope = resolve_scope(scope)
+        history = self._versions(
+            (self._users.lookup(username), self._blocks.lookup(block_key), self._scopes.lookup(scope))
+        )
+        if not history:
             raise self.DoesNotExist(username, block_key, scope)
 
-        yield from self._history[(username, block_key, scope)]
+        yield from history
+
+    @staticmethod
+    def _index_as_of(versions, timestamp):
+        """
+        Return the index of the first entry of ``versions`` (latest first) stored at or before ``timestamp``.
+        """
+        low, high = 0, len(versions)
+        while low < high:
+            middle = (low + high) // 2
+            updated = versions[middle].updated
+            if updated is not None and updated > timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    @classmethod
+    def _version_as_of(cls, versions, timestamp):
+        """
+        Return the entry of ``versions`` (latest first) in effect at ``timestamp``, by binary search.
+        """
+        index = cls._index_as_of(versions, timestamp)
+        return versions[index] if index < len(versions) else None
+
+    def get_many_as_of(self, username, block_keys, timestamp, scope=None, fields=None):
+        """
+        Binary-searches each block's history, which writes keep in order of ``updated``.
+        """
+        scope = resolve_scope(scope)
+        user_id = self._users.lookup(username)
+        scope_id = self._scopes.lookup(scope)
+        if user_id is None or scope_id is None:
+            return
+
+        for key in block_keys:
+            with self._lock:
+                versions = self._versions((user_id, self._blocks.lookup(key), scope_id))
+                entry = self._version_as_of(versions, timestamp) if versions else None
+            if entry is None or entry.state is None:
+                continue
+
+            yield entry._replace(state={
+                field: entry.state[field]
+                for field in (entry.state if fields is None else fields)
+                if field in entry.state
+            })
+
+    def _delete_all(self, history_keys, purge_history, batch_size, progress):
+        """
+        Delete the current state of the blocks with ``history_keys``, or remove their history entirely.
+        """
+        count = 0
+        for history_key in history_keys:
+            history_list = self._history[history_key]
+            entry = history_list[0]
+            self._preserve(history_key, purging=purge_history)
+            if purge_history:
+                user_id, block_id, scope_id = history_key
+                del self._history[history_key]
+                del self._users_by_block[(block_id, scope_id)][user_id]
+                del self._blocks_by_user[user_id][(block_id, scope_id)]
+            elif entry.state is not None:
+                self._add_state(history_list, entry.username, entry.block_key, entry.scope, None)
+            if entry.state is not None:
+                count += 1
+                if progress is not None and count % batch_size == 0:
+                    progress(count)
+        if progress is not None and count % batch_size:
+            progress(count)
+        return count
+
+    def delete_all_for_user(self, username, course_keys=None, scope=None, purge_history=False,
+                            batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        with self._lock:
+            user_id = self._users.lookup(username)
+            scope_id = self._scopes.lookup(scope)
+            course_ids = None
+            if course_keys is not None:
+                course_ids = {self._courses.lookup(course_key) for course_key in course_keys} - {None}
+            history_keys = [
+                (user_id, block_id, scope_id)
+                for block_id, one_scope_id in self._blocks_by_user.get(user_id, ())
+                if one_scope_id == scope_id and (
+                    course_ids is None or self._block_course_ids.get(block_id) in course_ids
+                )
+            ]
+            return self._delete_all(history_keys, purge_history, batch_size, progress)
+
+    def delete_all_for_block(self, block_key, scope=None, purge_history=False, batch_size=1000,
+                             progress=None):
+        scope = resolve_scope(scope)
+        with self._lock:
+            block_id = self._blocks.lookup(block_key)
+            scope_id = self._scopes.lookup(scope)
+            history_keys = [
+                (user_id, block_id, scope_id) for user_id in self._users_by_block.get((block_id, scope_id), ())
+            ]
+            return self._delete_all(history_keys, purge_history, batch_size, progress)
+
+    def delete_all_for_course(self, course_key, block_type=None, scope=None, purge_history=False,
+                              batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        with self._lock:
+            course_id = self._courses.lookup(course_key)
+            scope_id = self._scopes.lookup(scope)
+            block_type_id = None if block_type is None else self._block_types.lookup(block_type)
+            if block_type is not None and block_type_id is None:
+                return 0
+            history_keys = [
+                (user_id, block_id, scope_id)
+                for block_id in self._blocks_by_course.get((course_id, scope_id), ())
+                if block_type_id is None or self._block_type_ids[block_id] == block_type_id
+                for user_id in self._users_by_block.get((block_id, scope_id), ())
+            ]
+            return self._delete_all(history_keys, purge_history, batch_size, progress)
+
+    def _iter_current(self, block_id, scope_id):
+        """
+        Yield the current state of every user's block ``block_id``, skipping deleted blocks.
+        """
+        for user_id in self._block_user_ids(block_id, scope_id):
+            entry = self._current((user_id, block_id, scope_id))
+            if entry is not None and entry.state is not None:
+                yield entry
 
-    def iter_all_for_block(self, block_key, scope=Scope.user_state):
+    def iter_all_for_block(self, block_key, scope=None):
         """
         You get no ordering guarantees. If you're using this method, you should be running in an
         async task.
         """
-        for (_, key, one_scope), entries in list(self._history.items()):
-            if entries[0].state is None:
-                continue
+        scope = resolve_scope(scope)
+        block_id = self._blocks.lookup(block_key)
+        scope_id = self._scopes.lookup(scope)
+        if block_id is None or scope_id is None:
+            return
+
+        yield from self._iter_current(block_id, scope_id)
+
+    def iter_all_for_blocks(self, block_keys, scope=None):
+        """
+        Looks the scope up once, and then each block's users in the index.
+        """
+        scope = resolve_scope(scope)
+        scope_id = self._scopes.lookup(scope)
+        if scope_id is None:
+            return
+
+        for block_key in dict.fromkeys(block_keys):
+            block_id = self._blocks.lookup(block_key)
+            if block_id is not None:
+                yield from self._iter_current(block_id, scope_id)
+
+    def _current_entries(self, block_id, scope_id):
+        """
+        Return the current state of every user's block ``block_id`` as a list, skipping deleted blocks.
+        """
+        entries = [self._current((user_id, block_id, scope_id)) for user_id in self._block_user_ids(block_id, scope_id)]
+        return [entry for entry in entries if entry is not None and entry.state is not None]
 
-            if key == block_key and one_scope == scope:
-                yield entries[0]
+    def _iter_chunks(self, block_ids, scope_id, chunk_size, columnar, fields):
+        """
+        Yield the current state of the blocks ``block_ids`` in chunks, a block's users at a time.
+        """
+        pending = []
+        for block_id in block_ids:
+            pending.extend(self._current_entries(block_id, scope_id))
+            while len(pending) >= chunk_size:
+                yield make_chunk(pending[:chunk_size], columnar, fields)
+                del pending[:chunk_size]
+        if pending:
+            yield make_chunk(pending, columnar, fields)
+
+    def iter_chunks_for_blocks(self, block_keys, scope=None, chunk_size=1000, columnar=False,
+                               fields=None):
+        """
+        Gathers each block's entries into a list, rather than yielding them one by one.
+        """
+        scope = resolve_scope(scope)
+        check_chunk_size(chunk_size)
+        scope_id = self._scopes.lookup(scope)
+        if scope_id is None:
+            return iter(())
+
+        block_ids = (self._blocks.lookup(block_key) for block_key in dict.fromkeys(block_keys))
+        return self._iter_chunks(
+            (block_id for block_id in block_ids if block_id is not None), scope_id, chunk_size, columnar, fields
+        )
 
-    def iter_all_for_course(self, course_key, block_type=None, scope=Scope.user_state):
+    def iter_all_for_course(self, course_key, block_type=None, scope=None):
         """
         You get no ordering guarantees. If you're using this method, you should be running in an
         async task.
         """
-        for (_, key, one_scope), entries in list(self._history.items()):
-            if entries[0].state is None:
-                continue
+        scope = resolve_scope(scope)
+        course_id = self._courses.lookup(course_key)
+        scope_id = self._scopes.lookup(scope)
+        block_type_id = None if block_type is None else self._block_types.lookup(block_type)
+        if course_id is None or scope_id is None or (block_type is not None and block_type_id is None):
+            return
+
+        for block_id in list(self._blocks_by_course.get((course_id, scope_id), ())):
+            if block_type_id is None or self._block_type_ids[block_id] == block_type_id:
+                yield from self._iter_current(block_id, scope_id)
+
+    def iter_chunks_for_course(self, course_key, block_type=None, scope=None, chunk_size=1000,
+                               columnar=False, fields=None):
+        """
+        Gathers each block's entries into a list, rather than yielding them one by one.
+        """
+        scope = resolve_scope(scope)
+        check_chunk_size(chunk_size)
+        course_id = self._courses.lookup(course_key)
+        scope_id = self._scopes.lookup(scope)
+        block_type_id = None if block_type is None else self._block_types.lookup(block_type)
+        if course_id is None or scope_id is None or (block_type is not None and block_type_id is None):
+            return iter(())
+
+        block_ids = [
+            block_id for block_id in list(self._blocks_by_course.get((course_id, scope_id), ()))
+            if block_type_id is None or self._block_type_ids[block_id] == block_type_id
+        ]
+        return self._iter_chunks(block_ids, scope_id, chunk_size, columnar, fields)
+
+    def iter_all_for_course_sorted(self, course_key, block_type=None, scope=None,
+                                   order_by=ORDER_BY_USERNAME, username_prefix=None):
+        """
+        Sorts the course's block ids, and each block's or user's ids, rather than all of
+        the course's entries.
+        """
+        scope = resolve_scope(scope)
+        check_order(order_by)
+        course_id = self._courses.lookup(course_key)
+        scope_id = self._scopes.lookup(scope)
+        block_type_id = None if block_type is None else self._block_types.lookup(block_type)
+        if course_id is None or scope_id is None or (block_type is not None and block_type_id is None):
+            return iter(())
+
+        block_ids = sorted(
+            (
+                block_id for block_id in list(self._blocks_by_course.get((course_id, scope_id), ()))
+                if block_type_id is None or self._block_type_ids[block_id] == block_type_id
+            ),
+            key=lambda block_id: str(self._blocks.key(block_id)),
+        )
+        if order_by == ORDER_BY_BLOCK:
+            return self._iter_sorted_by_block(block_ids, scope_id, username_prefix)
+        return self._iter_sorted_by_user(block_ids, scope_id, username_prefix)
+
+    def _sorted_user_ids(self, user_ids, username_prefix):
+        """
+        Return ``user_ids`` sorted by username, keeping those whose usernames start with ``username_prefix``.
+        """
+        usernames = {user_id: self._users.key(user_id) for user_id in user_ids}
+        if username_prefix is not None:
+            usernames = {
+                user_id: username for user_id, username in usernames.items() if username.startswith(username_prefix)
+            }
+        return sorted(usernames, key=usernames.get)
+
+    def _iter_sorted_by_block(self, block_ids, scope_id, username_prefix):
+        for block_id in block_ids:
+            for user_id in self._sorted_user_ids(self._block_user_ids(block_id, scope_id), username_prefix):
+                entry = self._current((user_id, block_id, scope_id))
+                if entry is not None and entry.state is not None:
+                    yield entry
+
+    def _iter_sorted_by_user(self, block_ids, scope_id, username_prefix):
+        # Gathering each user's block ids in the order of the sorted block ids sorts them too.
+        block_ids_by_user = {}
+        for block_id in block_ids:
+            for user_id in self._block_user_ids(block_id, scope_id):
+                block_ids_by_user.setdefault(user_id, []).append(block_id)
+        for user_id in self._sorted_user_ids(block_ids_by_user, username_prefix):
+            for block_id in block_ids_by_user[user_id]:
+                entry = self._current((user_id, block_id, scope_id))
+                if entry is not None and entry.state is not None:
+                    yield entry
+
+
+class DictUserStateSnapshot(ReadOnlyClientMixin, DictUserStateClient):
+    """
+    A read-only view of a DictUserStateClient as it was when :meth:`DictUserStateClient.snapshot` was called.
+
+    It shares the client's interners and indexes (its ``SHARED`` attributes), and reads
+    the client's histories directly until the client saves one in it (see :meth:`save`)
+    before changing it.
+
+    Arguments:
+        client (DictUserStateClient): The client to take the snapshot of.
+    """
+    SHARED = (
+        '_users', '_blocks', '_scopes', '_courses', '_block_types', '_history', '_block_course_ids',
+        '_block_type_ids', '_users_by_block', '_blocks_by_user', '_blocks_by_course', '_lock',
+    )
+
+    def __init__(self, client):  # pylint: disable=super-init-not-called
+        for name in self.SHARED:
+            setattr(self, name, getattr(client, name))
+        self._client = client
+        # Maps history keys changed since the snapshot was taken to a copy of their history then.
+        self._saved = {}
+        # Maps (block id, scope id) to the ids of the users whose history of it has been purged since.
+        self._purged_users = {}
+
+    def save(self, history_key, history_list, purging):
+        """
+        Keep the history of ``history_key`` as it is now, before it is changed or purged.
+        """
+        if history_key not in self._saved:
+            self._saved[history_key] = list(history_list) if history_list else None
+        if purging:
+            user_id, block_id, scope_id = history_key
+            self._purged_users.setdefault((block_id, scope_id), []).append(user_id)
+
+    def close(self):
+        """
+        Stop saving the client's changed histories. The snapshot mustn't be read afterwards.
+        """
+        with self._lock:
+            self._client._snapshots.discard(self)  # pylint: disable=protected-access
+
+    def _versions(self, history_key):
+        with self._lock:
+            if history_key not in self._saved:
+                history_list = self._history.get(history_key)
+                return list(history_list) if history_list else None
+            history_list = self._saved[history_key]
+            return list(history_list) if history_list else None
+
+    def _current(self, history_key):
+        with self._lock:
+            if history_key not in self._saved:
+                return super()._current(history_key)
+            history_list = self._saved[history_key]
+            return history_list[0] if history_list else None
+
+    def _block_user_ids(self, block_id, scope_id):
+        with self._lock:
+            user_ids = super()._block_user_ids(block_id, scope_id) + self._purged_users.get((block_id, scope_id), [])
+            return list(dict.fromkeys(user_ids))
+
+
+class RecordingUserStateClient(DictUserStateClient):
+    """
+    A DictUserStateClient that records calls to get_many, set_many and delete_many in ``calls``.
+    """
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    @property
+    def writes(self):
+        """The ``block_keys_to_state`` of every set_many call, in order."""
+        return [call[1] for call in self.calls if call[0] == 'set_many']
 
-            if (
-                    key.course_key == course_key and
-                    one_scope == scope and
-                    (block_type is None or key.block_type == block_type)
-            ):
+    def get_many(self, username, block_keys, scope=None, fields=None):
+        block_keys = list(block_keys)
+        self.calls.append(('get_many', sorted(block_keys), fields))
+        return super().get_many(username, block_keys, scope, fields)
 
-                yield entries[0]
+    def set_many(self, username, block_keys_to_state, scope=None):
+        self.calls.append(('set_many', block_keys_to_state))
+        return super().set_many(username, block_keys_to_state, scope)
 
+    def delete_many(self, username, block_keys, scope=None, fields=None):
+        block_keys = list(block_keys)
+        self.calls.append(('delete_many', sorted(block_keys), fields))
+        return super().delete_many(username, block_keys, scope, fields)
 
-class TestDictUserStateClient(UserStateClientTestBase):
+
+class TestDictUserStateClient(UserStateClientTestBase, UserStateClientStressTestBase):
     """
     Tests of the DictUserStateClient backend.
     """
@@ -720,3 +1853,194 @@ class TestDictUserStateClient(UserStateClientTestBase):
     def setUp(self):
         super().setUp()
         self.client = DictUserStateClient()
+
+    def test_bulk_load_keeps_updated(self):
+        updated = datetime(2020, 1, 1, tzinfo=pytz.utc)
+        self.client.bulk_load([self._entry(0, 0, {'a': 1})._replace(updated=updated)])
+        self.assertEqual(self.get(user=0, block=0).updated, updated)
+
+    def test_bulk_load_keeps_history_in_order(self):
+        updates = [datetime(2020, 1, day, tzinfo=pytz.utc) for day in range(1, 4)]
+        state = {'a': 2}
+        self.client.bulk_load([
+            self._entry(0, 0, state)._replace(updated=updates[2]),
+            self._entry(0, 0, {'a': 0})._replace(updated=updates[0]),
+            self._entry(0, 0, {'a': 1})._replace(updated=updates[1]),
+        ], batch_size=2)
+        state['a'] = 'changed'
+        self.assertEqual(
+            [(entry.state, entry.updated) for entry in self.get_history(user=0, block=0)],
+            [({'a': 2}, updates[2]), ({'a': 1}, updates[1]), ({'a': 0}, updates[0])],
+        )
+        self.assertEqual(
+            next(self.client.get_many_as_of(self._user(0), [self._block(0)], updates[1])).state, {'a': 1}
+        )
+
+    def test_delete_all_purges_history(self):
+        self.set_many(user=0, block_to_state={0: {'a': 0}, 1000: {'a': 1}})
+        self.set(user=1, block=0, state={'a': 2})
+        self.delete(user=1, block=0)
+        progress = []
+        self.assertEqual(self.client.delete_all_for_block(
+            self._block(0), purge_history=True, batch_size=1, progress=progress.append
+        ), 1)
+        self.assertEqual(progress, [1])
+        for user in range(2):
+            with self.assertRaises(self.client.DoesNotExist):
+                next(self.get_history(user=user, block=0))
+        self.assertEqual(self.client.delete_all_for_user(self._user(0), purge_history=True), 1)
+        with self.assertRaises(self.client.DoesNotExist):
+            next(self.get_history(user=0, block=1000))
+        self.set(user=0, block=0, state={'a': 3})
+        self.assertEqual([entry.state for entry in self.get_history(user=0, block=0)], [{'a': 3}])
+
+    def test_get_many_as_of_bulk_loaded(self):
+        updates = [datetime(2020, 1, day, tzinfo=pytz.utc) for day in range(1, 4)]
+        self.client.bulk_load([
+            self._entry(0, 0, {'a': day})._replace(updated=updated) for day, updated in enumerate(updates)
+        ])
+        snapshot = self.client.snapshot()
+        self.addCleanup(snapshot.close)
+        self.set(user=0, block=0, state={'a': 'now'})
+        for client in (self.client, snapshot):
+            self.assertEqual(
+                [
+                    [entry.state for entry in client.get_many_as_of(self._user(0), [self._block(0)], timestamp)]
+                    for timestamp in (updates[0] - timedelta(days=1), updates[0], updates[1] + timedelta(hours=1))
+                ],
+                [[], [{'a': 0}], [{'a': 1}]],
+            )
+        self.assertEqual(
+            next(snapshot.get_many_as_of(self._user(0), [self._block(0)], datetime.now(pytz.utc))).state, {'a': 2}
+        )
+
+    def test_snapshot_then_bulk_load(self):
+        self.set(user=0, block=0, state={'a': 'current'})
+        snapshot = self.client.snapshot()
+        self.addCleanup(snapshot.close)
+        self.client.bulk_load([self._entry(0, 0, {'a': 'old-import'})._replace(
+            updated=datetime(2020, 1, 1, tzinfo=pytz.utc)
+        )])
+        self.assertEqual(self.get(user=0, block=0).state, {'a': 'current'})
+        self.assertEqual(snapshot.get(self._user(0), self._block(0)).state, {'a': 'current'})
+        self.assertEqual([entry.state for entry in snapshot.get_history(self._user(0), self._block(0))],
+                         [{'a': 'current'}])
+        self.assertEqual([entry.state for entry in self.get_history(user=0, block=0)],
+                         [{'a': 'current'}, {'a': 'old-import'}])
+
+    def test_snapshot_keeps_purged_history(self):
+        for user in range(2):
+            self.set(user=user, block=0, state={'a': user})
+        snapshot = self.client.snapshot()
+        self.client.delete_all_for_block(self._block(0), purge_history=True)
+        self.set(user=0, block=0, state={'a': 'new'})
+        self.assertEqual(
+            sorted(entry.state['a'] for entry in snapshot.iter_all_for_block(self._block(0))), [0, 1]
+        )
+        self.assertEqual([entry.state for entry in snapshot.get_history(self._user(1), self._block(0))], [{'a': 1}])
+        self.assertEqual([entry.state for entry in self.iter_all_for_block(block=0)], [{'a': 'new'}])
+
+    def test_snapshots_are_released(self):
+        snapshot = self.client.snapshot()
+        other = self.client.snapshot()
+        self.assertEqual(len(self.client._snapshots), 2)  # pylint: disable=protected-access
+        snapshot.close()
+        del other
+        gc.collect()
+        self.assertEqual(len(self.client._snapshots), 0)  # pylint: disable=protected-access
+
+    def test_scans_skip_unknown_keys(self):
+        self.set(user=0, block=0, state={'a': 1})
+        self.client.set_many(self._user(0), {'unversioned': {'a': 1}})
+        self.assertEqual(list(self.client.iter_all_for_course(self._course(1))), [])
+        self.assertEqual(list(self.client.iter_all_for_course(self._course(0), block_type='unknown')), [])
+        self.assertEqual(len(list(self.client.iter_all_for_course(self._course(0)))), 1)
+        self.assertEqual(len(list(self.client.iter_all_for_block('unversioned'))), 1)
+
+
+class TestGenericDeleteAll(UserStateClientTestBase):
+    """
+    Tests of the default XBlockUserStateClient bulk deletes, which stream through iter_all_* and delete_many.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.client = DictUserStateClient()
+        for method in ('delete_all_for_user', 'delete_all_for_block', 'delete_all_for_course'):
+            setattr(self.client, method, functools.partial(getattr(XBlockUserStateClient, method), self.client))
+
+    def test_progress(self):
+        self.set_many(user=0, block_to_state={block: {'a': block} for block in range(5)})
+        progress = []
+        self.client.delete_all_for_course(self._course(0), batch_size=2, progress=progress.append)
+        self.assertEqual(progress, [2, 4, 5])
+
+    def test_needs_course_keys(self):
+        with self.assertRaises(NotImplementedError):
+            self.client.delete_all_for_user(self._user(0))
+        with self.assertRaises(NotImplementedError):
+            self.client.delete_all_for_block(self._block(0), purge_history=True)
+
+
+class TestGenericIterSorted(UserStateClientTestBase):
+    """
+    Tests of the default XBlockUserStateClient.iter_all_for_course_sorted, which sorts iter_all_for_course.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.client = DictUserStateClient()
+        self.client.iter_all_for_course_sorted = functools.partial(
+            XBlockUserStateClient.iter_all_for_course_sorted, self.client
+        )
+
+
+class TestGenericIterAllForBlocks(UserStateClientTestBase):
+    """
+    Tests of the default XBlockUserStateClient.iter_all_for_blocks, which calls iter_all_for_block per block.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.client = DictUserStateClient()
+        self.client.iter_all_for_blocks = functools.partial(XBlockUserStateClient.iter_all_for_blocks, self.client)
+
+
+class TestGenericIterChunks(UserStateClientTestBase):
+    """
+    Tests of the default XBlockUserStateClient.iter_chunks_*, which batch iter_all_for_blocks and iter_all_for_course.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.client = DictUserStateClient()
+        for method in ('iter_chunks_for_blocks', 'iter_chunks_for_course'):
+            setattr(self.client, method, functools.partial(getattr(XBlockUserStateClient, method), self.client))
+
+
+class TestGenericGetManyAsOf(UserStateClientTestBase):
+    """
+    Tests of the default XBlockUserStateClient.get_many_as_of, which walks get_history.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.client = DictUserStateClient()
+        self.client.get_many_as_of = functools.partial(XBlockUserStateClient.get_many_as_of, self.client)
+
+
+class TestGenericBulkLoad(UserStateClientTestBase):
+    """
+    Tests of the default XBlockUserStateClient.bulk_load, which replays entries through set_many.
+    """
+    __test__ = True
+
+    def setUp(self):
+        super().setUp()
+        self.client = DictUserStateClient()
+        self.client.bulk_load = functools.partial(XBlockUserStateClient.bulk_load, self.client)
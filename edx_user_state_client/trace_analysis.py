@@ -0,0 +1,213 @@
+"""
+Analyze traces written by :class:`~edx_user_state_client.tracing.TracingUserStateClient`.
+
+Run it as a command to print a report::
+
+    python -m edx_user_state_client.trace_analysis trace.ndjson [more.ndjson ...]
+
+The report shows:
+
+* N+1 reads: call sites that make runs of single-key ``get``/``get_many`` calls for
+  one user, which could be one ``get_many``.
+* Hot block keys: the block keys read most often.
+* Redundant writes: call sites writing blocks whose fields already had the values written.
+* Wide reads: call sites reading with ``fields=None``, and how many fields they got back.
+"""
+
+import argparse
+import json
+import sys
+from collections import Counter, defaultdict
+
+READ_METHODS = ('get', 'get_many')
+WRITE_METHODS = ('set', 'set_many', 'set_many_if_unmodified')
+DELETE_METHODS = ('delete', 'delete_many')
+BULK_WRITE_METHODS = ('bulk_load', 'delete_all_for_user', 'delete_all_for_block', 'delete_all_for_course')
+
+
+def read_trace(paths):
+    """
+    Yield the trace records in ``paths``, in order.
+    """
+    for path in paths:
+        with open(path, encoding='utf-8') as trace:
+            for line in trace:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _site(record):
+    return record['st'][0] if record.get('st') else '<unknown>'
+
+
+def _may_change(record, username, scope, block_key):
+    """
+    Return whether the ``bulk_load`` or ``delete_all_*`` ``record`` may have changed the
+    state of ``username`` in ``block_key``, as traces don't record which blocks those changed.
+    """
+    if record['m'] == 'bulk_load':
+        return True
+    if scope != record.get('s'):
+        return False
+    if record['m'] == 'delete_all_for_user':
+        return username == record.get('u')
+    if record['m'] == 'delete_all_for_block':
+        return block_key in record['k']
+    # Traced block keys don't say which course they are in.
+    return True
+
+
+def analyze(records, n_plus_one_threshold=3, window=1.0, top=10):
+    """
+    Summarize access patterns in trace ``records``.
+
+    Arguments:
+        records: An iterable of trace records, in the order they were written.
+        n_plus_one_threshold (int): The number of consecutive single-key reads that counts as an N+1 run.
+        window (float): The longest gap, in seconds, between reads in the same run.
+        top (int): How many entries to include in each ranking.
+
+    Returns:
+        dict: With the keys ``methods``, ``n_plus_one``, ``hot_keys``, ``redundant_writes``
+        and ``wide_reads``, each a list of dicts sorted from most to least significant.
+    """
+    methods = defaultdict(lambda: {'calls': 0, 'ms': 0.0})
+    runs = {}
+    n_plus_one = defaultdict(lambda: {'runs': 0, 'calls': 0})
+    hot_keys = Counter()
+    # Maps (username, scope, block key) to the digests of the field values last written there.
+    last_written = defaultdict(dict)
+    writes = defaultdict(lambda: {'writes': 0, 'redundant_blocks': 0, 'redundant_fields': 0})
+    wide = defaultdict(lambda: {'reads': 0, 'entries': 0, 'fields': 0})
+
+    def close_run(run_key):
+        run = runs.pop(run_key)
+        if run['calls'] >= n_plus_one_threshold:
+            n_plus_one[run_key[3]]['runs'] += 1
+            n_plus_one[run_key[3]]['calls'] += run['calls']
+
+    for record in records:
+        method = record['m']
+        methods[method]['calls'] += 1
+        methods[method]['ms'] += record.get('ms', 0)
+        site = _site(record)
+        keys = record.get('k', [])
+
+        if method in READ_METHODS:
+            hot_keys.update(keys)
+            run_key = (record.get('th'), record.get('u'), record.get('s'), site)
+            if len(keys) == 1:
+                run = runs.get(run_key)
+                if run is not None and record['t'] - run['last'] > window:
+                    close_run(run_key)
+                    run = None
+                if run is None:
+                    run = runs[run_key] = {'calls': 0, 'last': record['t']}
+                run['calls'] += 1
+                run['last'] = record['t']
+            elif run_key in runs:
+                close_run(run_key)
+            if record.get('f') is None:
+                wide[site]['reads'] += 1
+                wide[site]['entries'] += record.get('n', 0)
+                wide[site]['fields'] += record.get('nf', 0)
+
+        elif method in WRITE_METHODS:
+            for key, digests in record.get('w', {}).items():
+                writes[site]['writes'] += 1
+                redundant = 0
+                block_written = last_written[(record.get('u'), record.get('s'), key)]
+                for field, digest in digests.items():
+                    if block_written.get(field) == digest:
+                        redundant += 1
+                    if 'e' not in record:
+                        block_written[field] = digest
+                writes[site]['redundant_fields'] += redundant
+                if digests and redundant == len(digests):
+                    writes[site]['redundant_blocks'] += 1
+
+        elif method in DELETE_METHODS:
+            for key in keys:
+                block_key = (record.get('u'), record.get('s'), key)
+                if record.get('f') is None:
+                    last_written.pop(block_key, None)
+                elif block_key in last_written:
+                    for field in record['f']:
+                        last_written[block_key].pop(field, None)
+
+        elif method in BULK_WRITE_METHODS:
+            for block_key in [block_key for block_key in last_written if _may_change(record, *block_key)]:
+                del last_written[block_key]
+
+    for run_key in list(runs):
+        close_run(run_key)
+
+    return {
+        'methods': sorted(
+            ({'method': method, 'calls': stats['calls'], 'total_ms': round(stats['ms'], 3),
+              'mean_ms': round(stats['ms'] / stats['calls'], 3)} for method, stats in methods.items()),
+            key=lambda row: -row['total_ms'],
+        ),
+        'n_plus_one': sorted(
+            ({'site': site, **stats} for site, stats in n_plus_one.items()),
+            key=lambda row: -row['calls'],
+        )[:top],
+        'hot_keys': [{'block_key': key, 'reads': count} for key, count in hot_keys.most_common(top)],
+        'redundant_writes': sorted(
+            ({'site': site, **stats} for site, stats in writes.items() if stats['redundant_fields']),
+            key=lambda row: -row['redundant_fields'],
+        )[:top],
+        'wide_reads': sorted(
+            ({'site': site, 'reads': stats['reads'],
+              'mean_fields': round(stats['fields'] / stats['entries'], 1) if stats['entries'] else 0.0}
+             for site, stats in wide.items()),
+            key=lambda row: -row['reads'],
+        )[:top],
+    }
+
+
+def format_report(report):
+    """
+    Return ``report`` from :func:`analyze` as human-readable text.
+    """
+    sections = [
+        ('Calls by method', 'methods', ('method', 'calls', 'total_ms', 'mean_ms')),
+        ('N+1 single-key reads (could be one get_many)', 'n_plus_one', ('site', 'runs', 'calls')),
+        ('Hot block keys', 'hot_keys', ('block_key', 'reads')),
+        ('Redundant writes', 'redundant_writes', ('site', 'writes', 'redundant_blocks', 'redundant_fields')),
+        ('Reads with fields=None (could use a projection)', 'wide_reads', ('site', 'reads', 'mean_fields')),
+    ]
+    lines = []
+    for title, name, columns in sections:
+        lines.append(title)
+        lines.append('=' * len(title))
+        if not report[name]:
+            lines.append('(none)')
+        for row in report[name]:
+            lines.append('  '.join(f'{column}={row[column]}' for column in columns))
+        lines.append('')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    """
+    Print a report on the trace files named in ``argv``.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('paths', nargs='+', help='Trace files written by TracingUserStateClient')
+    parser.add_argument('--top', type=int, default=10, help='How many entries to show in each ranking')
+    parser.add_argument('--threshold', type=int, default=3, help='Single-key reads in a row that count as N+1')
+    parser.add_argument('--window', type=float, default=1.0, help='Longest gap between reads in a run, in seconds')
+    parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+    args = parser.parse_args(argv)
+
+    report = analyze(read_trace(args.paths), args.threshold, args.window, args.top)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(format_report(report))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
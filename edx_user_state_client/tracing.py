@@ -0,0 +1,344 @@
+"""
+An XBlockUserStateClient that records every call to a trace file, for finding
+inefficient access patterns with :mod:`edx_user_state_client.trace_analysis`.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import traceback
+
+from edx_user_state_client.chunks import StateColumns, check_chunk_size
+from edx_user_state_client.interface import resolve_scope
+from edx_user_state_client.ordering import ORDER_BY_USERNAME
+from edx_user_state_client.wrapper import XBlockUserStateClientWrapper
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _is_library_frame(filename):
+    """
+    Return whether ``filename`` is one of this package's modules (other than its tests).
+    """
+    path = os.path.abspath(filename)
+    return os.path.dirname(path) == _PACKAGE_DIR and not os.path.basename(path).startswith('test')
+
+
+def _chunk_counts(chunk):
+    """
+    Return how many entries and fields a chunk from an ``iter_chunks_*`` method holds.
+    """
+    if isinstance(chunk, StateColumns):
+        return len(chunk.usernames), sum(
+            sum(value is not None for value in values) for values in chunk.fields.values()
+        )
+    return len(chunk), sum(len(entry.state) for entry in chunk)
+
+
+def value_digest(value):
+    """
+    Return a short digest of a field value, so traces can show repeated writes without storing values.
+    """
+    encoded = json.dumps(value, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(encoded, digest_size=6).hexdigest()
+
+
+class TracingUserStateClient(XBlockUserStateClientWrapper):
+    """
+    Record the method, username, block keys, scope, fields, latency and caller of every call.
+
+    Each call is written as one compact JSON object per line, with the keys:
+
+    * ``t``: When the call started, in seconds since the epoch.
+    * ``m``: The method called.
+    * ``u``: The username, if the method takes one.
+    * ``k``: The block keys, or the block or course keys for ``iter_*`` and ``delete_all_*``, as strings.
+    * ``bt``: The ``block_type`` argument of ``iter_all_for_course*``, ``iter_chunks_for_course``
+      and ``delete_all_for_course``.
+    * ``o``: The ``order_by`` argument of ``iter_all_for_course_sorted``.
+    * ``up``: The ``username_prefix`` argument of ``iter_all_for_course_sorted``.
+    * ``at``: The ``timestamp`` argument of ``get_many_as_of``, in ISO 8601 format.
+    * ``cs``: The ``chunk_size`` argument of the ``iter_chunks_*`` methods.
+    * ``col``: Whether the ``iter_chunks_*`` methods were asked for columnar chunks, if they were.
+    * ``s``: The scope name.
+    * ``f``: The ``fields`` argument.
+    * ``ms``: How long the call took, in milliseconds. For methods returning an
+      iterator, this includes consuming it.
+    * ``n``: How many entries were returned, for reads, or loaded or deleted, for bulk writes.
+    * ``nf``: How many fields were returned, for reads. Missing values in columnar chunks aren't counted.
+    * ``w``: For writes, a dict mapping block keys to dicts mapping fields to :func:`value_digest`.
+    * ``th``: The id of the calling thread.
+    * ``st``: The innermost ``stack_depth`` caller frames outside this package, as ``file:line:function``.
+    * ``e``: The name of the exception raised, if any.
+
+    Arguments:
+        client (XBlockUserStateClient): The client to trace.
+        trace_file: A path to append the trace to, or a text file object to write it to.
+        stack_depth (int): How many caller frames to record.
+    """
+
+    def __init__(self, client, trace_file, stack_depth=3):
+        super().__init__(client)
+        self.stack_depth = stack_depth
+        self._owns_file = isinstance(trace_file, str)
+        self._file = open(trace_file, 'a', encoding='utf-8') if self._owns_file else trace_file  # pylint: disable=consider-using-with
+        self._lock = threading.Lock()
+
+    def close(self):
+        """
+        Close the trace file, if this client opened it.
+        """
+        if self._owns_file:
+            self._file.close()
+
+    def _caller(self):
+        frames = [
+            f'{frame.filename}:{frame.lineno}:{frame.name}'
+            for frame in reversed(traceback.extract_stack())
+            if not _is_library_frame(frame.filename)
+        ]
+        return frames[:self.stack_depth]
+
+    def _write(self, record):
+        line = json.dumps(record, separators=(',', ':'), default=str)
+        with self._lock:
+            self._file.write(line)
+            self._file.write('\n')
+            self._file.flush()
+
+    def _start(self, method, username=None, keys=None, scope=None, fields=None):
+        record = {'t': time.time(), 'm': method}
+        if username is not None:
+            record['u'] = username
+        if keys is not None:
+            record['k'] = [str(key) for key in keys]
+        if scope is not None:
+            record['s'] = scope.name
+        if fields is not None:
+            record['f'] = list(fields)
+        record['th'] = threading.get_ident()
+        record['st'] = self._caller()
+        return record, time.perf_counter()
+
+    def _finish(self, record, started, error=None):
+        record['ms'] = round((time.perf_counter() - started) * 1000, 3)
+        if error is not None:
+            record['e'] = type(error).__name__
+        self._write(record)
+
+    def _call(self, record, started, call):
+        try:
+            result = call()
+        except Exception as exception:
+            self._finish(record, started, exception)
+            raise
+        self._finish(record, started)
+        return result
+
+    def _traced_iter(self, record, started, make_iterator, chunked=False):
+        """
+        Yield from ``make_iterator()``, recording the call once the iterator is exhausted or closed.
+
+        If ``chunked``, the iterator yields chunks, whose entries are counted.
+        """
+        count = 0
+        field_count = 0
+        error = None
+        try:
+            for item in make_iterator():
+                if chunked:
+                    entries, fields = _chunk_counts(item)
+                    count += entries
+                    field_count += fields
+                else:
+                    count += 1
+                    if item.state is not None:
+                        field_count += len(item.state)
+                yield item
+        except Exception as exception:
+            error = exception
+            raise
+        finally:
+            record['n'] = count
+            record['nf'] = field_count
+            self._finish(record, started, error)
+
+    @staticmethod
+    def _digests(block_keys_to_state):
+        return {
+            str(key): {field: value_digest(value) for field, value in state.items()}
+            for key, state in block_keys_to_state.items()
+        }
+
+    def get(self, username, block_key, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        record, started = self._start('get', username, [block_key], scope, fields)
+        record['n'] = 0
+        try:
+            entry = self._client.get(username, block_key, scope, fields=fields)
+        except Exception as exception:
+            self._finish(record, started, exception)
+            raise
+        record['n'] = 1
+        record['nf'] = len(entry.state)
+        self._finish(record, started)
+        return entry
+
+    def get_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        block_keys = list(block_keys)
+        record, started = self._start('get_many', username, block_keys, scope, fields)
+        return self._traced_iter(
+            record, started, lambda: self._client.get_many(username, block_keys, scope, fields=fields)
+        )
+
+    def set(self, username, block_key, state, scope=None):
+        scope = resolve_scope(scope)
+        record, started = self._start('set', username, [block_key], scope)
+        record['w'] = self._digests({block_key: state})
+        return self._call(record, started, lambda: self._client.set(username, block_key, state, scope))
+
+    def set_many(self, username, block_keys_to_state, scope=None):
+        scope = resolve_scope(scope)
+        record, started = self._start('set_many', username, block_keys_to_state, scope)
+        record['w'] = self._digests(block_keys_to_state)
+        return self._call(record, started, lambda: self._client.set_many(username, block_keys_to_state, scope))
+
+    def set_many_if_unmodified(self, username, block_keys_to_state, expected_updated, scope=None):
+        scope = resolve_scope(scope)
+        record, started = self._start('set_many_if_unmodified', username, block_keys_to_state, scope)
+        record['w'] = self._digests(block_keys_to_state)
+        return self._call(record, started, lambda: self._client.set_many_if_unmodified(
+            username, block_keys_to_state, expected_updated, scope
+        ))
+
+    def delete(self, username, block_key, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        record, started = self._start('delete', username, [block_key], scope, fields)
+        return self._call(record, started, lambda: self._client.delete(username, block_key, scope, fields=fields))
+
+    def delete_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        block_keys = list(block_keys)
+        record, started = self._start('delete_many', username, block_keys, scope, fields)
+        return self._call(
+            record, started, lambda: self._client.delete_many(username, block_keys, scope, fields=fields)
+        )
+
+    def bulk_load(self, entries, batch_size=1000):
+        record, started = self._start('bulk_load')
+        return self._counted(record, started, lambda: self._client.bulk_load(entries, batch_size))
+
+    def _counted(self, record, started, call):
+        try:
+            count = call()
+        except Exception as exception:
+            self._finish(record, started, exception)
+            raise
+        record['n'] = count
+        self._finish(record, started)
+        return count
+
+    def delete_all_for_user(self, username, course_keys=None, scope=None, purge_history=False,
+                            batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        record, started = self._start('delete_all_for_user', username, course_keys, scope)
+        return self._counted(record, started, lambda: self._client.delete_all_for_user(
+            username, course_keys, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+        ))
+
+    def delete_all_for_block(self, block_key, scope=None, purge_history=False, batch_size=1000,
+                             progress=None):
+        scope = resolve_scope(scope)
+        record, started = self._start('delete_all_for_block', keys=[block_key], scope=scope)
+        return self._counted(record, started, lambda: self._client.delete_all_for_block(
+            block_key, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+        ))
+
+    def delete_all_for_course(self, course_key, block_type=None, scope=None, purge_history=False,
+                              batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        record, started = self._start('delete_all_for_course', keys=[course_key], scope=scope)
+        if block_type is not None:
+            record['bt'] = block_type
+        return self._counted(record, started, lambda: self._client.delete_all_for_course(
+            course_key, block_type, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+        ))
+
+    def get_history(self, username, block_key, scope=None):
+        scope = resolve_scope(scope)
+        record, started = self._start('get_history', username, [block_key], scope)
+        return self._traced_iter(record, started, lambda: self._client.get_history(username, block_key, scope))
+
+    def get_many_as_of(self, username, block_keys, timestamp, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        block_keys = list(block_keys)
+        record, started = self._start('get_many_as_of', username, block_keys, scope, fields)
+        record['at'] = timestamp.isoformat()
+        return self._traced_iter(record, started, lambda: self._client.get_many_as_of(
+            username, block_keys, timestamp, scope, fields=fields
+        ))
+
+    def iter_all_for_block(self, block_key, scope=None):
+        scope = resolve_scope(scope)
+        record, started = self._start('iter_all_for_block', keys=[block_key], scope=scope)
+        return self._traced_iter(record, started, lambda: self._client.iter_all_for_block(block_key, scope))
+
+    def iter_all_for_blocks(self, block_keys, scope=None):
+        scope = resolve_scope(scope)
+        block_keys = list(block_keys)
+        record, started = self._start('iter_all_for_blocks', keys=block_keys, scope=scope)
+        return self._traced_iter(record, started, lambda: self._client.iter_all_for_blocks(block_keys, scope))
+
+    def iter_all_for_course(self, course_key, block_type=None, scope=None):
+        scope = resolve_scope(scope)
+        record, started = self._start('iter_all_for_course', keys=[course_key], scope=scope)
+        if block_type is not None:
+            record['bt'] = block_type
+        return self._traced_iter(
+            record, started, lambda: self._client.iter_all_for_course(course_key, block_type, scope)
+        )
+
+    def _start_chunks(self, method, keys, scope, chunk_size, columnar, fields):
+        check_chunk_size(chunk_size)
+        record, started = self._start(method, keys=keys, scope=scope, fields=fields)
+        record['cs'] = chunk_size
+        if columnar:
+            record['col'] = True
+        return record, started
+
+    def iter_chunks_for_blocks(self, block_keys, scope=None, chunk_size=1000, columnar=False,
+                               fields=None):
+        scope = resolve_scope(scope)
+        block_keys = list(block_keys)
+        record, started = self._start_chunks('iter_chunks_for_blocks', block_keys, scope, chunk_size, columnar, fields)
+        return self._traced_iter(record, started, lambda: self._client.iter_chunks_for_blocks(
+            block_keys, scope, chunk_size=chunk_size, columnar=columnar, fields=fields
+        ), chunked=True)
+
+    def iter_chunks_for_course(self, course_key, block_type=None, scope=None, chunk_size=1000,
+                               columnar=False, fields=None):
+        scope = resolve_scope(scope)
+        record, started = self._start_chunks(
+            'iter_chunks_for_course', [course_key], scope, chunk_size, columnar, fields
+        )
+        if block_type is not None:
+            record['bt'] = block_type
+        return self._traced_iter(record, started, lambda: self._client.iter_chunks_for_course(
+            course_key, block_type, scope, chunk_size=chunk_size, columnar=columnar, fields=fields
+        ), chunked=True)
+
+    def iter_all_for_course_sorted(self, course_key, block_type=None, scope=None,
+                                   order_by=ORDER_BY_USERNAME, username_prefix=None):
+        scope = resolve_scope(scope)
+        record, started = self._start('iter_all_for_course_sorted', keys=[course_key], scope=scope)
+        if block_type is not None:
+            record['bt'] = block_type
+        record['o'] = order_by
+        if username_prefix is not None:
+            record['up'] = username_prefix
+        return self._traced_iter(record, started, lambda: self._client.iter_all_for_course_sorted(
+            course_key, block_type, scope, order_by=order_by, username_prefix=username_prefix
+        ))
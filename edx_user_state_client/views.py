@@ -0,0 +1,380 @@
+"""
+Materialized per-(course, user) summaries of chosen fields, kept up to date by an
+XBlockUserStateClient wrapper, for gradebook and progress-page reads.
+"""
+
+import copy
+import threading
+
+from edx_user_state_client.interface import resolve_scope
+from edx_user_state_client.wrapper import XBlockUserStateClientWrapper
+
+
+class MaterializedView():
+    """
+    A summary of some fields of the blocks in each course, for each user.
+
+    Arguments:
+        name (str): The name to look the view up by.
+        fields: The field names to keep.
+        block_type (str): Only keep blocks of this type, or None for every block type.
+        scope (Scope): The scope of the state summarized.
+    """
+
+    def __init__(self, name, fields, block_type=None, scope=None):
+        scope = resolve_scope(scope)
+        self.name = name
+        self.fields = frozenset(fields)
+        self.block_type = block_type
+        self.scope = scope
+        # Maps the keys of courses that have been built to dicts mapping usernames
+        # to dicts mapping block keys to the view's fields.
+        self._courses = {}
+
+    def covers(self, block_key, scope):
+        """
+        Return the course key of ``block_key`` if this view summarizes it, or else None.
+        """
+        if scope != self.scope:
+            return None
+        if self.block_type is not None and getattr(block_key, 'block_type', None) != self.block_type:
+            return None
+        return getattr(block_key, 'course_key', None)
+
+    def is_built(self, course_key):
+        """
+        Return whether ``course_key`` has been read into this view.
+        """
+        return course_key in self._courses
+
+    def built_courses(self):
+        """
+        Return the keys of the courses that have been read into this view.
+        """
+        return list(self._courses)
+
+    def read(self, client, course_key):
+        """
+        Read the view's fields for every user in ``course_key`` from ``client``, without keeping them.
+
+        Returns:
+            dict: Maps usernames to dicts mapping block keys to the view's fields, for :meth:`install`.
+        """
+        users = {}
+        for entry in client.iter_all_for_course(course_key, self.block_type, self.scope):
+            summary = {field: value for field, value in entry.state.items() if field in self.fields}
+            if summary:
+                users.setdefault(entry.username, {})[entry.block_key] = summary
+        return users
+
+    def install(self, course_key, users):
+        """
+        Keep ``users``, as returned by :meth:`read`, as the view of ``course_key``.
+        """
+        self._courses[course_key] = users
+
+    def build(self, client, course_key):
+        """
+        Read the view's fields for every user in ``course_key`` from ``client``.
+        """
+        self.install(course_key, self.read(client, course_key))
+
+    def forget(self, course_key):
+        """
+        Drop ``course_key``, so that it is read again on next use.
+        """
+        self._courses.pop(course_key, None)
+
+    def apply_set(self, username, block_key, course_key, state):
+        """
+        Merge the view's fields from a write of ``state`` to ``block_key``.
+        """
+        if course_key not in self._courses:
+            return
+        summary = {field: value for field, value in state.items() if field in self.fields}
+        if summary:
+            self._courses[course_key].setdefault(username, {}).setdefault(block_key, {}).update(summary)
+
+    def apply_delete(self, username, block_key, course_key, fields):
+        """
+        Remove ``fields`` (or all fields, if None) of ``block_key`` from the view.
+        """
+        blocks = self._courses.get(course_key, {}).get(username)
+        if not blocks or block_key not in blocks:
+            return
+        if fields is None:
+            del blocks[block_key]
+        else:
+            for field in fields:
+                blocks[block_key].pop(field, None)
+            if not blocks[block_key]:
+                del blocks[block_key]
+        if not blocks:
+            del self._courses[course_key][username]
+
+    def drop_user(self, username, course_keys=None):
+        """
+        Remove ``username`` from the built courses in ``course_keys``, or from every built course.
+        """
+        for course_key in self.built_courses() if course_keys is None else course_keys:
+            self._courses.get(course_key, {}).pop(username, None)
+
+    def drop_block(self, block_key, course_key):
+        """
+        Remove ``block_key`` from every user's summary in ``course_key``.
+        """
+        users = self._courses.get(course_key, {})
+        for username in list(users):
+            users[username].pop(block_key, None)
+            if not users[username]:
+                del users[username]
+
+    def summary(self, course_key, username):
+        """
+        Return a dict mapping the block keys of ``username``'s blocks in ``course_key`` to the view's fields.
+        """
+        return copy.deepcopy(self._courses[course_key].get(username, {}))
+
+    def course(self, course_key):
+        """
+        Return a dict mapping usernames to the :meth:`summary` for each user in ``course_key``.
+        """
+        return copy.deepcopy(self._courses[course_key])
+
+
+class MaterializedViewUserStateClient(XBlockUserStateClientWrapper):
+    """
+    Keep :class:`MaterializedView` summaries up to date with writes made through this client.
+
+    A course is read into a view with one ``iter_all_for_course`` the first time it is
+    asked for. After that, ``set_many``, ``set_many_if_unmodified`` and ``delete_many``
+    update the view in place, so a progress page makes one :meth:`summary` lookup rather
+    than reading the full state of every block. If a write raises, the courses it
+    touched are dropped from the views and read again on next use. ``bulk_load`` and
+    ``delete_all_for_course`` do the same for every course they touch, while
+    ``delete_all_for_user`` and ``delete_all_for_block`` remove the deleted state from
+    the views in place.
+
+    Views are updated after the wrapped client's write returns. Courses are read
+    without holding the lock that writes update the views under; the updates made
+    while a course is being read are replayed over it before it is kept, so a write
+    is never lost from a view. Writes that raise one of the errors that mean nothing
+    was written (``VersionConflict``, ``QuotaExceeded`` and ``PermissionDenied``)
+    leave the views alone. Writes made directly against the wrapped client are not
+    seen, so every writer should go through this client. Two concurrent writes to the
+    same field of the same user's block may reach the view in the opposite order to
+    the store.
+
+    Arguments:
+        client (XBlockUserStateClient): The client to read from and write to.
+        views: The :class:`MaterializedView` instances to maintain.
+    """
+
+    def __init__(self, client, views):
+        super().__init__(client)
+        self._views = {view.name: view for view in views}
+        self._lock = threading.Lock()
+        # Maps (view name, course key) to a list of the update lists of the reads of that
+        # course in progress. Every update to the course is appended to each.
+        self._building = {}
+
+    def view(self, name):
+        """
+        Return the :class:`MaterializedView` called ``name``.
+        """
+        return self._views[name]
+
+    def _read_view(self, name, course_key, read):
+        """
+        Return ``read(view)`` for the view called ``name``, under the lock, building ``course_key`` first if needed.
+        """
+        view = self._views[name]
+        with self._lock:
+            if view.is_built(course_key):
+                return read(view)
+            updates = []
+            self._building.setdefault((name, course_key), []).append(updates)
+        try:
+            users = view.read(self._client, course_key)
+        except Exception:
+            with self._lock:
+                self._stop_building(name, course_key, updates)
+            raise
+        with self._lock:
+            self._stop_building(name, course_key, updates)
+            if not view.is_built(course_key):
+                view.install(course_key, users)
+                for update in updates:
+                    update(view)
+            if not view.is_built(course_key):
+                # An update forgot the course while it was being read; read it again.
+                return self._read_view(name, course_key, read)
+            return read(view)
+
+    def _stop_building(self, name, course_key, updates):
+        """
+        Stop collecting ``updates`` for a read of ``course_key``. Call with the lock held.
+        """
+        builds = self._building[(name, course_key)]
+        builds.remove(updates)
+        if not builds:
+            del self._building[(name, course_key)]
+
+    def summary(self, name, course_key, username):
+        """
+        Return ``username``'s summary in ``course_key`` from the view called ``name``.
+
+        Returns:
+            dict: Maps block keys to dicts of the view's fields.
+        """
+        return self._read_view(name, course_key, lambda view: view.summary(course_key, username))
+
+    def course_summaries(self, name, course_key):
+        """
+        Return every user's summary in ``course_key`` from the view called ``name``.
+
+        Returns:
+            dict: Maps usernames to dicts mapping block keys to dicts of the view's fields.
+        """
+        return self._read_view(name, course_key, lambda view: view.course(course_key))
+
+    def _update(self, view, course_key, update):
+        """
+        Call ``update(view)`` now, and again over each read of ``course_key`` in progress. Call with the lock held.
+        """
+        update(view)
+        for updates in self._building.get((view.name, course_key), ()):
+            updates.append(update)
+
+    def _courses(self, view, course_keys=None):
+        """
+        Return ``course_keys``, or else the courses that ``view`` has built or is reading.
+        """
+        if course_keys is not None:
+            return course_keys
+        return view.built_courses() + [course_key for name, course_key in self._building if name == view.name]
+
+    def _forget(self, block_keys, scope):
+        for view in self._views.values():
+            for block_key in block_keys:
+                course_key = view.covers(block_key, scope)
+                if course_key is not None:
+                    self._update(view, course_key, lambda view, course_key=course_key: view.forget(course_key))
+
+    def _write(self, write, block_keys, scope, apply):
+        """
+        Call ``write()``, then ``apply(view, block_key, course_key)`` for every view covering one of ``block_keys``.
+        """
+        try:
+            result = write()
+        except (self.VersionConflict, self.QuotaExceeded, self.PermissionDenied):
+            raise
+        except Exception:
+            with self._lock:
+                self._forget(block_keys, scope)
+            raise
+        with self._lock:
+            for view in self._views.values():
+                for block_key in block_keys:
+                    course_key = view.covers(block_key, scope)
+                    if course_key is not None:
+                        self._update(
+                            view,
+                            course_key,
+                            lambda view, block_key=block_key, course_key=course_key: apply(view, block_key, course_key),
+                        )
+            return result
+
+    def set_many(self, username, block_keys_to_state, scope=None):
+        scope = resolve_scope(scope)
+        return self._write(
+            lambda: self._client.set_many(username, block_keys_to_state, scope),
+            list(block_keys_to_state),
+            scope,
+            lambda view, block_key, course_key: view.apply_set(
+                username, block_key, course_key, block_keys_to_state[block_key]
+            ),
+        )
+
+    def set_many_if_unmodified(self, username, block_keys_to_state, expected_updated, scope=None):
+        scope = resolve_scope(scope)
+        return self._write(
+            lambda: self._client.set_many_if_unmodified(username, block_keys_to_state, expected_updated, scope),
+            list(block_keys_to_state),
+            scope,
+            lambda view, block_key, course_key: view.apply_set(
+                username, block_key, course_key, block_keys_to_state[block_key]
+            ),
+        )
+
+    def delete_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        block_keys = list(block_keys)
+        return self._write(
+            lambda: self._client.delete_many(username, block_keys, scope, fields=fields),
+            block_keys,
+            scope,
+            lambda view, block_key, course_key: view.apply_delete(username, block_key, course_key, fields),
+        )
+
+    def bulk_load(self, entries, batch_size=1000):
+        loaded = set()
+
+        def noting_keys():
+            for entry in entries:
+                loaded.add((entry.block_key, entry.scope))
+                yield entry
+
+        try:
+            return self._client.bulk_load(noting_keys(), batch_size)
+        finally:
+            with self._lock:
+                for block_key, scope in loaded:
+                    self._forget([block_key], scope)
+
+    def delete_all_for_user(self, username, course_keys=None, scope=None, purge_history=False,
+                            batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        views = [view for view in self._views.values() if view.scope == scope]
+        try:
+            result = super().delete_all_for_user(username, course_keys, scope, purge_history, batch_size, progress)
+        except Exception:
+            with self._lock:
+                for view in views:
+                    for course_key in self._courses(view, course_keys):
+                        self._update(view, course_key, lambda view, course_key=course_key: view.forget(course_key))
+            raise
+        with self._lock:
+            for view in views:
+                for course_key in self._courses(view, course_keys):
+                    self._update(
+                        view, course_key, lambda view, course_key=course_key: view.drop_user(username, [course_key])
+                    )
+        return result
+
+    def delete_all_for_block(self, block_key, scope=None, purge_history=False, batch_size=1000,
+                             progress=None):
+        scope = resolve_scope(scope)
+        try:
+            result = super().delete_all_for_block(block_key, scope, purge_history, batch_size, progress)
+        except Exception:
+            with self._lock:
+                self._forget([block_key], scope)
+            raise
+        with self._lock:
+            for view in self._views.values():
+                course_key = view.covers(block_key, scope)
+                if course_key is not None:
+                    self._update(view, course_key, lambda view, course_key=course_key: view.drop_block(block_key, course_key))
+        return result
+
+    def delete_all_for_course(self, course_key, block_type=None, scope=None, purge_history=False,
+                              batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        try:
+            return super().delete_all_for_course(course_key, block_type, scope, purge_history, batch_size, progress)
+        finally:
+            with self._lock:
+                for view in self._views.values():
+                    if view.scope == scope:
+                        self._update(view, course_key, lambda view: view.forget(course_key))
@@ -0,0 +1,133 @@
+"""
+A baseclass for XBlockUserStateClient implementations that add behaviour in front of
+another XBlockUserStateClient.
+"""
+
+from edx_user_state_client.interface import XBlockUserStateClient, resolve_scope
+from edx_user_state_client.ordering import ORDER_BY_USERNAME
+
+
+class XBlockUserStateClientWrapper(XBlockUserStateClient):
+    """
+    An XBlockUserStateClient that forwards every call to a wrapped client.
+
+    Subclasses override only the methods whose behaviour they change.
+
+    Arguments:
+        client (XBlockUserStateClient): The client to forward calls to.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    @property
+    def wrapped_client(self):
+        """
+        The XBlockUserStateClient that this wrapper forwards calls to.
+        """
+        return self._client
+
+    def get_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        return self._client.get_many(username, block_keys, scope, fields=fields)
+
+    def set_many(self, username, block_keys_to_state, scope=None):
+        scope = resolve_scope(scope)
+        return self._client.set_many(username, block_keys_to_state, scope)
+
+    def set_many_if_unmodified(self, username, block_keys_to_state, expected_updated, scope=None):
+        scope = resolve_scope(scope)
+        return self._client.set_many_if_unmodified(username, block_keys_to_state, expected_updated, scope)
+
+    def delete_many(self, username, block_keys, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        return self._client.delete_many(username, block_keys, scope, fields=fields)
+
+    def bulk_load(self, entries, batch_size=1000):
+        return self._client.bulk_load(entries, batch_size)
+
+    def delete_all_for_user(self, username, course_keys=None, scope=None, purge_history=False,
+                            batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        return self._client.delete_all_for_user(
+            username, course_keys, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+        )
+
+    def delete_all_for_block(self, block_key, scope=None, purge_history=False, batch_size=1000,
+                             progress=None):
+        scope = resolve_scope(scope)
+        return self._client.delete_all_for_block(
+            block_key, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+        )
+
+    def delete_all_for_course(self, course_key, block_type=None, scope=None, purge_history=False,
+                              batch_size=1000, progress=None):
+        scope = resolve_scope(scope)
+        return self._client.delete_all_for_course(
+            course_key, block_type, scope, purge_history=purge_history, batch_size=batch_size, progress=progress
+        )
+
+    def snapshot(self):
+        """
+        Return a snapshot of the wrapped client. Reads from it don't go through this
+        wrapper, so wrappers that change what is read should override this.
+        """
+        return self._client.snapshot()
+
+    def get_history(self, username, block_key, scope=None):
+        scope = resolve_scope(scope)
+        return self._client.get_history(username, block_key, scope)
+
+    def get_many_as_of(self, username, block_keys, timestamp, scope=None, fields=None):
+        scope = resolve_scope(scope)
+        return self._client.get_many_as_of(username, block_keys, timestamp, scope, fields=fields)
+
+    def iter_all_for_block(self, block_key, scope=None):
+        scope = resolve_scope(scope)
+        return self._client.iter_all_for_block(block_key, scope)
+
+    def iter_all_for_blocks(self, block_keys, scope=None):
+        scope = resolve_scope(scope)
+        return self._client.iter_all_for_blocks(block_keys, scope)
+
+    def iter_chunks_for_blocks(self, block_keys, scope=None, chunk_size=1000, columnar=False,
+                               fields=None):
+        scope = resolve_scope(scope)
+        return self._client.iter_chunks_for_blocks(
+            block_keys, scope, chunk_size=chunk_size, columnar=columnar, fields=fields
+        )
+
+    def iter_all_for_course(self, course_key, block_type=None, scope=None):
+        scope = resolve_scope(scope)
+        return self._client.iter_all_for_course(course_key, block_type, scope)
+
+    def iter_chunks_for_course(self, course_key, block_type=None, scope=None, chunk_size=1000,
+                               columnar=False, fields=None):
+        scope = resolve_scope(scope)
+        return self._client.iter_chunks_for_course(
+            course_key, block_type, scope, chunk_size=chunk_size, columnar=columnar, fields=fields
+        )
+
+    def iter_all_for_course_sorted(self, course_key, block_type=None, scope=None,
+                                   order_by=ORDER_BY_USERNAME, username_prefix=None):
+        scope = resolve_scope(scope)
+        return self._client.iter_all_for_course_sorted(
+            course_key, block_type, scope, order_by=order_by, username_prefix=username_prefix
+        )
+
+
+def project_state(entry, fields):
+    """
+    Return ``entry`` with its state restricted to ``fields``.
+
+    Arguments:
+        entry (XBlockUserState): The full stored state of a block.
+        fields: A list of field names to keep. If None, keep all fields.
+    """
+    if fields is None:
+        return entry._replace(state=dict(entry.state))
+    return entry._replace(state={
+        field: entry.state[field]
+        for field in fields
+        if field in entry.state
+    })